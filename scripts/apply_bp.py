@@ -26,6 +26,7 @@ o.add_option('-l', '--linearization', dest='linearization', default='comb',
     help='Apply the specified quantization linearization function to raw correlator values before applying bandpass.  Options are null, digi, full, and comb.  Default is comb')
 o.add_option('-s', '--scale', dest='scale', type='float', default=12250000.,
     help='An additional numerical scaling to apply to the data.  Default: 12250000.')
+a.scripting.add_standard_options(o, nproc=True)
 opts, args = o.parse_args(sys.argv[1:])
 
 # Digital Gain, Power Output (Channel 1024+512)
@@ -138,12 +139,11 @@ print 'Using %s quantization correction' % opts.linearization
 ignore_vars = ['bandpass', 'freqs', 'ngains', 'nspect0', 
     'nchan0', 'ntau', 'nfeeds', 'nsols', 'header', 'vartable']
 
-# Process all files passed from the command line.
-for filename in args:
+def process(filename):
     print filename,'->',filename+'b'
     if os.path.exists(filename+'b'):
         print 'File exists: skipping'
-        continue
+        return
     uvi = a.miriad.UV(filename)
     uvo = a.miriad.UV(filename+'b', status='new')
     uvo.init_from_uv(uvi, exclude=ignore_vars)
@@ -158,11 +158,15 @@ for filename in args:
         print 'No bandpass found'
         bp = n.ones((nants, nchan))
         print '.'
-    def f(uv, preamble, data, flags):
-        uvw, t, (i,j) = preamble
-        if i == j: data = n.polyval(cpoly, data)
-        data *= bp[i,:] * bp[j,:] * opts.scale
-        return preamble, data, flags
-    uvo.pipe(uvi, mfunc=f, raw=True,
+    def f(uv, preambles, data, flags):
+        i, j = a.miriad.bl2ij(preambles[:,4])
+        auto = n.where(i == j)[0]
+        data[auto] = n.polyval(cpoly, data[auto])
+        data *= bp[i] * bp[j] * opts.scale
+        return preambles, data, flags
+    uvo.pipe_batched(uvi, f,
         append2hist='APPLY_BP: ver=%s, corr type=%s, scale=%f\n' % \
             (__version__, opts.linearization, opts.scale))
+
+# Process all files passed from the command line.
+a.scripting.process_files(process, args, nproc=opts.nproc)
@@ -8,7 +8,7 @@ import numpy as np
 import optparse,sys,os
 
 o = optparse.OptionParser()
-a.scripting.add_standard_options(o,cal=True)
+a.scripting.add_standard_options(o,cal=True,nproc=True)
 opts,args = o.parse_args(sys.argv[1:])
 
 uv = a.miriad.UV(args[0])
@@ -27,14 +27,16 @@ def mfunc(uv,p,d):
     d_fix = d * G_ij * E_ij
     return p,d_fix
 
-for infile in args:
+def process(infile):
     outfile = infile+'C'
     print infile,'-->',outfile
     if os.path.exists(outfile):
         print 'File exists, skipping....'
-        continue 
+        return
 
     uvi = a.miriad.UV(infile)
     uvo = a.miriad.UV(outfile,status='new')
     uvo.init_from_uv(uvi)
     uvo.pipe(uvi,mfunc,append2hist='APPLY_CAL: Applied calibration information from %s' % opts.cal)
+
+a.scripting.process_files(process,args,nproc=opts.nproc)
@@ -22,10 +22,14 @@ o.add_option('-d', '--dont_flag', dest='dont_flag', action='store_true',
     help='Only flag resultant bin if every component bin is flagged (otherwise, uses any data available).')
 o.add_option('-u', '--unify', dest='unify', action='store_true',
     help='Output to a single UV file.')
+a.scripting.add_standard_options(o, nproc=True)
 opts, args = o.parse_args(sys.argv[1:])
+if opts.unify and opts.nproc > 1:
+    o.error('--unify writes a single file, so files cannot be processed in parallel.')
 
 uvo = None
-for uvfile in args:
+def process(uvfile):
+    global uvo
     print uvfile,'->',uvfile+'m'
     uvi = a.miriad.UV(uvfile)
     sfreq,sdf,nchan = uvi['sfreq'], uvi['sdf'], uvi['nchan']
@@ -36,7 +40,7 @@ for uvfile in args:
         uvofile = uvfile+'m'
         if os.path.exists(uvofile):
             print uvofile, 'exists, skipping.'
-            continue
+            return
         uvo = a.miriad.UV(uvofile, status='new')
         if nchan != opts.nchan:
             uvo.init_from_uv(uvi, override={'nchan':opts.nchan, 
@@ -66,4 +70,5 @@ for uvfile in args:
     if not opts.unify:
         del(uvo)
         uvo = None
-    
+
+a.scripting.process_files(process, args, nproc=opts.nproc)
@@ -6,6 +6,7 @@ here is a steepest-decent filter and does not make use of priors.
 """
 
 import aipy as a, numpy as n, sys, os, optparse
+import hashlib, shutil
 
 o = optparse.OptionParser()
 o.set_usage('fitmdl.py [options] *.uv')
@@ -19,9 +20,13 @@ o.add_option('--snap', dest='snap', action='store_true',
 o.add_option('-q', '--quiet', dest='quiet', action='store_true',
     help='Be less verbose.')
 o.add_option('--maxiter', dest='maxiter', type='float', default=-1,
-    help='Maximum # of iterations to run.  Default is infinite.')
+    help='Maximum # of function evaluations of the downhill simplex, or of iterations with --grad (each of which may evaluate the score several times).  Default is infinite.')
 o.add_option('--xtol', dest='xtol', type='float', default=1e-10,
     help='Fractional change sought in it parameters before convergence.  Default 1e-10.')
+o.add_option('--grad', dest='grad', action='store_true',
+    help='Minimize with BFGS using analytic parameter gradients instead of the downhill simplex.  Not available in daemon/master modes.')
+o.add_option('--gtol', dest='gtol', type='float', default=1e-5,
+    help='Gradient norm sought before convergence with --grad.  Default 1e-5.')
 o.add_option('--ftol', dest='ftol', type='float', default=1e-10,
     help='Fractional tolerance sought in score before convergence.  Default 1e-10.')
 o.add_option('--remem', dest='remember', action='store_true',
@@ -34,9 +39,17 @@ o.add_option('--master', dest='master',
     help='Operate in master mode, employing daemon-mode servers to do the work and collecting the results.  Should be a comma delimited list of host:daemonid pairs to contact.  Daemon ID will be added to baseport to determine actual port used for TCP transactions.')
 o.add_option('--sim_autos', dest='sim_autos', action='store_true',
     help='Use auto-correlations in fitting.  Default is to use only cross-correlations.')
+o.add_option('--memo', dest='memo', action='store_true',
+    help='Memoize source and array geometry for each integration between iterations of the fit.  Uses more memory, but avoids recomputing positions that have not changed.')
+o.add_option('--nproc', dest='nproc', type='int', default=1,
+    help='Number of local worker processes among which the cached data are divided.  Default 1.')
+o.add_option('--cachedir', dest='cachedir',
+    help='Directory in which to keep memory-mapped caches of the selected data.  A later run with the same files and selection maps the cache instead of rereading the files.')
 o.add_option('--minuv',dest='minuv',default=20.,type='float',help='Minimum baseline lenght to consider')
 
 opts, args = o.parse_args(sys.argv[1:])
+if opts.grad and (opts.daemon or opts.master):
+    o.error('--grad is not available in daemon/master modes')
 
 # Parse command-line options
 uv = a.miriad.UV(args[0])
@@ -88,10 +101,9 @@ dbuf = None
 
 def uvlen(A): return n.sqrt(n.dot(A,A))
 
-# The function to be optimized
-def fit_func(prms, filelist, decimate, decphs):
-    global first_fit, dbuf
-    if first_fit == 0: return 0
+def set_prms(prms):
+    """Apply a flattened parameter vector to aa and cat, propagating shared
+    parameters.  Returns the parameter dictionary."""
     prms = a.fit.reconstruct_prms(prms, key_list)
     # Propagate shared params
     for (skey,sprm) in shkeys:
@@ -100,66 +112,189 @@ def fit_func(prms, filelist, decimate, decphs):
             if not prms.has_key(k2): prms[k2] = {}
             for sp in sprm:
                 prms[k2][sp] = prms[k][sp]
-    if not opts.quiet: a.fit.print_params(prms)
-    print prms
     aa.set_params(prms)
     cat.set_params(prms)
+    return prms
+
+def grad_keys():
+    """Return key_list with shared parameters also indexed under every 
+    object that shares them, for use with sim_grad()."""
+    keys = {}
+    for k in key_list: keys[k] = key_list[k].copy()
+    for (skey,sprm) in shkeys:
+        for k2 in skey[1:]:
+            if not keys.has_key(k2): keys[k2] = {}
+            for sp in sprm: keys[k2][sp] = key_list[skey[0]][sp]
+    return keys
+
+def calc_score(tinds):
+    """Return the summed squared residual and # of samples over the cached
+    data for the listed time indices, along with the gradient of the 
+    residual with respect to the parameters if opts.grad is set."""
     a1,a2,th = cat.get('srcshape')
-    score,nsamples = 0.,0.
+    score,nsamples,dscore = 0.,0.,None
+    if opts.grad: dscore, gkeys = n.zeros(len(prm_list)), grad_keys()
+    bls, pols = dbuf['bls'], list(dbuf['pols'])
+    for ti in tinds:
+        aa.set_jultime(dbuf['times'][ti])
+        cat.compute(aa)
+        eqs = cat.get_crds('eq', ncrd=3)
+        flx = cat.get_jys()
+        dra,ddec = cat.get('ionref')
+        aa.sim_cache(eqs, flx, mfreqs=mfq, 
+            ionrefs=(dra,ddec), srcshapes=(a1,a2,th))
+        sim_d = aa.sim_all(bls, pols=pols)
+        res = n.where(dbuf['flags'][ti], 0, dbuf['data'][ti] - sim_d)
+        score += (n.abs(res)**2).sum()
+        nsamples += dbuf['nsamp'][ti].sum()
+        if not opts.grad: continue
+        for bi,(bl,pol) in enumerate(zip(bls,pols)):
+            i,j = a.miriad.bl2ij(bl)
+            dsim = aa.sim_grad(i, j, cat, gkeys, pol=pol)
+            dscore -= 2 * (n.conjugate(res[bi]) * dsim).real.sum(axis=1)
+    return score, nsamples, dscore
+
+def cache_name(filelist, decimate, decphs):
+    """Return a name for the data cache that changes with the input files,
+    the cal file (whose antenna positions select baselines by --minuv), and
+    any option affecting which data are selected."""
+    key = [opts.ant, opts.pol, opts.cal, opts.sim_autos, opts.minuv,
+        decimate, decphs, list(chans)]
+    calfile = os.path.abspath(sys.modules[opts.cal].__file__)
+    if calfile[-4:] in ('.pyc','.pyo') and os.path.exists(calfile[:-1]):
+        calfile = calfile[:-1]
+    key.append((calfile, hashlib.md5(open(calfile,'rb').read()).hexdigest()))
+    for uvfile in filelist:
+        uvfile = os.path.abspath(uvfile)
+        st = os.stat(os.path.join(uvfile, 'visdata'))
+        key.append((uvfile, st.st_size, st.st_mtime))
+    return 'fitmdl_' + hashlib.md5(repr(key)).hexdigest()
+
+def read_dbuf(filelist, decimate, decphs):
+    """Read the selected data into contiguous (time,baseline,chan) arrays.
+    The baseline axis runs over (baseline,pol) pairs; a pair missing at
+    some time is fully flagged there."""
+    recs, times, blpols = {}, {}, {}
+    for uvfile in filelist:
+        sys.stdout.write('.') ; sys.stdout.flush()
+        uv = a.miriad.UV(uvfile)
+        a.scripting.uv_selector(uv, opts.ant, opts.pol)
+        uv.select('decimate', decimate, decphs)
+        for (uvw,t,(i,j)),d,f in uv.all(raw=True):
+            if not opts.sim_autos and i == j: continue
+            if uvlen(aa.get_baseline(i,j))*0.15 <= opts.minuv: continue
+            blpol = (a.miriad.ij2bl(i,j), a.miriad.pol2str[uv['pol']])
+            times[t] = blpols[blpol] = None
+            recs[(t,blpol)] = (d.take(chans), f.take(chans))
+        del(uv)
+    times, blpols = sorted(times.keys()), sorted(blpols.keys())
+    shape = (len(times), len(blpols), len(chans))
+    data = n.zeros(shape, dtype=n.complex64)
+    flags = n.ones(shape, dtype=n.bool)
+    for ti,t in enumerate(times):
+        for bi,blpol in enumerate(blpols):
+            try: data[ti,bi], flags[ti,bi] = recs.pop((t,blpol))
+            except(KeyError): pass
+    nsamp = n.where(flags, 0, n.abs(data)**2).sum(axis=-1)
+    return {'times':n.array(times), 'data':data, 'flags':flags, 
+        'nsamp':nsamp, 'bls':n.array([b for b,p in blpols], dtype=n.int),
+        'pols':n.array([p for b,p in blpols])}
+
+def load_dbuf(filelist, decimate, decphs):
+    """Return the cached data arrays, memory-mapping them from
+    opts.cachedir when possible, and (re)writing that cache otherwise."""
+    if opts.cachedir is None: return read_dbuf(filelist, decimate, decphs)
+    path = os.path.join(opts.cachedir, cache_name(filelist,decimate,decphs))
+    if not os.path.exists(path):
+        buf = read_dbuf(filelist, decimate, decphs)
+        tmp = path + '.%d' % os.getpid()
+        os.makedirs(tmp)
+        for k in buf: n.save(os.path.join(tmp, k+'.npy'), buf[k])
+        try: os.rename(tmp, path)
+        except(OSError):
+            # Another run wrote the same cache first; use theirs
+            if not os.path.exists(path): raise
+            shutil.rmtree(tmp)
+    elif not opts.quiet: print 'Mapping', path
+    buf = {}
+    for k in ('times','data','flags','nsamp','bls','pols'):
+        buf[k] = n.load(os.path.join(path, k+'.npy'), mmap_mode='r')
+    return buf
+
+# Persistent worker processes for --nproc, each holding a share of dbuf
+workers = []
+
+def fit_worker(conn, tinds):
+    """Serve parameter vectors sent over conn, replying with the
+    (score,nsamples) of this worker's share of the cached data."""
+    while True:
+        prms = conn.recv()
+        if prms is None: break
+        set_prms(prms)
+        conn.send(calc_score(tinds))
+
+def start_workers():
+    """(Re)start opts.nproc workers, dividing the cached times among them."""
+    import multiprocessing
+    stop_workers()
+    tinds = n.arange(dbuf['times'].size)
+    for cnt in range(opts.nproc):
+        conn, child_conn = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=fit_worker,
+            args=(child_conn, tinds[cnt::opts.nproc]))
+        p.daemon = True
+        p.start()
+        workers.append((p, conn))
+
+def stop_workers():
+    while workers:
+        p, conn = workers.pop()
+        conn.send(None)
+        p.join()
+
+# The function to be optimized
+def fit_func(prms, filelist, decimate, decphs):
+    global first_fit, dbuf, last_grad
+    if first_fit == 0: return 0
+    flat_prms = prms
+    prms = set_prms(prms)
+    if not opts.quiet: a.fit.print_params(prms)
+    print prms
     # Cache data from file to avoid hitting disk excessively
     if dbuf is None:
         if not opts.quiet: print 'Caching data...'
-        dbuf = {}
-        for uvfile in filelist:
-            sys.stdout.write('.') ; sys.stdout.flush()
-            uv = a.miriad.UV(uvfile)
-            a.scripting.uv_selector(uv, opts.ant, opts.pol)
-            uv.select('decimate', decimate, decphs)
-            for (uvw,t,(i,j)),d,f in uv.all(raw=True):
-                if not dbuf.has_key(t): dbuf[t] = {}
-                if not opts.sim_autos and i == j: continue
-                if uvlen(aa.get_baseline(i,j))*0.15 <= opts.minuv: continue
-                bl = a.miriad.ij2bl(i,j)
-                d = d.take(chans)
-                f = f.take(chans)
-                dbuf[t][bl] = (d, f, 
-                        n.where(f, 0, n.abs(d)**2).sum(),
-                        a.miriad.pol2str[uv['pol']])
+        dbuf = load_dbuf(filelist, decimate, decphs)
+        if opts.memo:
+            aa.set_memo(2 * dbuf['times'].size)
+            cat.set_memo(2 * dbuf['times'].size * len(cat))
         if not opts.quiet:
-            samp, vsamp, wgts = 0, 0, 0.
-            for t in dbuf:
-              for bl in dbuf[t]:
-                samp += len(dbuf[t][bl][1])
-                vsamp += n.logical_not(dbuf[t][bl][1]).astype(n.int).sum()
-                wgts += dbuf[t][bl][2]
+            samp = dbuf['flags'].size
+            vsamp = n.logical_not(dbuf['flags']).astype(n.int).sum()
+            wgts = dbuf['nsamp'].sum()
             print 'Cache summary:'
             print '   %d samples' % samp
             print '   %d valid' % vsamp
             print '   %f sum weights' %  wgts
             sys.stdout.flush()
+        if opts.nproc > 1: start_workers()
     # Process data from cache
-    for t in dbuf:
-        aa.set_jultime(t)
-        cat.compute(aa)
-        eqs = cat.get_crds('eq', ncrd=3)
-        flx = cat.get_jys()
-        dra,ddec = cat.get('ionref')
-        aa.sim_cache(eqs, flx, mfreqs=mfq, 
-            ionrefs=(dra,ddec), srcshapes=(a1,a2,th))
-        for bl in dbuf[t]:
-            i,j = a.miriad.bl2ij(bl)
-            d,f,nsamp,pol = dbuf[t][bl]
-            sim_d = aa.sim(i, j, pol=pol,resolve_src=False)
-            difsq = n.abs(d - sim_d)**2
-            difsq = n.where(f, 0, difsq)
-            score += difsq.sum()
-            nsamples += nsamp
+    if workers:
+        for p, conn in workers: conn.send(flat_prms)
+        score,nsamples,dscore = 0.,0.,0.
+        for p, conn in workers:
+            scr, nsp, dscr = conn.recv()
+            score += scr; nsamples += nsp
+            if opts.grad: dscore += dscr
+    else: score,nsamples,dscore = calc_score(range(dbuf['times'].size))
     if opts.daemon: return score, nsamples
     if nsamples == 0:
         first_fit = 0.
         return 0.
     score = n.sqrt(score / nsamples)
     if first_fit is None: first_fit = score
+    if opts.grad:
+        dscore /= 2 * score * nsamples * first_fit
+        last_grad = (n.array(flat_prms), dscore)
     if not opts.quiet:
         print
         print 'Score:', score, 
@@ -167,6 +302,33 @@ def fit_func(prms, filelist, decimate, decphs):
         print '-' * 70
     return score / first_fit
 
+last_grad = None
+
+def fit_grad(prms, *args):
+    """Return the gradient of fit_func(), reusing the one computed along 
+    with the last score when evaluated at the same parameters."""
+    if first_fit == 0: return n.zeros(len(prms))
+    if last_grad is None or not n.all(last_grad[0] == prms):
+        fit_func(prms, *args)
+    return last_grad[1]
+
+def fit(prm_list, args):
+    """Run the optimizer chosen on the command line from prm_list."""
+    if opts.grad:
+        # fmin_bfgs stops after 200*len(prm_list) iterations if maxiter=None
+        if opts.maxiter == n.Inf: maxiter = sys.maxint
+        else: maxiter = int(opts.maxiter)
+        return a.optimize.fmin_bfgs(fit_func, prm_list, fprime=fit_grad,
+            args=args, full_output=1, disp=0, maxiter=maxiter,
+            gtol=opts.gtol)
+    return a.optimize.fmin(
+        fit_func, prm_list,
+        args=args,
+        full_output=1, disp=0,
+        maxfun=opts.maxiter, maxiter=n.Inf, 
+        ftol=opts.ftol, xtol=opts.xtol
+    )
+
 # Call the optimizer
 if opts.daemon:
     import SocketServer, struct
@@ -241,13 +403,7 @@ elif opts.master:
     
 
 elif not opts.snap:
-    rv = a.optimize.fmin(
-        fit_func, prm_list,
-        args=(args, opts.decimate, opts.decphs),
-        full_output=1, disp=0,
-        maxfun=opts.maxiter, maxiter=n.Inf, 
-        ftol=opts.ftol, xtol=opts.xtol
-    )
+    rv = fit(prm_list, (args, opts.decimate, opts.decphs))
     prms,score = rv[:2]
     prms = a.fit.reconstruct_prms(prms, key_list)
     print
@@ -257,28 +413,18 @@ elif not opts.snap:
     print '------------------------------------------------------------'
 else:
     for uvfile in args:
-        # Figure out what times are in the file
+        # Figure out what times are in the file from its time index
         uv = a.miriad.UV(uvfile)
-        a.scripting.uv_selector(uv, opts.ant, opts.pol)
-        uv.select('decimate', opts.decimate, opts.decphs)
-        times = [0]
-        for (uvw,t,(i,j)),d,f in uv.all(raw=True):
-            if times[-1] != t: times.append(t)
-        times = times[1:]
+        times = list(uv.times()[opts.decphs::opts.decimate])
         del(uv)
         decimate = len(times) * opts.decimate
         # Fit each time separately
         for cnt, t in enumerate(times):
             print 'Time:', t
             print 'Iter: %d / %d' % (cnt+1, len(times))
-            first_fit,dbuf = None,None
-            rv = a.optimize.fmin(
-                fit_func, prm_list,
-                args=([uvfile], decimate, opts.decimate*cnt + opts.decphs),
-                full_output=1, disp=0,
-                maxfun=opts.maxiter, maxiter=n.Inf, 
-                ftol=opts.ftol, xtol=opts.xtol
-            )
+            first_fit,dbuf,last_grad = None,None,None
+            rv = fit(prm_list, 
+                ([uvfile], decimate, opts.decimate*cnt + opts.decphs))
             prms,score = rv[:2]
             prms = a.fit.reconstruct_prms(prms, key_list)
             print
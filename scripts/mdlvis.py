@@ -11,7 +11,7 @@ import numpy as n, aipy as a, optparse, os, sys, ephem
 o = optparse.OptionParser()
 o.set_usage('mdlvis.py [options] *.uv')
 o.set_description(__doc__)
-a.scripting.add_standard_options(o, ant=True, cal=True, src=True)
+a.scripting.add_standard_options(o, ant=True, cal=True, src=True, nproc=True)
 o.add_option('-m','--mode', dest='mode', default='sim',
     help='Operation mode.  Can be "sim" (output simulated data), "sub" (subtract from input data), or "add" (add to input data).  Default is "sim"')
 o.add_option('-f', '--flag', dest='flag', action='store_true',
@@ -141,12 +141,12 @@ def mdl(uv, p, d, f):
 
 if len(args) > 0:
     # Run mdl on all files
-    for filename in args:
+    def process(filename):
         uvofile = filename + 's'
         print filename,'->',uvofile
         if os.path.exists(uvofile):
             print 'File exists: skipping'
-            continue
+            return
         uvi = a.miriad.UV(filename)
         a.scripting.uv_selector(uvi, opts.ant)
         uvo = a.miriad.UV(uvofile, status='new')
@@ -154,6 +154,7 @@ if len(args) > 0:
         uvo.pipe(uvi, mfunc=mdl, raw=True,
             append2hist="MDLVIS: srcs=%s cat=%s mode=%s flag=%s noise=%f\n" % \
                 (opts.src, opts.cat, opts.mode, opts.flag, opts.noiselev))
+    a.scripting.process_files(process, args, nproc=opts.nproc)
 else:
     # Initialize a new UV file
     pols = opts.pol.split(',')
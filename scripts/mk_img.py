@@ -40,13 +40,19 @@ o.add_option('--res', dest='res', type='float', default=0.5,
 o.add_option('--no_w', dest='no_w', action='store_true',
     help="Don't use W projection.")
 o.add_option('--wres', dest='wres', type='float', default=0.5,
-    help="W-Plane projection resolution.  Default 0.5")
+    help="W-Plane projection resolution (of sqrt(w)).  Default 0.5")
+o.add_option('--wstack', dest='wstack', action='store_true',
+    help="Use W stacking instead of W projection.  It costs an FFT per w layer (see --wstack_res), so it is slower than W projection at their defaults, but W projection bins sqrt(w), so at large w it loses sources far from the phase center, which W stacking still images.  At equal run time, W stacking is the more accurate.")
+o.add_option('--wstack_res', dest='wstack_res', type='float', default=None,
+    help="Spacing (in wavelengths) of the w layers with --wstack.  Fewer layers are faster but attenuate sources far from the phase center.  Default is the spacing for which phase errors reach pi/4 (~10% amplitude loss) at the edge of the image, e.g. 0.25 for images reaching the horizon.")
 o.add_option('--altmin', dest='altmin', type='float', default=0,
     help="Minimum allowed altitude for pointing, in degrees.  When phase center is lower than this altitude, data is omitted.  Default is 0.")
 o.add_option('--minuv', dest='minuv', type='float', default=0,
     help="Minimum distance from the origin in the UV plane (in wavelengths) for a baseline to be included.  Default is 0.")
 o.add_option('--buf_thresh', dest='buf_thresh', default=2e6, type='float',
     help='Maximum amount of data to buffer before gridding.  Excessive gridding takes performance hit, but if buffer exceeds memory available... ouch.')
+o.add_option('--nthreads', dest='nthreads', type='int', default=1,
+    help='Number of threads used to grid data.  Default 1.')
 opts, args = o.parse_args(sys.argv[1:])
 
 # Parse command-line options
@@ -89,9 +95,11 @@ if opts.list_facets:
 # Generate the image object that will be used.
 us,vs,ws,ds,wgts = [],[],[],[],[]
 if opts.no_w:
-    im = a.img.Img(opts.size, opts.res, mf_order=0)
+    im = a.img.Img(opts.size, opts.res, mf_order=0, nthreads=opts.nthreads)
+elif opts.wstack:
+    im = a.img.ImgWStack(opts.size, opts.res, mf_order=0, wres=opts.wstack_res, nthreads=opts.nthreads)
 else:
-    im = a.img.ImgW(opts.size, opts.res, mf_order=0, wres=opts.wres)
+    im = a.img.ImgW(opts.size, opts.res, mf_order=0, wres=opts.wres, nthreads=opts.nthreads)
 L,M = im.get_LM()
 DIM = int(opts.size/opts.res)
 n_ints = 0
@@ -191,9 +199,11 @@ for srccnt, s in enumerate(cat.values()):
                           imgcnt += 1
                       us,vs,ws,ds,wgts = [],[],[],[],[]
                       if opts.no_w:
-                          im = a.img.Img(opts.size, opts.res, mf_order=0)
+                          im = a.img.Img(opts.size, opts.res, mf_order=0, nthreads=opts.nthreads)
+                      elif opts.wstack:
+                          im = a.img.ImgWStack(opts.size, opts.res, mf_order=0, wres=opts.wstack_res, nthreads=opts.nthreads)
                       else:
-                          im = a.img.ImgW(opts.size, opts.res, mf_order=0, wres=opts.wres)
+                          im = a.img.ImgW(opts.size, opts.res, mf_order=0, wres=opts.wres, nthreads=opts.nthreads)
                       if opts.src == 'zen':
                           s = a.phs.RadioFixedBody(aa.sidereal_time(), 
                               aa.lat, name='zen')
@@ -249,8 +259,10 @@ for srccnt, s in enumerate(cat.values()):
     imgcnt += 1
     us,vs,ws,ds,wgts = [],[],[],[],[]
     if opts.no_w:
-        im = a.img.Img(opts.size, opts.res, mf_order=0)
+        im = a.img.Img(opts.size, opts.res, mf_order=0, nthreads=opts.nthreads)
+    elif opts.wstack:
+        im = a.img.ImgWStack(opts.size, opts.res, mf_order=0, wres=opts.wstack_res, nthreads=opts.nthreads)
     else:
-        im = a.img.ImgW(opts.size, opts.res, mf_order=0, wres=opts.wres)
+        im = a.img.ImgW(opts.size, opts.res, mf_order=0, wres=opts.wres, nthreads=opts.nthreads)
     
 
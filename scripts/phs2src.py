@@ -9,7 +9,7 @@ import aipy as a, numpy as n, sys, os, optparse
 o = optparse.OptionParser()
 o.set_usage('phs2src.py [options] *.uv')
 o.set_description(__doc__)
-a.scripting.add_standard_options(o, cal=True, src=True)
+a.scripting.add_standard_options(o, cal=True, src=True, nproc=True)
 o.add_option('--setphs', dest='setphs', action='store_true',
     help='Instead of rotating phase, assign a phase corresponding to the specified source.')
 o.add_option('--rot_uvw',action='store_true',
@@ -53,16 +53,17 @@ def phs(uv, p, d, f):
     except(a.phs.PointingError): d *= 0
     return p, d, f
 
-# Process data
-for filename in args:
+def process(filename):
     if not opts.src is None: uvofile = filename + '.' + opts.src
     else: uvofile = filename + 'P'
     print filename,'->',uvofile
     if os.path.exists(uvofile):
         print 'File exists: skipping'
-        continue
+        return
     uvi = a.miriad.UV(filename)
     uvo = a.miriad.UV(uvofile, status='new')
     uvo.init_from_uv(uvi)
     uvo.pipe(uvi, mfunc=phs, raw=True)
 
+# Process data
+a.scripting.process_files(process, args, nproc=opts.nproc)
@@ -63,9 +63,8 @@ for uvfile in args:
     # Gather all data and each time step
     window = None
     data,mask,times = {}, {}, []
-    for (uvw,t,(i,j)), d, f in uvi.all(raw=True):
+    for (uvw,t,(i,j)), d, f, pol in uvi.all(raw=True, prefetch=2, pols=True):
         if len(times) == 0 or times[-1] != t: times.append(t)
-        pol = uvi['pol']
         if not pol in data:
             data[pol] = {}
             mask[pol] = {}
@@ -17,6 +17,7 @@ o.add_option('--combine', dest='combine', action='store_true',
     help='Use the same mask for all baselines/pols (and use thresh to decide how many concidences it takes to flag all data.')
 o.add_option('-t', '--thresh', dest='thresh', default=1, type='int',
     help='Number of flagging coincidences (baselines/pols) required to flag a time/chan.')
+a.scripting.add_standard_options(o, nproc=True)
 opts,args = o.parse_args(sys.argv[1:])
 
 # Parse command-line options
@@ -28,21 +29,19 @@ else:
     opts.chan = 'None'
 del(uv)
 
-
-for uvfile in args:
+def process(uvfile):
     uvofile = uvfile+'R'
     print uvfile,'->',uvofile
     if os.path.exists(uvofile):
         print uvofile, 'exists, skipping.'
-        continue
+        return
     uvi = a.miriad.UV(uvfile)
     #uvi.select('auto', -1, -1, include=False)
     # Gather all data and each time step
     data,mask,times = {}, {}, []
-    for (uvw,t,(i,j)), d, f in uvi.all(raw=True):
+    for (uvw,t,(i,j)), d, f, pol in uvi.all(raw=True, prefetch=2, pols=True):
         if len(times) == 0 or times[-1] != t: times.append(t)
         bl = a.miriad.ij2bl(i,j)
-        pol = uvi['pol']
         if not pol in data:
             data[pol] = {}
             mask[pol] = {}
@@ -107,5 +106,4 @@ for uvfile in args:
     uvo.init_from_uv(uvi)
     uvo.pipe(uvi, mfunc=rfi_mfunc, raw=True, append2hist=' '.join(sys.argv)+'\n')
 
-
-
+a.scripting.process_files(process, args, nproc=opts.nproc)
@@ -13,7 +13,7 @@ Author: Aaron Parsons
 import phs, const, coord, deconv
 import ephem, fit, healpix, img 
 import interp, cal, map, miriad
-import optimize, rfi, amp, scripting, src, _src, utils
+import optimize, rfi, amp, scripting, src, _src, utils, uvcube
 import dsp
 import pol, twodgauss #added by dfm
 from __gitlog__ import __gitlog__
@@ -492,7 +492,7 @@ template<typename T> struct Clean {
 PyObject *clean(PyObject *self, PyObject *args, PyObject *kwargs) {
     PyArrayObject *res, *ker, *mdl, *area;
     double gain=.1, tol=.001;
-    int maxiter=200, rank=0, dim1, dim2, rv, stop_if_div=0, verb=0, pos_def=0;
+    int maxiter=200, rank=0, dim1, dim2, rv=0, stop_if_div=0, verb=0, pos_def=0;
     static char *kwlist[] = {"res", "ker", "mdl", "area", "gain", \
                              "maxiter", "tol", "stop_if_div", "verbose","pos_def", NULL};
     // Parse arguments and perform sanity check
@@ -520,7 +520,15 @@ PyObject *clean(PyObject *self, PyObject *args, PyObject *kwargs) {
         PyErr_Format(PyExc_ValueError, "area must by of type 'int'");
         return NULL;
     }
+    if (TYPE(res) != NPY_FLOAT && TYPE(res) != NPY_DOUBLE && \
+            TYPE(res) != NPY_LONGDOUBLE && TYPE(res) != NPY_CFLOAT && \
+            TYPE(res) != NPY_CDOUBLE && TYPE(res) != NPY_CLONGDOUBLE) {
+        PyErr_Format(PyExc_ValueError, "Unsupported data type.");
+        return NULL;
+    }
     Py_INCREF(res); Py_INCREF(ker); Py_INCREF(mdl);
+    // The clean loops touch only array data, so other threads may run
+    Py_BEGIN_ALLOW_THREADS
     // Use template to implement data loops for all data types
     if (TYPE(res) == NPY_FLOAT) {
         if (rank == 1) {
@@ -558,10 +566,8 @@ PyObject *clean(PyObject *self, PyObject *args, PyObject *kwargs) {
         } else {
             rv = Clean<long double>::clean_2d_c(res,ker,mdl,area,gain,maxiter,tol,stop_if_div,verb,pos_def);
         }
-    } else {
-        PyErr_Format(PyExc_ValueError, "Unsupported data type.");
-        return NULL;
     }
+    Py_END_ALLOW_THREADS
     Py_DECREF(res); Py_DECREF(ker); Py_DECREF(mdl);
     return Py_BuildValue("i", rv);
 }
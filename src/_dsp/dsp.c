@@ -1,5 +1,20 @@
 #include "dsp.h"
 
+/* Check that ker is None or a 1D C-contiguous float32 kernel table, and
+ * return it as an array (or NULL if None).  Sets *err on failure. */
+static PyArrayObject *get_ker(PyObject *ker, int *err) {
+    *err = 0;
+    if (ker == NULL || ker == Py_None) return NULL;
+    if (!PyArray_Check(ker) || PyArray_NDIM((PyArrayObject *)ker) != 1 || \
+            PyArray_TYPE((PyArrayObject *)ker) != NPY_FLOAT || \
+            !PyArray_ISCONTIGUOUS((PyArrayObject *)ker)) {
+        PyErr_Format(PyExc_ValueError,
+            "ker must be a 1D C-contiguous float32 array");
+        *err = 1;
+    }
+    return (PyArrayObject *)ker;
+}
+
 // Adds data to a at indicies specified in ind.  Checks safety of arrays input.
 PyObject *wrap_grid1D_c(PyObject *self, PyObject *args) {
     PyArrayObject *buf, *ind, *dat;
@@ -23,9 +38,11 @@ PyObject *wrap_grid1D_c(PyObject *self, PyObject *args) {
     Py_INCREF(buf);
     Py_INCREF(ind);
     Py_INCREF(dat);
+    Py_BEGIN_ALLOW_THREADS
     rv = grid1D_c((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0),
                   (float *) PyArray_DATA(ind), 
                   (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0), footprint);
+    Py_END_ALLOW_THREADS
     Py_DECREF(buf);
     Py_DECREF(ind);
     Py_DECREF(dat);
@@ -39,12 +56,14 @@ PyObject *wrap_grid1D_c(PyObject *self, PyObject *args) {
 }
 
 PyObject *wrap_grid2D_c(PyObject *self, PyObject *args) {
-    PyArrayObject *buf, *ind1, *ind2, *dat;
-    int rv;
-    long footprint=6;
+    PyArrayObject *buf, *ind1, *ind2, *dat, *ker;
+    PyObject *ker_obj=NULL;
+    int rv, err;
+    long footprint=6, oversample=1;
     // Parse arguments and perform sanity check
-    if (!PyArg_ParseTuple(args, "O!O!O!O!|i", &PyArray_Type, &buf, 
-            &PyArray_Type, &ind1, &PyArray_Type, &ind2, &PyArray_Type, &dat, &footprint)) 
+    if (!PyArg_ParseTuple(args, "O!O!O!O!|lOl", &PyArray_Type, &buf, 
+            &PyArray_Type, &ind1, &PyArray_Type, &ind2, &PyArray_Type, &dat,
+            &footprint, &ker_obj, &oversample)) 
         return NULL;
     CHK_ARRAY_RANK(buf, 2);
     CHK_ARRAY_RANK(ind1, 1);
@@ -58,14 +77,30 @@ PyObject *wrap_grid2D_c(PyObject *self, PyObject *args) {
         PyErr_Format(PyExc_ValueError, "Dimensions of ind and dat do not match");
         return NULL;
     }
+    ker = get_ker(ker_obj, &err);
+    if (err) return NULL;
+    if (ker != NULL && (footprint < 1 || oversample < 1)) {
+        PyErr_Format(PyExc_ValueError, "footprint and oversample must be > 0");
+        return NULL;
+    }
         
     Py_INCREF(buf);
     Py_INCREF(ind1);
     Py_INCREF(ind2);
     Py_INCREF(dat);
-    rv = grid2D_c((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0), (long) PyArray_DIM(buf,1),
-                  (float *) PyArray_DATA(ind1), (float *) PyArray_DATA(ind2), 
-                  (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0), footprint);
+    Py_BEGIN_ALLOW_THREADS
+    if (ker == NULL) {
+        rv = grid2D_c((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0), (long) PyArray_DIM(buf,1),
+                      (float *) PyArray_DATA(ind1), (float *) PyArray_DATA(ind2), 
+                      (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0), footprint);
+    } else {
+        rv = grid2D_kc((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0), (long) PyArray_DIM(buf,1),
+                      (float *) PyArray_DATA(ind1), (float *) PyArray_DATA(ind2), 
+                      (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0),
+                      (float *) PyArray_DATA(ker), (long) PyArray_DIM(ker,0),
+                      footprint, oversample);
+    }
+    Py_END_ALLOW_THREADS
     Py_DECREF(buf);
     Py_DECREF(ind1);
     Py_DECREF(ind2);
@@ -80,12 +115,14 @@ PyObject *wrap_grid2D_c(PyObject *self, PyObject *args) {
 }
 
 PyObject *wrap_degrid2D_c(PyObject *self, PyObject *args) {
-    PyArrayObject *buf, *ind1, *ind2, *dat;
-    int rv;
-    long footprint=6;
+    PyArrayObject *buf, *ind1, *ind2, *dat, *ker;
+    PyObject *ker_obj=NULL;
+    int rv, err;
+    long footprint=6, oversample=1;
     // Parse arguments and perform sanity check
-    if (!PyArg_ParseTuple(args, "O!O!O!O!|i", &PyArray_Type, &buf, 
-            &PyArray_Type, &ind1, &PyArray_Type, &ind2, &PyArray_Type, &dat, &footprint)) 
+    if (!PyArg_ParseTuple(args, "O!O!O!O!|lOl", &PyArray_Type, &buf, 
+            &PyArray_Type, &ind1, &PyArray_Type, &ind2, &PyArray_Type, &dat,
+            &footprint, &ker_obj, &oversample)) 
         return NULL;
     CHK_ARRAY_RANK(buf, 2);
     CHK_ARRAY_RANK(ind1, 1);
@@ -99,15 +136,31 @@ PyObject *wrap_degrid2D_c(PyObject *self, PyObject *args) {
         PyErr_Format(PyExc_ValueError, "Dimensions of ind and dat do not match");
         return NULL;
     }
+    ker = get_ker(ker_obj, &err);
+    if (err) return NULL;
+    if (ker != NULL && (footprint < 1 || oversample < 1)) {
+        PyErr_Format(PyExc_ValueError, "footprint and oversample must be > 0");
+        return NULL;
+    }
         
     Py_INCREF(buf);
     Py_INCREF(ind1);
     Py_INCREF(ind2);
     Py_INCREF(dat);
     // Being lazy.  should allocate data rather than take it as an argument
-    rv = degrid2D_c((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0), (long) PyArray_DIM(buf,1),
-                  (float *) PyArray_DATA(ind1), (float *) PyArray_DATA(ind2), 
-                  (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0), footprint);
+    Py_BEGIN_ALLOW_THREADS
+    if (ker == NULL) {
+        rv = degrid2D_c((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0), (long) PyArray_DIM(buf,1),
+                      (float *) PyArray_DATA(ind1), (float *) PyArray_DATA(ind2), 
+                      (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0), footprint);
+    } else {
+        rv = degrid2D_kc((float *) PyArray_DATA(buf), (long) PyArray_DIM(buf,0), (long) PyArray_DIM(buf,1),
+                      (float *) PyArray_DATA(ind1), (float *) PyArray_DATA(ind2), 
+                      (float *) PyArray_DATA(dat), (long) PyArray_DIM(dat,0),
+                      (float *) PyArray_DATA(ker), (long) PyArray_DIM(ker,0),
+                      footprint, oversample);
+    }
+    Py_END_ALLOW_THREADS
     Py_DECREF(buf);
     Py_DECREF(ind1);
     Py_DECREF(ind2);
@@ -126,9 +179,9 @@ static PyMethodDef _dsp_methods[] = {
     {"grid1D_c", (PyCFunction)wrap_grid1D_c, METH_VARARGS,
         "grid1D_c(buf,ind,dat,footprint=6)\nTBD."},
     {"grid2D_c", (PyCFunction)wrap_grid2D_c, METH_VARARGS,
-        "grid2D_c(buf,ind1,ind2,dat,footprint=6)\nTBD."},
+        "grid2D_c(buf,ind1,ind2,dat,footprint=6,ker=None,oversample=1)\nAdd dat to the 2D complex64 buf at the fractional (ind1,ind2) pixel indices, spread over footprint pixels by a Gaussian or, if given, by the symmetric kernel tabulated in ker (float32) at offsets of 1/oversample pixels."},
     {"degrid2D_c", (PyCFunction)wrap_degrid2D_c, METH_VARARGS,
-        "degrid2D_c(buf,ind1,ind2,dat,footprint=6)\nTBD."},
+        "degrid2D_c(buf,ind1,ind2,dat,footprint=6,ker=None,oversample=1)\nAdd to dat the kernel-weighted average of buf around each (ind1,ind2); the inverse of grid2D_c."},
     {NULL, NULL}
 };
 
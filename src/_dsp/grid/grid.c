@@ -96,3 +96,82 @@ int degrid2D_c(float *buf, long buflen1, long buflen2,
     }
     return 0;
 }
+
+/* Fill wgt with the weights of the cells j0, j0+1, ... within support/2 of
+ * find, looked up in ker, a table of a symmetric kernel sampled at
+ * offsets of 1/oversample cells from 0.  Returns the number of cells. */
+static long ker_wgts(float find, float *ker, long nker, long support,
+        long oversample, long *j0, float *wgt) {
+    long j, k, cnt=0;
+    float half = support / 2.;
+    *j0 = (long) ceilf(find - half);
+    for (j = *j0; j <= (long) floorf(find + half); j++) {
+        k = (long) (fabsf(find - j) * oversample + .5);
+        wgt[cnt++] = (k < nker) ? ker[k] : 0;
+    }
+    return cnt;
+}
+
+int grid2D_kc(float *buf, long buflen1, long buflen2,
+        float *ind1, float *ind2, float *data, long datalen,
+        float *ker, long nker, long support, long oversample) {
+    long i, j1, j2, j1mod, j2mod, n1, n2, j10, j20, row;
+    float fdatr, fdati, fwgt1, *wgt1, *wgt2;
+    wgt1 = (float *) malloc(2 * (support + 2) * sizeof(float));
+    if (wgt1 == NULL) return -1;
+    wgt2 = wgt1 + support + 2;
+    for (i = 0; i < datalen; i++) {
+        fdatr = data[2*i];
+        fdati = data[2*i+1];
+        n1 = ker_wgts(ind1[i], ker, nker, support, oversample, &j10, wgt1);
+        n2 = ker_wgts(ind2[i], ker, nker, support, oversample, &j20, wgt2);
+        for (j1 = 0; j1 < n1; j1++) {
+          j1mod = (j10 + j1) % buflen1;
+          j1mod = j1mod < 0 ? j1mod + buflen1 : j1mod;
+          row = j1mod * buflen2;
+          fwgt1 = wgt1[j1];
+          for (j2 = 0; j2 < n2; j2++) {
+            j2mod = (j20 + j2) % buflen2;
+            j2mod = j2mod < 0 ? j2mod + buflen2 : j2mod;
+            buf[2*(row+j2mod)]   += fwgt1 * wgt2[j2] * fdatr;
+            buf[2*(row+j2mod)+1] += fwgt1 * wgt2[j2] * fdati;
+          }
+        }
+    }
+    free(wgt1);
+    return 0;
+}
+
+int degrid2D_kc(float *buf, long buflen1, long buflen2,
+        float *ind1, float *ind2, float *data, long datalen,
+        float *ker, long nker, long support, long oversample) {
+    long i, j1, j2, j1mod, j2mod, n1, n2, j10, j20, row;
+    float fwgt, tot_wgt, *wgt1, *wgt2;
+    wgt1 = (float *) malloc(2 * (support + 2) * sizeof(float));
+    if (wgt1 == NULL) return -1;
+    wgt2 = wgt1 + support + 2;
+    for (i = 0; i < datalen; i++) {
+        tot_wgt = 0;
+        n1 = ker_wgts(ind1[i], ker, nker, support, oversample, &j10, wgt1);
+        n2 = ker_wgts(ind2[i], ker, nker, support, oversample, &j20, wgt2);
+        for (j1 = 0; j1 < n1; j1++) {
+          j1mod = (j10 + j1) % buflen1;
+          j1mod = j1mod < 0 ? j1mod + buflen1 : j1mod;
+          row = j1mod * buflen2;
+          for (j2 = 0; j2 < n2; j2++) {
+            j2mod = (j20 + j2) % buflen2;
+            j2mod = j2mod < 0 ? j2mod + buflen2 : j2mod;
+            fwgt = wgt1[j1] * wgt2[j2];
+            tot_wgt += fwgt;
+            data[2*i] += fwgt * buf[2*(row+j2mod)];
+            data[2*i+1] += fwgt * buf[2*(row+j2mod)+1];
+          }
+        }
+        if (tot_wgt != 0) {
+            data[2*i] /= tot_wgt;
+            data[2*i+1] /= tot_wgt;
+        }
+    }
+    free(wgt1);
+    return 0;
+}
@@ -8,5 +8,9 @@ int grid1D_r(float *, long, float *, float *, long, long);
 int grid1D_c(float *, long, float *, float *, long, long);
 int grid2D_c(float *, long, long, float *, float *, float *, long, long);
 int degrid2D_c(float *, long, long, float *, float *, float *, long, long);
+int grid2D_kc(float *, long, long, float *, float *, float *, long,
+    float *, long, long, long);
+int degrid2D_kc(float *, long, long, float *, float *, float *, long,
+    float *, long, long, long);
 
 #endif
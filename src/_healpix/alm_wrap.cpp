@@ -54,6 +54,15 @@
         PyErr_Format(PyExc_ValueError, "expected a complex"); \
         return NULL; }
 
+// Releases the GIL for the lifetime of the object
+class NoGIL {
+  private:
+    PyThreadState *state;
+  public:
+    NoGIL() { state = PyEval_SaveThread(); }
+    ~NoGIL() { PyEval_RestoreThread(state); }
+};
+
 // Some helper functions
 
 void option_err(char *options[]) {
@@ -216,7 +225,10 @@ static PyObject * AlmObject_to_map(AlmObject *self, PyObject *args) {
     }
     try {
         Healpix_Map<double> map(nside, scheme, SET_NSIDE);
-        alm2map<double>(self->alm, map);
+        {
+            NoGIL nogil;
+            alm2map<double>(self->alm, map);
+        }
         // Transfer map contents into numpy array
         npix = map.Npix();
         rv = (PyArrayObject *) PyArray_SimpleNew(1, &npix, PyArray_DOUBLE);
@@ -272,7 +284,10 @@ static PyObject * AlmObject_from_map(AlmObject *self, PyObject *args) {
             PyErr_Format(PyExc_ValueError, "Unsupported data type");
             return NULL;
         }
-        map2alm_iter<double>(map, self->alm, iter);
+        {
+            NoGIL nogil;
+            map2alm_iter<double>(map, self->alm, iter);
+        }
         Py_INCREF(Py_None);
         return Py_None;
     } catch (Message_error &e) {
@@ -55,6 +55,15 @@
         PyErr_Format(PyExc_MemoryError, "Failed to allocate %s", QUOTE(a)); \
         return NULL; }
 
+// Releases the GIL for the lifetime of the object
+class NoGIL {
+  private:
+    PyThreadState *state;
+  public:
+    NoGIL() { state = PyEval_SaveThread(); }
+    ~NoGIL() { PyEval_RestoreThread(state); }
+};
+
 // Some helper functions
 
 /*____                           _                    _    
@@ -139,16 +148,21 @@ static PyObject * HPBObject_nest_ring_conv(HPBObject *self, PyObject *args) {
         return NULL;
     CHK_ARRAY_TYPE(px,NPY_LONG);
     CHK_ARRAY_RANK(px,1);
+    int to_nest;
+    if (strcmp(PyString_AsString(scheme), "NEST") == 0) to_nest = 1;
+    else if (strcmp(PyString_AsString(scheme), "RING") == 0) to_nest = 0;
+    else {
+        PyErr_Format(PyExc_ValueError,"scheme must be 'RING' or 'NEST'.");
+        return NULL;
+    }
     try {
-        if (strcmp(PyString_AsString(scheme), "NEST") == 0) {
+        NoGIL nogil;
+        if (to_nest) {
             for (int i=0; i < DIM(px,0); i++)
                 IND1(px,i,long) = self->hpb.ring2nest(IND1(px,i,long));
-        } else if (strcmp(PyString_AsString(scheme), "RING") == 0) {
+        } else {
             for (int i=0; i < DIM(px,0); i++)
                 IND1(px,i,long) = self->hpb.nest2ring(IND1(px,i,long));
-        } else {
-            PyErr_Format(PyExc_ValueError,"scheme must be 'RING' or 'NEST'.");
-            return NULL;
         }
     } catch (Message_error &e) {
         PyErr_Format(PyExc_RuntimeError, e.what());
@@ -216,6 +230,7 @@ static PyObject * HPBObject_crd2px(HPBObject *self, PyObject *args,
         CHK_NULL(wgt);
     }     
     // Interpret coordinates
+    Py_BEGIN_ALLOW_THREADS
     for (int i=0; i < sz; i++) {
         c1 = IND1(crd1,i,double);
         c2 = IND1(crd2,i,double);
@@ -242,6 +257,7 @@ static PyObject * HPBObject_crd2px(HPBObject *self, PyObject *args,
             }
         }
     }
+    Py_END_ALLOW_THREADS
     if (interpolate == 0) return PyArray_Return(rv);
     // Otherwise build tuple to return.
     // Make sure to DECREF when using Py_BuildValue() !!
@@ -279,14 +295,18 @@ static PyObject * HPBObject_px2crd(HPBObject *self,
     CHK_NULL(crd1);
     CHK_NULL(crd2);
     if (ncrd == 2) {
+        Py_BEGIN_ALLOW_THREADS
         for (int i=0; i < sz; i++) {
             p = self->hpb.pix2ang(IND1(px,i,int));
             IND1(crd1,i,double) = p.theta;
             IND1(crd2,i,double) = p.phi;
         }
+        Py_END_ALLOW_THREADS
         return Py_BuildValue("(OO)",PyArray_Return(crd1),PyArray_Return(crd2));
     } else {
         crd3 = (PyArrayObject *) PyArray_SimpleNew(1, dimens, PyArray_DOUBLE);
+        CHK_NULL(crd3);
+        Py_BEGIN_ALLOW_THREADS
         for (int i=0; i < sz; i++) {
             p = self->hpb.pix2ang(IND1(px,i,int));
             v = p.to_vec3();
@@ -294,6 +314,7 @@ static PyObject * HPBObject_px2crd(HPBObject *self,
             IND1(crd2,i,double) = v.y;
             IND1(crd3,i,double) = v.z;
         }
+        Py_END_ALLOW_THREADS
         return Py_BuildValue("(OOO)", PyArray_Return(crd1),
             PyArray_Return(crd2), PyArray_Return(crd3));
     }
@@ -201,6 +201,9 @@ void uvclose_c  (int tno);
 void uvflush_c  (int tno);
 void uvnext_c   (int tno);
 void uvrewind_c (int tno);
+int  uvtell_c   (int tno, off_t *pos, int n);
+void uvseek_c   (int tno, Const off_t *pos, int n);
+int  uvskip_c   (int tno);
 void uvcopyvr_c (int tin, int tout);
 int  uvupdate_c (int tno);
 void uvvarini_c (int tno, int *vhan);
@@ -164,6 +164,7 @@
 /*		  only when the relevant uv variables are in the dataset*/
 /*  pjt  25apr06 Add ATNF's new uvdim_c and match sourcenames w/o case  */
 /*  pjt  22aug06 merged versions; finish dazim/delev selection code     */
+/*  aipy 18oct26 Added uvtell, uvseek and uvskip for indexed access.    */
 /*----------------------------------------------------------------------*/
 /*									*/
 /*		Handle UV files.					*/
@@ -249,6 +250,8 @@
 /*		array of the UV structure.				*/
 /*  callno	The call number to uv_scan when the variable was last	*/
 /*		updated.						*/
+/*  soff,doff	Offsets of the last length and value records read for	*/
+/*		this variable, or -1 (see uvtell).			*/
 /*  fwd		Pointer to the next variable. This allows a linked	*/
 /*		list to be formed for hashing.				*/
 /*									*/
@@ -371,6 +374,7 @@ static char var_eor_hdr[UV_HDR_SIZE]={0,0,VAR_EOR,0};
 typedef struct variable{
 	char *buf,name[MAXNAM+1];
 	int length,flength,flags,type,index,callno;
+	off_t soff,doff;
 	struct variable *fwd;
 } VARIABLE;
 
@@ -1070,6 +1074,7 @@ private UV *uv_getuv(int tno)
 
   for(i=0, v = uv->variable; i < MAXVAR; i++, v++){
     v->length = v->flength = 0;
+    v->soff = v->doff = -1;
     v->buf = NULL;
     v->flags = 0;
     v->type = 0;
@@ -1275,6 +1280,132 @@ void uvnext_c(int tno)
   }
 }
 /************************************************************************/
+int uvtell_c(int tno,off_t *pos,int n)
+/**uvtell -- Return the position of a uv file being read.		*/
+/*:uv-i/o								*/
+/*+
+  Save the position in the variable stream (and flag items) of a uv file
+  being read, together with the offsets of the records which set the
+  current value of each variable, so that uvseek can later return to it.
+
+  Input:
+    tno		The uv data file handle.
+    n		The size of pos.  The offsets are returned if n is at least
+		4, and those of variables if n is at least the value
+		returned.
+  Output:
+    pos		The stream offset, the offsets into the correlation and
+		wideband flags, the end of the stream, then the offsets of
+		the length and value records of each variable (-1 if not
+		yet read).
+    uvtell_c	The number of elements needed for pos.			*/
+/*--									*/
+/*----------------------------------------------------------------------*/
+{
+  UV *uv;
+  VARIABLE *v;
+  int i;
+
+  uv = uvs[tno];
+  if(n < 4) return(4 + 2*uv->nvar);
+  pos[0] = uv->offset;
+  pos[1] = uv->corr_flags.offset;
+  pos[2] = uv->wcorr_flags.offset;
+  pos[3] = uv->max_offset;
+  if(n < 4 + 2*uv->nvar) return(4 + 2*uv->nvar);
+  for(i=0, v = uv->variable; i < uv->nvar; i++, v++){
+    pos[4+2*i] = v->soff;
+    pos[5+2*i] = v->doff;
+  }
+  return(4 + 2*uv->nvar);
+}
+/************************************************************************/
+void uvseek_c(int tno,Const off_t *pos,int n)
+/**uvseek -- Return to a position in a uv file being read.		*/
+/*:uv-i/o								*/
+/*+
+  Return to a position saved by uvtell, restoring the value of each
+  variable from the records which set it.  The end of the stream may
+  be set before the end of the file, so that reading stops there.
+
+  Input:
+    tno		The uv data file handle.
+    pos		A position returned by uvtell.
+    n		The number of elements of pos.  If 4, only the offsets and
+		end of the stream are set, and variables are untouched.	*/
+/*--									*/
+/*----------------------------------------------------------------------*/
+{
+  UV *uv;
+  VARIABLE *v;
+  int i,iostat,intsize,extsize;
+
+  uv = uvs[tno];
+  if(n != 4 && n != 4 + 2*uv->nvar)
+    ERROR('f',(message,"Position has %d elements not %d, in UVSEEK",
+	n,4 + 2*uv->nvar));
+  uv->offset = pos[0];
+  uv->corr_flags.offset = pos[1];
+  uv->wcorr_flags.offset = pos[2];
+  uv->max_offset = pos[3];
+  if(n == 4) return;
+  uv->callno++;
+  uv->mark = uv->callno;
+  for(i=0, v = uv->variable; i < uv->nvar; i++, v++){
+    v->soff = pos[4+2*i];
+    v->doff = pos[5+2*i];
+    if(v->soff < 0 || (v->flags & UVF_OVERRIDE)) continue;
+    intsize = internal_size[v->type];
+    extsize = external_size[v->type];
+    hreadi_c(uv->item,&v->flength,v->soff+UV_HDR_SIZE,H_INT_SIZE,&iostat);
+    CHECK(iostat,(message,"Error reading a variable-length for %s, in UVSEEK",v->name));
+    v->length = v->flength;
+    v->buf = Realloc( v->buf, (v->flength * intsize)/extsize );
+    if(v->doff >= 0){
+      hread_c(uv->item,v->type,v->buf,v->doff,v->flength,&iostat);
+      CHECK(iostat,(message,"Error reading a variable value for %s, in UVSEEK",v->name));
+    }
+    v->callno = uv->callno;
+    uv->flags |= v->flags & (UVF_UPDATED | UVF_UPDATED_PLANET |
+			     UVF_UPDATED_SKYFREQ | UVF_UPDATED_UVW | UVF_COPY);
+  }
+}
+/************************************************************************/
+int uvskip_c(int tno)
+/**uvskip -- Skip the next correlation record of a uv file.		*/
+/*:uv-i/o								*/
+/*+
+  Skip over the next correlation record, updating variables but without
+  reading the correlation data or applying any selection.  Unlike uvnext,
+  this keeps the position in the flag items in step, so that uvtell and
+  uvseek may be used.
+
+  Input:
+    tno		The uv data file handle.
+  Output:
+    uvskip_c	0 on success, -1 at the end of the file.		*/
+/*--									*/
+/*----------------------------------------------------------------------*/
+{
+  UV *uv;
+  VARIABLE *v;
+
+  uv = uvs[tno];
+  if(!(uv->flags & UVF_INIT)) uvread_defline(tno);
+  uv->mark = uv->callno + 1;
+  uv->flags &= ~(UVF_UPDATED | UVF_COPY);
+  do {
+    if(uv_scan(uv,(VARIABLE *)NULL) != 0)return(-1);
+    if(!(uv->flags & UVF_INIT)) uvread_init(tno);
+    if(uv->corr != NULL)if(uv->corr->callno == uv->callno)
+      uv->corr_flags.offset += NUMCHAN(uv->corr);
+    if(uv->wcorr != NULL)if(uv->wcorr->callno == uv->callno)
+      uv->wcorr_flags.offset += NUMCHAN(uv->wcorr);
+    v = (uv->data_line.linetype == LINE_WIDE ? uv->wcorr : uv->corr);
+  } while(v == NULL || v->callno < uv->callno);
+  return(0);
+}
+/************************************************************************/
 void uvrewind_c(int tno)
 /**uvrewind -- Reset the uv data file to the start of the file.		*/
 /*&rjs                                                                  */
@@ -1873,6 +2004,7 @@ private int uv_scan(UV *uv, VARIABLE *vt)
       if(v->flength % extsize)
         ERROR('f',(message,
 	  "Non-integral no. elements in variable %s, when scanning",v->name));
+      v->soff = offset;
       if(!(v->flags & UVF_OVERRIDE) || v->type != H_BYTE){
         v->length = v->flength;
         v->buf = Realloc( v->buf, (v->flength * intsize)/extsize );
@@ -1888,6 +2020,7 @@ private int uv_scan(UV *uv, VARIABLE *vt)
    of this variable, read it. */
      case VAR_DATA:
       offset += mroundup(UV_HDR_SIZE,extsize);
+      v->doff = offset;
       if(!(v->flags & UVF_OVERRIDE)){
 	hread_c(uv->item,v->type,v->buf,offset,v->flength,&iostat);
 	CHECK(iostat,(message,"Error reading a variable value for %s, while UV scanning",v->name));
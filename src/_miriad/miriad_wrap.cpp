@@ -7,6 +7,51 @@
  \____|_|  \___/ \__,_|_| |_|\__,_| \_/\_/ \___/|_|  |_|\_\
 */
 
+/* MIRIAD's I/O layer keeps global state, so all calls into it are
+ * serialized by one lock.  This lets reads and writes run with the GIL
+ * released (see NoGIL) while other threads use Python, or even other UV
+ * files.  The lock is re-entrant within a thread, and waits for it without holding the GIL
+ * (has_gil must be 0 if the GIL has already been released).
+ */
+static PyThread_type_lock miriad_lock = NULL;
+static long miriad_owner = -1;
+static int miriad_depth = 0;
+
+class MiriadLock {
+  public:
+    MiriadLock(int has_gil=1) {
+        long me = PyThread_get_thread_ident();
+        if (miriad_depth > 0 && miriad_owner == me) {
+            miriad_depth++;
+            return;
+        }
+        if (!PyThread_acquire_lock(miriad_lock, NOWAIT_LOCK)) {
+            if (has_gil) {
+                Py_BEGIN_ALLOW_THREADS
+                PyThread_acquire_lock(miriad_lock, WAIT_LOCK);
+                Py_END_ALLOW_THREADS
+            } else PyThread_acquire_lock(miriad_lock, WAIT_LOCK);
+        }
+        miriad_owner = me;
+        miriad_depth = 1;
+    }
+    ~MiriadLock() {
+        if (--miriad_depth == 0) {
+            miriad_owner = -1;
+            PyThread_release_lock(miriad_lock);
+        }
+    }
+};
+
+// Releases the GIL for the lifetime of the object
+class NoGIL {
+  private:
+    PyThreadState *state;
+  public:
+    NoGIL() { state = PyEval_SaveThread(); }
+    ~NoGIL() { PyEval_RestoreThread(state); }
+};
+
 // Python object that holds handle to UV file
 typedef struct {
     PyObject_HEAD
@@ -15,11 +60,40 @@ typedef struct {
     long decphase;
     long intcnt;
     double curtime;
+    // A record read past an integration boundary by read_many, held over
+    // to be returned by the next read.
+    int pending;
+    int pend_nread;
+    int pend_size;
+    double pend_preamble[PREAMBLE_SIZE];
+    float *pend_data;
+    int *pend_flags;
+    // Baseline mask (nmask x nmask) and polarization set checked on read
+    int nmask;
+    npy_bool *blmask;
+    int npols;
+    int *pols;
+    // Channel indices gathered from each spectrum read (chan_size deep)
+    int nchans;
+    int *chans;
+    int chan_size;
+    float *chan_data;
+    int *chan_flags;
+    // End of the variable stream before _seek limited it, or -1
+    off_t vislen;
 } UVObject;
 
 // Deallocate memory when Python object is deleted
 static void UVObject_dealloc(UVObject* self) {
+    MiriadLock lock;
     if (self->tno != -1) uvclose_c(self->tno);
+    free(self->pend_data);
+    free(self->pend_flags);
+    free(self->blmask);
+    free(self->pols);
+    free(self->chans);
+    free(self->chan_data);
+    free(self->chan_flags);
     self->ob_type->tp_free((PyObject*)self);
 }
 
@@ -44,6 +118,9 @@ static int UVObject_init(UVObject *self, PyObject *args, PyObject *kwds) {
     self->decphase = 0;
     self->intcnt = -1;
     self->curtime = -1;
+    self->pending = 0;
+    self->nmask = self->npols = self->nchans = self->chan_size = 0;
+    self->vislen = -1;
     // Parse arguments and typecheck
     if (!PyArg_ParseTuple(args, "sss", &name, &status, &corrmode)) return -1;
     switch (corrmode[0]) {
@@ -52,9 +129,12 @@ static int UVObject_init(UVObject *self, PyObject *args, PyObject *kwds) {
             PyErr_Format(PyExc_ValueError, "UV corrmode must be 'r' or 'j' (got '%c')", corrmode[0]);
             return -1;
     }
-    // Setup an error handler so MIRIAD doesn't just exit
-    bugrecover_c(error_handler);
     try {
+        // Open without the GIL, so files may be opened in the background
+        NoGIL nogil;
+        MiriadLock lock(0);
+        // Setup an error handler so MIRIAD doesn't just exit
+        bugrecover_c(error_handler);
         uvopen_c(&self->tno, name, status);
         // Statically set the preamble format
         uvset_c(self->tno,"preamble","uvw/time/baseline",0,0.,0.,0.);
@@ -77,13 +157,224 @@ static int UVObject_init(UVObject *self, PyObject *args, PyObject *kwds) {
 
 // Thin wrapper over uvrewind_c
 PyObject * UVObject_rewind(UVObject *self) {
-    uvrewind_c(self->tno);
+    MiriadLock lock;
+    off_t pos[4] = {0, 0, 0, self->vislen};
+    try {
+        uvrewind_c(self->tno);
+        if (self->vislen >= 0) uvseek_c(self->tno, pos, 4);
+    } catch (MiriadError &e) {
+        PyErr_Format(PyExc_RuntimeError, e.get_message());
+        return NULL;
+    }
+    self->intcnt = -1;
+    self->curtime = -1;
+    self->pending = 0;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Return the current position in the file (see uvtell_c) as an int64
+ * array, for returning to with _seek.
+ */
+PyObject * UVObject_tell(UVObject *self) {
+    PyArrayObject *rv;
+    MiriadLock lock;
+    npy_intp dims[1] = {uvtell_c(self->tno, NULL, 0)};
+    off_t *pos = (off_t *) malloc(dims[0] * sizeof(off_t));
+    CHK_NULL(pos);
+    uvtell_c(self->tno, pos, dims[0]);
+    rv = (PyArrayObject *) PyArray_SimpleNew(1, dims, NPY_INT64);
+    if (rv == NULL) {
+        free(pos);
+        PyErr_Format(PyExc_MemoryError, "Failed to allocate rv");
+        return NULL;
+    }
+    for (int i=0; i < dims[0]; i++) IND1(rv,i,npy_int64) = pos[i];
+    free(pos);
+    return PyArray_Return(rv);
+}
+
+/* Return to a position from _tell or _tindex, restoring variables.  If
+ * end >= 0, reading stops at that offset in the variable stream (until
+ * rewind), otherwise it continues to the end of the file.
+ */
+PyObject * UVObject_seek(UVObject *self, PyObject *args) {
+    PyArrayObject *pos_arr;
+    long long end;
+    int n, i;
+    off_t *pos;
+    if (!PyArg_ParseTuple(args, "O!L", &PyArray_Type, &pos_arr, &end))
+        return NULL;
+    CHK_ARRAY_RANK(pos_arr, 1);
+    CHK_ARRAY_TYPE(pos_arr, NPY_INT64);
+    MiriadLock lock;
+    n = DIM(pos_arr,0);
+    if (n < 4) {
+        PyErr_Format(PyExc_ValueError, "position must have at least 4 elements");
+        return NULL;
+    }
+    pos = (off_t *) malloc(n * sizeof(off_t));
+    CHK_NULL(pos);
+    for (i=0; i < n; i++) pos[i] = IND1(pos_arr,i,npy_int64);
+    try {
+        if (self->vislen < 0) {
+            off_t cur[4];
+            uvtell_c(self->tno, cur, 4);
+            self->vislen = cur[3];
+        }
+        pos[3] = (end >= 0) ? end : self->vislen;
+        uvseek_c(self->tno, pos, n);
+    } catch (MiriadError &e) {
+        free(pos);
+        PyErr_Format(PyExc_RuntimeError, e.get_message());
+        return NULL;
+    }
+    free(pos);
     self->intcnt = -1;
     self->curtime = -1;
+    self->pending = 0;
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+/* Scan the whole file without decoding data or applying selections, and
+ * return (times, positions), where times is an (N,) array of the distinct
+ * times of the integrations in the file, and positions is an (N,M) int64
+ * array of the position (see _tell) before the first record of each.
+ * The current position is restored afterwards.
+ */
+PyObject * UVObject_tindex(UVObject *self) {
+    PyArrayObject *times_arr, *pos_arr;
+    PyObject *rv;
+    MiriadLock lock;
+    int npos, cnt=0, size=0, ok=1, i;
+    off_t *saved, *cur, *pos=NULL, start[4] = {0, 0, 0, self->vislen};
+    double t, *times=NULL;
+    npos = uvtell_c(self->tno, NULL, 0);
+    saved = (off_t *) malloc(2 * npos * sizeof(off_t));
+    CHK_NULL(saved);
+    cur = saved + npos;
+    try {
+        NoGIL nogil;
+        uvtell_c(self->tno, saved, npos);
+        if (start[3] < 0) start[3] = saved[3];
+        uvrewind_c(self->tno);
+        uvseek_c(self->tno, start, 4);
+        while (1) {
+            uvtell_c(self->tno, cur, npos);
+            if (uvskip_c(self->tno) != 0) break;
+            uvgetvr_c(self->tno, H_DBLE, "time", (char *)&t, 1);
+            if (cnt > 0 && times[cnt-1] == t) continue;
+            if (cnt == size) {
+                size = 2 * size + 64;
+                times = (double *) realloc(times, size * sizeof(double));
+                pos = (off_t *) realloc(pos, size * npos * sizeof(off_t));
+                if (times == NULL || pos == NULL)
+                    throw MiriadError("Failed to allocate index");
+            }
+            times[cnt] = t;
+            memcpy(pos + cnt * npos, cur, npos * sizeof(off_t));
+            cnt++;
+        }
+        uvrewind_c(self->tno);
+        uvseek_c(self->tno, saved, npos);
+    } catch (MiriadError &e) {
+        PyErr_Format(PyExc_RuntimeError, e.get_message());
+        ok = 0;
+    }
+    free(saved);
+    if (!ok) { free(times); free(pos); return NULL; }
+    npy_intp tdims[1] = {cnt};
+    npy_intp pdims[2] = {cnt, npos};
+    times_arr = (PyArrayObject *) PyArray_SimpleNew(1, tdims, NPY_DOUBLE);
+    pos_arr = (PyArrayObject *) PyArray_SimpleNew(2, pdims, NPY_INT64);
+    if (times_arr == NULL || pos_arr == NULL) {
+        Py_XDECREF(times_arr); Py_XDECREF(pos_arr);
+        free(times); free(pos);
+        PyErr_Format(PyExc_MemoryError, "Failed to allocate index arrays");
+        return NULL;
+    }
+    for (i=0; i < cnt; i++) IND1(times_arr,i,double) = times[i];
+    for (i=0; i < cnt * npos; i++) ((npy_int64 *)pos_arr->data)[i] = pos[i];
+    free(times); free(pos);
+    rv = Py_BuildValue("(OO)", (PyObject *)times_arr, (PyObject *)pos_arr);
+    Py_DECREF(times_arr); Py_DECREF(pos_arr);
+    return rv;
+}
+
+/* Return whether the record just read passes the baseline mask and
+ * polarization set of _select_mask. */
+static int passes_mask(UVObject *self, double *preamble) {
+    int i, j, p, pol, defpol=0;
+    if (self->blmask != NULL) {
+        i = GETI(preamble[4]);
+        j = GETJ(preamble[4]);
+        if (i < 0 || j < 0 || i >= self->nmask || j >= self->nmask) return 0;
+        if (!self->blmask[i*self->nmask + j]) return 0;
+    }
+    if (self->pols != NULL) {
+        uvrdvri_c(self->tno, "pol", &pol, &defpol);
+        for (p=0; p < self->npols; p++) if (self->pols[p] == pol) return 1;
+        return 0;
+    }
+    return 1;
+}
+
+/* Copy the channels selected by _select_chans from the spectrum just read
+ * (nread channels long) into data and flags, returning the number copied.
+ * Selected channels beyond the end of the spectrum are flagged. */
+static int gather_chans(UVObject *self, float *data, int *flags,
+        int n2read, int nread) {
+    int c, ch, n = (self->nchans < n2read) ? self->nchans : n2read;
+    for (c=0; c < n; c++) {
+        ch = self->chans[c];
+        if (ch < nread) {
+            data[2*c] = self->chan_data[2*ch];
+            data[2*c+1] = self->chan_data[2*ch+1];
+            flags[c] = self->chan_flags[ch];
+        } else {
+            data[2*c] = data[2*c+1] = 0;
+            flags[c] = 0;
+        }
+    }
+    return n;
+}
+
+/* Read the next record which passes the mask and decimation into the
+ * provided buffers, first returning any record held over by read_many.
+ * May throw MiriadError.
+ */
+static void read_next(UVObject *self, double *preamble, float *data,
+        int *flags, int n2read, int *nread) {
+    if (self->pending) {
+        self->pending = 0;
+        *nread = (self->pend_nread < n2read) ? self->pend_nread : n2read;
+        memcpy(preamble, self->pend_preamble, PREAMBLE_SIZE * sizeof(double));
+        memcpy(data, self->pend_data, 2 * *nread * sizeof(float));
+        memcpy(flags, self->pend_flags, *nread * sizeof(int));
+        return;
+    }
+    while (1) {
+        // Here is the MIRIAD call
+        if (self->chans == NULL) {
+            uvread_c(self->tno, preamble, data, flags, n2read, nread);
+        } else {
+            uvread_c(self->tno, preamble, self->chan_data, self->chan_flags,
+                self->chan_size, nread);
+            if (*nread > 0)
+                *nread = gather_chans(self, data, flags, n2read, *nread);
+        }
+        if (*nread > 0 && !passes_mask(self, preamble)) continue;
+        if (preamble[3] != self->curtime) {
+            self->intcnt += 1;
+            self->curtime = preamble[3];
+        }
+        if ((self->intcnt-self->decphase) % self->decimate == 0 || *nread==0) {
+            break;
+        }
+    }
+}
+
 /* Wrapper over uvread_c to deal with numpy arrays, conversion of baseline
  * and polarization codes, and returning a tuple of all results.
  */
@@ -99,22 +390,14 @@ PyObject * UVObject_read(UVObject *self, PyObject *args) {
     CHK_NULL(data);
     flags = (PyArrayObject *) PyArray_SimpleNew(1, data_dims, PyArray_INT);
     CHK_NULL(flags);
-    while (1) {
-        // Here is the MIRIAD call
-        try {
-            uvread_c(self->tno, preamble,
-                (float *)data->data, (int *)flags->data, n2read, &nread);
-        } catch (MiriadError &e) {
-            PyErr_Format(PyExc_RuntimeError, e.get_message());
-            return NULL;
-        }
-        if (preamble[3] != self->curtime) {
-            self->intcnt += 1;
-            self->curtime = preamble[3];
-        }
-        if ((self->intcnt-self->decphase) % self->decimate == 0 || nread==0) {
-            break;
-        }
+    try {
+        NoGIL nogil;
+        MiriadLock lock(0);
+        read_next(self, preamble,
+            (float *)data->data, (int *)flags->data, n2read, &nread);
+    } catch (MiriadError &e) {
+        PyErr_Format(PyExc_RuntimeError, e.get_message());
+        return NULL;
     }
     // Now we build a return value of ((uvw,t,(i,j)), data, flags, nread)
     npy_intp uvw_dims[1] = {3};
@@ -133,6 +416,106 @@ PyObject * UVObject_read(UVObject *self, PyObject *args) {
     return rv;
 }
 
+/* Read up to N records into preallocated C-contiguous arrays: preambles
+ * (N,5) double of (u,v,w,t,bl), data (N,nchan) complex64, and flags (N,nchan)
+ * bool, with true where data are flagged (the inverse of Miriad).  If pols is
+ * an (N,) int32 array, it is filled with the polarization of each record.  If
+ * stop is true, reading stops before the first record whose time differs
+ * from t0 (or from the first record read if t0 < 0), and that record is held
+ * over for the next read.  Returns the number of records read.
+ */
+PyObject * UVObject_read_many(UVObject *self, PyObject *args) {
+    PyArrayObject *preambles, *data, *flags, *pols=NULL;
+    PyObject *pols_obj;
+    int stop, nrec, nchan, nread, cnt, c, pol, defpol=0;
+    int *iflags;
+    double t0, *p;
+    float *d;
+    npy_bool *f;
+    if (!PyArg_ParseTuple(args, "O!O!O!Oid",
+        &PyArray_Type, &preambles, &PyArray_Type, &data,
+        &PyArray_Type, &flags, &pols_obj, &stop, &t0)) return NULL;
+    CHK_ARRAY_RANK(preambles, 2);
+    CHK_ARRAY_RANK(data, 2);
+    CHK_ARRAY_RANK(flags, 2);
+    CHK_ARRAY_TYPE(preambles, NPY_DOUBLE);
+    CHK_ARRAY_TYPE(data, NPY_CFLOAT);
+    CHK_ARRAY_TYPE(flags, NPY_BOOL);
+    nrec = DIM(data,0); nchan = DIM(data,1);
+    if (DIM(preambles,0) != nrec || DIM(preambles,1) != PREAMBLE_SIZE || \
+            DIM(flags,0) != nrec || DIM(flags,1) != nchan) {
+        PyErr_Format(PyExc_ValueError,
+            "preambles must have shape (N,5) and flags the shape of data");
+        return NULL;
+    } else if (!PyArray_ISCARRAY(preambles) || !PyArray_ISCARRAY(data) || \
+            !PyArray_ISCARRAY(flags)) {
+        PyErr_Format(PyExc_ValueError,
+            "preambles, data, and flags must be writeable and C-contiguous");
+        return NULL;
+    }
+    if (pols_obj != Py_None) {
+        if (!PyArray_Check(pols_obj)) {
+            PyErr_Format(PyExc_ValueError, "pols must be an array or None");
+            return NULL;
+        }
+        pols = (PyArrayObject *) pols_obj;
+        CHK_ARRAY_RANK(pols, 1);
+        CHK_ARRAY_TYPE(pols, NPY_INT);
+        if (DIM(pols,0) != nrec || !PyArray_ISCARRAY(pols)) {
+            PyErr_Format(PyExc_ValueError,
+                "pols must be writeable, C-contiguous, and have shape (N,)");
+            return NULL;
+        }
+    }
+    iflags = (int *) malloc(nchan * sizeof(int));
+    CHK_NULL(iflags);
+    try {
+        NoGIL nogil;
+        MiriadLock lock(0);
+        for (cnt=0; cnt < nrec; cnt++) {
+            p = (double *)(preambles->data + cnt*preambles->strides[0]);
+            d = (float *)(data->data + cnt*data->strides[0]);
+            f = (npy_bool *)(flags->data + cnt*flags->strides[0]);
+            read_next(self, p, d, iflags, nchan, &nread);
+            if (nread == 0) break;
+            if (stop) {
+                if (t0 < 0) t0 = p[3];
+                else if (p[3] != t0) {
+                    // Hold this record over for the next read
+                    if (self->pend_size < nchan) {
+                        free(self->pend_data); free(self->pend_flags);
+                        self->pend_data = (float *) malloc(2*nchan*sizeof(float));
+                        self->pend_flags = (int *) malloc(nchan*sizeof(int));
+                        self->pend_size = nchan;
+                        if (self->pend_data == NULL || self->pend_flags == NULL) {
+                            self->pend_size = 0;
+                            throw MiriadError("Failed to allocate held record");
+                        }
+                    }
+                    memcpy(self->pend_preamble, p, PREAMBLE_SIZE*sizeof(double));
+                    memcpy(self->pend_data, d, 2*nread*sizeof(float));
+                    memcpy(self->pend_flags, iflags, nread*sizeof(int));
+                    self->pend_nread = nread;
+                    self->pending = 1;
+                    break;
+                }
+            }
+            for (c=0; c < nread; c++) f[c] = !iflags[c];
+            for (; c < nchan; c++) { f[c] = 1; d[2*c] = d[2*c+1] = 0; }
+            if (pols != NULL) {
+                uvrdvri_c(self->tno, "pol", &pol, &defpol);
+                ((int *)pols->data)[cnt] = pol;
+            }
+        }
+    } catch (MiriadError &e) {
+        free(iflags);
+        PyErr_Format(PyExc_RuntimeError, e.get_message());
+        return NULL;
+    }
+    free(iflags);
+    return PyInt_FromLong(cnt);
+}
+
 /* Wrapper over uvwrite_c to deal with numpy arrays, conversion of baseline
  * codes, and accepts preamble as a tuple.
  */
@@ -169,6 +552,8 @@ PyObject * UVObject_write(UVObject *self, PyObject *args) {
     preamble[4] = MKBL(i,j);
     // Here is the MIRIAD call
     try {
+        NoGIL nogil;
+        MiriadLock lock(0);
         uvwrite_c(self->tno, preamble,
             (float *)data->data, (int *)flags->data, DIM(data,0));
     } catch (MiriadError &e) {
@@ -179,10 +564,110 @@ PyObject * UVObject_write(UVObject *self, PyObject *args) {
     return Py_None;
 }
 
+/* Write N records from C-contiguous arrays: preambles (N,5) double of
+ * (u,v,w,t,bl), data (N,nchan) complex64 and flags (N,nchan) bool (true
+ * where data are flagged).  vars is a list of (name,type,values) tuples,
+ * where values is a (N,) or (N,len) array of the Miriad type ('i','j','r',
+ * 'd') whose row is written to the variable before each record.
+ */
+PyObject * UVObject_write_many(UVObject *self, PyObject *args) {
+    PyArrayObject *preambles, *data, *flags, **arrs=NULL;
+    PyObject *vars;
+    char **names=NULL, *type;
+    int nrec, nchan, nvars, cnt, c, v, ok=1, *htypes=NULL, *lens=NULL;
+    int *iflags=NULL, npy_type;
+    npy_bool *f;
+    if (!PyArg_ParseTuple(args, "O!O!O!O!",
+        &PyArray_Type, &preambles, &PyArray_Type, &data,
+        &PyArray_Type, &flags, &PyList_Type, &vars)) return NULL;
+    CHK_ARRAY_RANK(preambles, 2);
+    CHK_ARRAY_RANK(data, 2);
+    CHK_ARRAY_RANK(flags, 2);
+    CHK_ARRAY_TYPE(preambles, NPY_DOUBLE);
+    CHK_ARRAY_TYPE(data, NPY_CFLOAT);
+    CHK_ARRAY_TYPE(flags, NPY_BOOL);
+    nrec = DIM(data,0); nchan = DIM(data,1);
+    if (DIM(preambles,0) != nrec || DIM(preambles,1) != PREAMBLE_SIZE || \
+            DIM(flags,0) != nrec || DIM(flags,1) != nchan) {
+        PyErr_Format(PyExc_ValueError,
+            "preambles must have shape (N,5) and flags the shape of data");
+        return NULL;
+    } else if (!PyArray_ISCONTIGUOUS(preambles) || \
+            !PyArray_ISCONTIGUOUS(data) || !PyArray_ISCONTIGUOUS(flags)) {
+        PyErr_Format(PyExc_ValueError,
+            "preambles, data, and flags must be C-contiguous");
+        return NULL;
+    }
+    nvars = PyList_Size(vars);
+    names = (char **) malloc((nvars+1) * sizeof(char *));
+    htypes = (int *) malloc((nvars+1) * sizeof(int));
+    lens = (int *) malloc((nvars+1) * sizeof(int));
+    arrs = (PyArrayObject **) malloc((nvars+1) * sizeof(PyArrayObject *));
+    iflags = (int *) malloc((nchan+1) * sizeof(int));
+    if (names == NULL || htypes == NULL || lens == NULL || arrs == NULL || \
+            iflags == NULL) {
+        PyErr_Format(PyExc_MemoryError, "Failed to allocate buffers");
+        ok = 0;
+    }
+    // Check the variables before writing anything
+    for (v=0; ok && v < nvars; v++) {
+        if (!PyArg_ParseTuple(PyList_GetItem(vars, v),
+                "ssO!;vars must be a list of (name,type,values)",
+                &names[v], &type, &PyArray_Type, &arrs[v])) {
+            ok = 0; break;
+        }
+        switch (type[0]) {
+            case 'i': htypes[v] = H_INT; npy_type = NPY_INT; break;
+            case 'j': htypes[v] = H_INT2; npy_type = NPY_SHORT; break;
+            case 'r': htypes[v] = H_REAL; npy_type = NPY_FLOAT; break;
+            case 'd': htypes[v] = H_DBLE; npy_type = NPY_DOUBLE; break;
+            default:
+                PyErr_Format(PyExc_ValueError,
+                    "unsupported var type for %s: %c", names[v], type[0]);
+                ok = 0; continue;
+        }
+        if (TYPE(arrs[v]) != npy_type || (RANK(arrs[v]) != 1 && \
+                RANK(arrs[v]) != 2) || DIM(arrs[v],0) != nrec || \
+                !PyArray_ISCONTIGUOUS(arrs[v]) || \
+                (RANK(arrs[v]) == 2 && DIM(arrs[v],1) < 1)) {
+            PyErr_Format(PyExc_ValueError,
+                "values for %s must be a C-contiguous (N,) or (N,len) %s",
+                names[v], "array of the var type");
+            ok = 0; continue;
+        }
+        lens[v] = (RANK(arrs[v]) == 2) ? DIM(arrs[v],1) : 1;
+    }
+    if (ok) {
+        try {
+            NoGIL nogil;
+            MiriadLock lock(0);
+            for (cnt=0; cnt < nrec; cnt++) {
+                for (v=0; v < nvars; v++)
+                    uvputvr_c(self->tno, htypes[v], names[v],
+                        arrs[v]->data + cnt*arrs[v]->strides[0], lens[v]);
+                f = (npy_bool *)(flags->data + cnt*flags->strides[0]);
+                for (c=0; c < nchan; c++) iflags[c] = !f[c];
+                uvwrite_c(self->tno,
+                    (double *)(preambles->data + cnt*preambles->strides[0]),
+                    (float *)(data->data + cnt*data->strides[0]),
+                    iflags, nchan);
+            }
+        } catch (MiriadError &e) {
+            PyErr_Format(PyExc_RuntimeError, e.get_message());
+            ok = 0;
+        }
+    }
+    free(names); free(htypes); free(lens); free(arrs); free(iflags);
+    if (!ok) return NULL;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 // A thin wrapper over uvcopyvr_c
 PyObject * UVObject_copyvr(UVObject *self, PyObject *args) {
     UVObject *uv;
     if (!PyArg_ParseTuple(args, "O!", &UVType, &uv)) return NULL;
+    MiriadLock lock;
     try {
         uvcopyvr_c(uv->tno, self->tno);
     } catch (MiriadError &e) {
@@ -197,6 +682,7 @@ PyObject * UVObject_copyvr(UVObject *self, PyObject *args) {
 PyObject * UVObject_trackvr(UVObject *self, PyObject *args) {
     char *name, *sw;
     if (!PyArg_ParseTuple(args, "ss", &name, &sw)) return NULL;
+    MiriadLock lock;
     try {
         uvtrack_c(self->tno, name, sw);
     } catch (MiriadError &e) {
@@ -225,6 +711,7 @@ PyObject * UVObject_rdvr(UVObject *self, PyObject *args) {
     npy_intp dims[1];
     PyArrayObject *rv;
     if (!PyArg_ParseTuple(args, "ss", &name, &type)) return NULL;
+    MiriadLock lock;
     uvprobvr_c(self->tno, name, value, &length, &updated);
     dims[0] = length;
     try {
@@ -284,6 +771,7 @@ PyObject * UVObject_wrvr(UVObject *self, PyObject *args) {
     PyObject *wr_val;
     PyArrayObject *wr_arr=NULL;
     if (!PyArg_ParseTuple(args, "ssO", &name, &type, &wr_val)) return NULL;
+    MiriadLock lock;
     if (PyArray_Check(wr_val)) {
         wr_arr = (PyArrayObject *) wr_val;
         CHK_ARRAY_RANK(wr_arr,1);
@@ -337,6 +825,7 @@ PyObject * UVObject_select(UVObject *self, PyObject *args) {
     double n1, n2;
     int include;
     if (!PyArg_ParseTuple(args, "sddi", &name, &n1, &n2, &include)) return NULL;
+    MiriadLock lock;
     if (strncmp(name,"decimation",5) == 0) {
         self->decimate = (long) n1;
         self->decphase = (long) n2;
@@ -352,11 +841,133 @@ PyObject * UVObject_select(UVObject *self, PyObject *args) {
     return Py_None;
 }
 
+/* Set a (N,N) boolean baseline mask and a list of polarization codes that
+ * records must match to be returned by reads.  None for either clears it.
+ * Checked in C for each record read, after any uvselect selection. */
+PyObject * UVObject_select_mask(UVObject *self, PyObject *args) {
+    PyObject *mask_obj, *pols_obj;
+    PyArrayObject *mask=NULL, *pols=NULL;
+    npy_bool *blmask=NULL;
+    int *polset=NULL, nmask=0, npols=0, i, j;
+    if (!PyArg_ParseTuple(args, "OO", &mask_obj, &pols_obj)) return NULL;
+    MiriadLock lock;
+    if (mask_obj != Py_None) {
+        mask = (PyArrayObject *) PyArray_ContiguousFromAny(mask_obj,
+            NPY_BOOL, 2, 2);
+        if (mask == NULL) return NULL;
+        if (DIM(mask,0) != DIM(mask,1)) {
+            PyErr_Format(PyExc_ValueError, "baseline mask must be square");
+            Py_DECREF(mask);
+            return NULL;
+        }
+        nmask = DIM(mask,0);
+        blmask = (npy_bool *) malloc(nmask * nmask * sizeof(npy_bool) + 1);
+        if (blmask == NULL) {
+            Py_DECREF(mask);
+            PyErr_Format(PyExc_MemoryError, "Failed to allocate blmask");
+            return NULL;
+        }
+        // Records may be labeled (i,j) or (j,i)
+        for (i=0; i < nmask; i++) for (j=0; j < nmask; j++)
+            blmask[i*nmask+j] = IND2(mask,i,j,npy_bool) || \
+                IND2(mask,j,i,npy_bool);
+        Py_DECREF(mask);
+    }
+    if (pols_obj != Py_None) {
+        pols = (PyArrayObject *) PyArray_ContiguousFromAny(pols_obj,
+            NPY_INT, 1, 1);
+        if (pols == NULL) { free(blmask); return NULL; }
+        npols = DIM(pols,0);
+        polset = (int *) malloc(npols * sizeof(int) + 1);
+        if (polset == NULL) {
+            free(blmask); Py_DECREF(pols);
+            PyErr_Format(PyExc_MemoryError, "Failed to allocate pols");
+            return NULL;
+        }
+        for (i=0; i < npols; i++) polset[i] = IND1(pols,i,int);
+        Py_DECREF(pols);
+    }
+    free(self->blmask); free(self->pols);
+    self->blmask = blmask; self->nmask = nmask;
+    self->pols = polset; self->npols = npols;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+/* Choose the channels returned by reads.  A contiguous window of channels
+ * is selected with Miriad's line selection, so only those channels are
+ * decoded.  Otherwise, spectra are decoded up to the highest
+ * channel selected and the selected channels gathered from them.  None
+ * selects all channels. */
+PyObject * UVObject_select_chans(UVObject *self, PyObject *args) {
+    PyObject *chans_obj;
+    PyArrayObject *chans;
+    int nchans, c, *chan_list=NULL, chan_size=0;
+    float *chan_data=NULL;
+    int *chan_flags=NULL;
+    if (!PyArg_ParseTuple(args, "O", &chans_obj)) return NULL;
+    MiriadLock lock;
+    try {
+        if (chans_obj == Py_None) {
+            uvset_c(self->tno, "data", "channel", 0, 1., 1., 1.);
+        } else {
+            chans = (PyArrayObject *) PyArray_ContiguousFromAny(chans_obj,
+                NPY_INT, 1, 1);
+            if (chans == NULL) return NULL;
+            nchans = DIM(chans,0);
+            for (c=0; c < nchans; c++) if (IND1(chans,c,int) < 0) break;
+            if (nchans == 0 || c < nchans) {
+                PyErr_Format(PyExc_ValueError,
+                    "chans must be a non-empty array of channels >= 0");
+                Py_DECREF(chans);
+                return NULL;
+            }
+            // Strided lines are averaged by Miriad, zeroing flagged data
+            for (c=1; c < nchans; c++)
+                if (IND1(chans,c,int) - IND1(chans,c-1,int) != 1) break;
+            if (c == nchans) {
+                uvset_c(self->tno, "data", "channel", nchans,
+                    IND1(chans,0,int) + 1., 1., 1.);
+            } else {
+                for (c=0; c < nchans; c++)
+                    if (IND1(chans,c,int) >= chan_size)
+                        chan_size = IND1(chans,c,int) + 1;
+                chan_list = (int *) malloc(nchans * sizeof(int));
+                chan_data = (float *) malloc(2 * chan_size * sizeof(float));
+                chan_flags = (int *) malloc(chan_size * sizeof(int));
+                if (chan_list==NULL || chan_data==NULL || chan_flags==NULL) {
+                    free(chan_list); free(chan_data); free(chan_flags);
+                    Py_DECREF(chans);
+                    PyErr_Format(PyExc_MemoryError, "Failed to allocate chans");
+                    return NULL;
+                }
+                for (c=0; c < nchans; c++) chan_list[c] = IND1(chans,c,int);
+                // Only decode spectra up to the highest channel selected
+                uvset_c(self->tno, "data", "channel", chan_size, 1., 1., 1.);
+            }
+            Py_DECREF(chans);
+        }
+    } catch (MiriadError &e) {
+        free(chan_list); free(chan_data); free(chan_flags);
+        PyErr_Format(PyExc_RuntimeError, e.get_message());
+        return NULL;
+    }
+    free(self->chans); free(self->chan_data); free(self->chan_flags);
+    self->chans = chan_list;
+    self->nchans = (chan_list == NULL) ? 0 : nchans;
+    self->chan_size = chan_size;
+    self->chan_data = chan_data;
+    self->chan_flags = chan_flags;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 // A thin wrapper over haccess_c
 PyObject * UVObject_haccess(UVObject *self, PyObject *args) {
     char *name, *mode;
     int item_hdl, iostat;
     if (!PyArg_ParseTuple(args, "ss", &name, &mode)) return NULL;
+    MiriadLock lock;
     try {
         haccess_c(self->tno, &item_hdl, name, mode, &iostat);
         CHK_IO(iostat);
@@ -371,6 +982,7 @@ PyObject * UVObject_haccess(UVObject *self, PyObject *args) {
 PyObject * WRAP_hdaccess(UVObject *self, PyObject *args) {
     int item_hdl, iostat;
     if (!PyArg_ParseTuple(args, "i", &item_hdl)) return NULL;
+    MiriadLock lock;
     try {
         hdaccess_c(item_hdl, &iostat);
         Py_INCREF(Py_None);
@@ -391,6 +1003,7 @@ PyObject * WRAP_hwrite_init(PyObject *self, PyObject *args) {
     int item_hdl, offset, iostat;
     char *type;
     if (!PyArg_ParseTuple(args, "is", &item_hdl, &type)) return NULL;
+    MiriadLock lock;
     try {
         switch(type[0]) {
             case 'a': INIT(char_item,H_BYTE_SIZE); break;
@@ -418,6 +1031,7 @@ PyObject * WRAP_hread_init(PyObject *self, PyObject *args) {
     int item_hdl, offset, iostat, code;
     char s[ITEM_HDR_SIZE];
     if (!PyArg_ParseTuple(args, "i", &item_hdl)) return NULL;
+    MiriadLock lock;
     try {
         hreadb_c(item_hdl,s,0,ITEM_HDR_SIZE,&iostat);
         CHK_IO(iostat);
@@ -463,6 +1077,7 @@ PyObject * WRAP_hwrite(PyObject *self, PyObject *args) {
     int in; short sh; long lg; float fl; double db; float cx[2]; char *st;
     if (!PyArg_ParseTuple(args, "iiOs", &item_hdl, &offset, &val, &type))
         return NULL;
+    MiriadLock lock;
     try {
         switch (type[0]) {
             case 'a':
@@ -536,6 +1151,7 @@ PyObject * WRAP_hread(PyObject *self, PyObject *args) {
     int in; short sh; long lg; float fl; double db; float cx[2]; char st[2];
     if (!PyArg_ParseTuple(args, "iis", &item_hdl, &offset, &type))
         return NULL;
+    MiriadLock lock;
     try {
         switch (type[0]) {
             case 'a':
@@ -592,8 +1208,18 @@ static PyMethodDef UVObject_methods[] = {
         "rewind()\nSeek to the beginning of a UV file."},
     {"raw_read", (PyCFunction)UVObject_read, METH_VARARGS,
         "_read(num)\nRead up to the specified number of channels from a spectrum.  Returns (preamble, data, flags) where preamble = (uvw,time,(ant_i,ant_j)), data = complex64 numpy array of data, flags = integer32 array of data valid where == 1.  Note that this definition of flags is the inverse of numpy's definition."},
+    {"_tell", (PyCFunction)UVObject_tell, METH_NOARGS,
+        "_tell()\nReturn the current position in the file as an int64 array, including the records which set each variable, for returning to with _seek()."},
+    {"_seek", (PyCFunction)UVObject_seek, METH_VARARGS,
+        "_seek(pos,end)\nReturn to a position from _tell() or _tindex(), restoring variables.  If end >= 0, reading stops at that offset in the variable stream until rewind()."},
+    {"_tindex", (PyCFunction)UVObject_tindex, METH_NOARGS,
+        "_tindex()\nScan the file without decoding data or applying selections and return (times,positions), the distinct times of integrations and an (N,M) int64 array of the position (see _tell()) before the first record of each."},
+    {"raw_read_many", (PyCFunction)UVObject_read_many, METH_VARARGS,
+        "raw_read_many(preambles,data,flags,pols,stop,t0)\nFill preallocated C-contiguous arrays with up to N records: preambles (N,5) float64 of (u,v,w,t,bl), data (N,nchan) complex64, flags (N,nchan) bool (True where flagged), and, unless None, pols (N,) int32.  If stop, halt before the first record whose time differs from t0 (or from the first record read if t0 < 0).  Returns the number of records read."},
     {"raw_write", (PyCFunction)UVObject_write, METH_VARARGS,
         "_write(preamble,data,flags)\nWrite the provided preamble, data, flags to file.  See _read() for definitions of preamble, data, flags."},
+    {"raw_write_many", (PyCFunction)UVObject_write_many, METH_VARARGS,
+        "raw_write_many(preambles,data,flags,vars)\nWrite N records from C-contiguous arrays: preambles (N,5) float64 of (u,v,w,t,bl), data (N,nchan) complex64, and flags (N,nchan) bool (True where flagged).  vars is a list of (name,type,values) where values is an (N,) or (N,len) array of Miriad type ('i','j','r','d') written to the variable before each record."},
     {"copyvr", (PyCFunction)UVObject_copyvr, METH_VARARGS,
         "copyvr(uv)\nCopy any variables which changed during the last read into the provided uv interface."},
     {"trackvr", (PyCFunction)UVObject_trackvr, METH_VARARGS,
@@ -604,6 +1230,10 @@ static PyMethodDef UVObject_methods[] = {
         "_wrvr(name,type,val)\nWrite a value to a variable of the provided Miriad type (see _rdvr()).  If val is an array, multiple values will be written."},
     {"_select", (PyCFunction)UVObject_select, METH_VARARGS,
         "_select(name,n1,n2,include)\nSelect which data is returned by _read().  See select() for more information."},
+    {"_select_mask", (PyCFunction)UVObject_select_mask, METH_VARARGS,
+        "_select_mask(blmask,pols)\nOnly return records whose baseline (i,j) is True in the (N,N) boolean array blmask and whose polarization code is in the sequence pols.  None for either removes that criterion.  See select_mask() for more information."},
+    {"_select_chans", (PyCFunction)UVObject_select_chans, METH_VARARGS,
+        "_select_chans(chans)\nOnly return the channels with the provided indices (in order) from reads.  None returns all channels.  See select_chans() for more information."},
     {"haccess", (PyCFunction)UVObject_haccess, METH_VARARGS,
         "haccess(name,mode)\nOpen a header item in the given mode ('read','write').  Returns an integer handle."},
     {NULL}  /* Sentinel */
@@ -675,6 +1305,9 @@ PyMODINIT_FUNC init_miriad(void) {
     PyObject* m;
     UVType.tp_new = PyType_GenericNew;
     if (PyType_Ready(&UVType) < 0) return;
+    PyEval_InitThreads();
+    miriad_lock = PyThread_allocate_lock();
+    if (miriad_lock == NULL) return;
     m = Py_InitModule3("_miriad", _miriad_methods,
     "This is a hand-written Python wrapper (by Aaron Parsons) for MIRIAD.");
     import_array();
@@ -6,6 +6,7 @@
  */
 #include "miriad.h"
 #include <Python.h>
+#include "pythread.h"
 #include "numpy/arrayobject.h"
 #include <string>
 #include "hio.h"
@@ -274,7 +274,9 @@ class AntennaArray(phs.AntennaArray):
     def set_jultime(self, t=None):
         """Set current time as a Julian date."""
         phs.AntennaArray.set_jultime(self, t=t)
-        self.eq2top_m = coord.eq2top_m(-self.sidereal_time(), self.lat)
+        lst = self.sidereal_time()
+        self.eq2top_m = self._memoize('eq2top', lst,
+            coord.eq2top_m, -lst, self.lat)
         self._cache = None
     def passband(self, i, j):
         """Return the passband response of baseline i,j."""
@@ -284,16 +286,23 @@ class AntennaArray(phs.AntennaArray):
         for baseline i,j with the specified polarization."""
         assert(pol in ('xx','yy','xy','yx'))
         p1, p2 = pol
-        # Check that we have cached results needed.  If not, cache them.
-        for c,p in zip([i,j], [p1,p2]):
-            if not self._cache.has_key(c): self._cache[c] = {}
-            if not self._cache[c].has_key(p):
-                x,y,z = self._cache['s_top']
+        return self._bm_cache(i, p1) * n.conjugate(self._bm_cache(j, p2))
+    def _bm_cache(self, c, p):
+        """Return the beam response of antenna c (single polarization p) 
+        towards the cached source positions, caching it if necessary."""
+        if not self._cache.has_key(c): self._cache[c] = {}
+        if not self._cache[c].has_key(p):
+            x,y,z = self._cache['s_top']
+            if len(x.shape) == 1:
                 resp = self[c].bm_response((x,y,z), pol=p).transpose()
-                self._cache[c][p] = resp
-        return self._cache[i][p1] * n.conjugate(self._cache[j][p2])
+            else: # Time-batched cache: evaluate all (time,src) at once
+                resp = self[c].bm_response((x.flatten(), y.flatten(),
+                    z.flatten()), pol=p).transpose()
+                resp = n.reshape(resp, x.shape + (resp.shape[-1],))
+            self._cache[c][p] = resp
+        return self._cache[c][p]
     def sim_cache(self, s_eqs, jys=n.array([1.]), mfreqs=0.150,
-            ionrefs=(0.,0.), srcshapes=(0,0,0)):
+            ionrefs=(0.,0.), srcshapes=(0,0,0), jultimes=None):
         """Cache intermediate computations given catalog information to speed
         simulation for multiple baselines.  For efficiency, should only be 
         called once per time setting.  MUST be called before sim().
@@ -304,12 +313,31 @@ class AntennaArray(phs.AntennaArray):
             frequency `mfreq'.
         srcshapes = (a1,a2,th) where a1,a2 are angular sizes along the 
             semimajor, semiminor axes, and th is the angle (in radians) of
-            the semimajor axis from E."""
-        # Get topocentric coordinates of all srcs
-        src_top = n.dot(self.eq2top_m, s_eqs)
-        # Throw out everything that is below the horizon
-        valid = src_top[2,:] > 0
-        if n.all(valid == 0): self._cache = {}
+            the semimajor axis from E.
+        jultimes = optional array of Julian dates.  If provided, sources
+            are cached for all of these times at once (instead of the
+            current time), and sim() and sim_all() return results with
+            a time axis.  In this case, s_eqs may also be an 
+            (Ntime,3,Nsrc) array of per-time source positions."""
+        if jultimes is None:
+            # Get topocentric coordinates of all srcs
+            src_top = n.dot(self.eq2top_m, s_eqs)
+            # Throw out everything that is below the horizon
+            valid = src_top[2,:] > 0
+        else:
+            # Stack topocentric rotations for all times into (Ntime,3,3)
+            lsts = self.get_lsts(jultimes)
+            eq2top_m = coord.eq2top_m(-lsts, self.lat * n.ones_like(lsts))
+            if len(s_eqs.shape) == 2: src_top = n.dot(eq2top_m, s_eqs)
+            else: src_top = (eq2top_m[...,n.newaxis] * \
+                s_eqs[:,n.newaxis]).sum(axis=2)
+            src_top = src_top.transpose([1,0,2])
+            # Only throw out srcs that are below the horizon at all times
+            t_valid = src_top[2] > 0
+            valid = n.any(t_valid, axis=0)
+        if n.all(valid == 0):
+            if jultimes is None: self._cache = {}
+            else: self._cache = {'lsts': lsts}
         else:
             jys = jys.compress(valid, axis=0)
             try:
@@ -327,8 +355,8 @@ class AntennaArray(phs.AntennaArray):
                 dra = dra.compress(valid)
                 ddec = ddec.compress(valid)
             except(AttributeError): pass
-            src_top = src_top.compress(valid, axis=1)
-            s_eqs = s_eqs.compress(valid, axis=1)
+            src_top = src_top.compress(valid, axis=-1)
+            s_eqs = s_eqs.compress(valid, axis=-1)
             # Get src fluxes vs. freq
             self._cache = {
                 'jys':   jys,
@@ -337,14 +365,21 @@ class AntennaArray(phs.AntennaArray):
                 's_top': src_top,
                 's_shp': (a1,a2,th),
                 'i_ref': (dra,ddec),
+                's_ind': n.arange(valid.size).compress(valid),
             }
+            if not jultimes is None:
+                self._cache['lsts'] = lsts
+                self._cache['valid'] = t_valid.compress(valid, axis=1)
     def sim(self, i, j, pol='xx'):
         """Simulate visibilites for the specified (i,j) baseline and 
         polarization.  sim_cache() must be called at each time step before 
-        this will return valid results."""
+        this will return valid results.  If sim_cache() was given jultimes,
+        an (Ntime,Nchan) array is returned."""
         assert(pol in ('xx','yy','xy','yx'))
         if self._cache is None:
             raise RuntimeError('sim_cache() must be called before the first sim() call at each time step.')
+        elif self._cache.has_key('lsts'):
+            return self._sim_times(i, j, pol)
         elif self._cache == {}:
             return n.zeros_like(self.passband(i,j))
         s_eqs = self._cache['s_eqs']
@@ -363,3 +398,147 @@ class AntennaArray(phs.AntennaArray):
         GBIE_sf = Gij_sf * Bij_sf * I_sf * E_sf
         Vij_f = GBIE_sf.sum(axis=0)
         return Vij_f
+    def _ant_crds_times(self):
+        """Return the positions of all antennas projected toward every
+        (time,src) of a time-batched cache as an (3,Nant,Ntime,Nsrc) array
+        (see get_ant_crds()), caching it if necessary."""
+        if not self._cache.has_key('ant_crds'):
+            s_eqs = self._cache['s_eqs']
+            if len(s_eqs.shape) == 3: s_eqs = s_eqs.transpose([1,0,2])
+            ra,dec = coord.eq2radec(s_eqs)
+            ha = self._cache['lsts'][:,n.newaxis] - ra
+            dec = dec * n.ones_like(ha)
+            m = coord.eq2top_m(ha.flatten(), dec.flatten())
+            pos = n.array([a.pos for a in self])
+            crds = n.dot(m, pos.transpose())
+            crds.shape = ha.shape + crds.shape[1:]
+            self._cache['ant_crds'] = crds.transpose([2,3,0,1])
+        return self._cache['ant_crds']
+    def _sim_times(self, i, j, pol):
+        """Simulate baseline i,j at all times held in a time-batched cache 
+        (see sim_cache()), returning an (Ntime,Nchan) array."""
+        afreqs = self.get_afreqs()
+        if not self._cache.has_key('s_eqs'):
+            return n.zeros((self._cache['lsts'].size, afreqs.size),
+                dtype=n.complex)
+        x,y,z = self._ant_crds_times()
+        x,y,z = x[j] - x[i], y[j] - y[i], z[j] - z[i]
+        nsrc = x.shape[-1]
+        f = n.reshape(afreqs, (1,1,afreqs.size))
+        u,v,w = x[...,n.newaxis]*f, y[...,n.newaxis]*f, z[...,n.newaxis]*f
+        w += self.refract(u, v, mfreq=self._cache['mfreq'],
+            ionref=self._cache['i_ref'])
+        E_tsf = n.exp(2j*n.pi*(w + self.get_phs_offset(i,j)))
+        a1,a2,th = [n.resize(c, (1,nsrc,1)) for c in self._cache['s_shp']]
+        E_tsf *= n.reshape(self.resolve_src(u, v, srcshape=(a1,a2,th)),
+            u.shape)
+        I_tsf = self._cache['jys'] * self._cache['valid'][...,n.newaxis]
+        B_tsf = self.bm_response(i, j, pol=pol)
+        return self.passband(i,j) * (B_tsf * I_tsf * E_tsf).sum(axis=1)
+    def sim_all(self, bls=None, pols='xx', blk=64):
+        """Simulate visibilities for many baselines in one vectorized pass,
+        returning an (Nbl,Nchan) array with rows ordered as in bls (or an
+        (Nbl,Ntime,Nchan) array if sim_cache() was given jultimes).
+        bls = list of (i,j) pairs or Miriad baseline indices.  Default is
+            all baselines returned by bl_indices().
+        pols = polarization for all baselines, or a list of polarizations
+            with one entry per baseline.
+        blk = number of baselines computed together.  Bounds the size of
+            the intermediate (bl,src,freq) arrays (or, with jultimes, the
+            number of (bl,time) rows of (src,freq) computed together).
+        sim_cache() must be called at each time step before this will
+        return valid results."""
+        if self._cache is None:
+            raise RuntimeError('sim_cache() must be called before the first sim_all() call at each time step.')
+        if bls is None: bls = self.bl_indices()
+        ij = []
+        for bl in bls:
+            if type(bl) in (tuple,list): ij.append(tuple(bl))
+            else: ij.append(self.bl2ij(bl))
+        if type(pols) == str: pols = [pols] * len(ij)
+        assert(len(pols) == len(ij))
+        for pol in pols: assert(pol in ('xx','yy','xy','yx'))
+        afreqs = self.get_afreqs()
+        if self._cache.has_key('lsts'): return self._sim_all_times(ij, pols, blk)
+        vis = n.zeros((len(ij), afreqs.size), dtype=n.complex)
+        if self._cache == {} or len(ij) == 0: return vis
+        s_eqs = self._cache['s_eqs']
+        nsrc = s_eqs.shape[1]
+        # Baseline coordinates and phases are formed from per-antenna terms
+        x_as,y_as,z_as = self.get_ant_crds(s_eqs)
+        phs_asf = self.gen_ant_phs(s_eqs, mfreq=self._cache['mfreq'],
+            ionref=self._cache['i_ref'])
+        gain_af = n.array([a.passband() for a in self])
+        # Stack beam responses of each (antenna,pol) used as (src,freq)
+        bm_keys, bm_ind = [], {}
+        for (i,j),(p1,p2) in zip(ij, pols):
+            for k in [(i,p1), (j,p2)]:
+                if not bm_ind.has_key(k):
+                    bm_ind[k] = len(bm_keys)
+                    bm_keys.append(k)
+        bm_ksf = n.array([n.reshape(self._bm_cache(c,p), (nsrc,afreqs.size))
+            for c,p in bm_keys])
+        bm_i = n.array([bm_ind[(i,p1)] for (i,j),(p1,p2) in zip(ij,pols)])
+        bm_j = n.array([bm_ind[(j,p2)] for (i,j),(p1,p2) in zip(ij,pols)])
+        ij = n.array(ij, dtype=n.int)
+        # Source terms, broadcastable against (bl,src,freq)
+        I_sf = n.array(self._cache['jys'])[n.newaxis]
+        a1,a2,th = [n.resize(c, (1,nsrc,1)) for c in self._cache['s_shp']]
+        f = n.reshape(afreqs, (1,1,afreqs.size))
+        for b0 in range(0, len(ij), blk):
+            i, j = ij[b0:b0+blk,0], ij[b0:b0+blk,1]
+            u = (x_as[j] - x_as[i])[...,n.newaxis] * f
+            v = (y_as[j] - y_as[i])[...,n.newaxis] * f
+            E_bsf = n.conjugate(phs_asf[j]) * phs_asf[i]
+            E_bsf *= n.reshape(self.resolve_src(u, v, srcshape=(a1,a2,th)),
+                u.shape)
+            G_bsf = (gain_af[i] * n.conjugate(gain_af[j]))[:,n.newaxis,:]
+            B_bsf = bm_ksf[bm_i[b0:b0+blk]] * \
+                n.conjugate(bm_ksf[bm_j[b0:b0+blk]])
+            vis[b0:b0+blk] = (G_bsf * B_bsf * I_sf * E_bsf).sum(axis=1)
+        return vis
+    def _sim_all_times(self, ij, pols, blk):
+        """sim_all() for a time-batched cache: for each block of times,
+        phasors are formed once per antenna and multiplied together in blocks
+        of baselines.  Blocks hold about blk (baseline,time) rows of
+        (src,freq), and the per-antenna phasors max(blk,Nant) rows."""
+        afreqs = self.get_afreqs()
+        ntime = self._cache['lsts'].size
+        vis = n.zeros((len(ij), ntime, afreqs.size), dtype=n.complex)
+        if not self._cache.has_key('s_eqs') or len(ij) == 0: return vis
+        nsrc = self._cache['s_eqs'].shape[-1]
+        crds = self._ant_crds_times()
+        f = n.reshape(afreqs, (1,1,1,afreqs.size))
+        phsoff = n.array([a.phsoff for a in self])[:,n.newaxis,n.newaxis,:]
+        gain_af = n.array([a.passband() for a in self])
+        jys, valid = self._cache['jys'], self._cache['valid']
+        a1,a2,th = [n.resize(c, (1,1,nsrc,1)) for c in self._cache['s_shp']]
+        ij = n.array(ij, dtype=n.int)
+        nt = max(1, min(ntime, blk / len(self)))
+        nbl = max(1, blk / nt)
+        for t0 in range(0, ntime, nt):
+            t = slice(t0, t0+nt)
+            # Per-antenna phasors exp(2j*pi*(w+phsoff)) as (ant,time,src,freq)
+            x_ats,y_ats,z_ats = crds[:,:,t]
+            w = z_ats[...,n.newaxis] * f
+            w += self.refract(x_ats[...,n.newaxis] * f,
+                y_ats[...,n.newaxis] * f, mfreq=self._cache['mfreq'],
+                ionref=self._cache['i_ref'])
+            w += phsoff
+            phs_atsf = n.exp(2j*n.pi*w)
+            del(w)
+            I_tsf = jys * valid[t,:,n.newaxis]
+            for b0 in range(0, len(ij), nbl):
+                i, j = ij[b0:b0+nbl,0], ij[b0:b0+nbl,1]
+                u = (x_ats[j] - x_ats[i])[...,n.newaxis] * f
+                v = (y_ats[j] - y_ats[i])[...,n.newaxis] * f
+                E_btsf = phs_atsf[j] * n.conjugate(phs_atsf[i])
+                E_btsf *= n.reshape(self.resolve_src(u, v,
+                    srcshape=(a1,a2,th)), u.shape)
+                B_btsf = n.array([self._bm_cache(bi,p1)[t] *
+                    n.conjugate(self._bm_cache(bj,p2)[t])
+                    for bi,bj,(p1,p2) in zip(i, j, pols[b0:b0+nbl])])
+                G_btf = (gain_af[i] * n.conjugate(gain_af[j]))[:,n.newaxis,:]
+                vis[b0:b0+nbl,t] = G_btf * \
+                    (B_btsf * I_tsf * E_btsf).sum(axis=2)
+        return vis
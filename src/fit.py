@@ -2,7 +2,7 @@
 Module for reading and setting parameters in components of an AntennaArray
 simulation for purpose of fitting.
 """
-import amp, numpy as n
+import amp, ephem, _cephes, numpy as n
 
 #  _   _ _   _ _ _ _           _____                 _   _                 
 # | | | | |_(_) (_) |_ _   _  |  ___|   _ _ __   ___| |_(_) ___  _ __  ___ 
@@ -372,3 +372,135 @@ class AntennaArray(amp.AntennaArray):
             except(KeyError): pass
         if changed: self.update()
         return changed
+    def _app_deriv(self, src, prm, eps=1e-6):
+        """Return the change in apparent (ra,dec) of src per unit change in
+        its catalog 'ra' or 'dec' (which includes precession to the current
+        epoch), by differencing positions computed by ephem."""
+        crds, val = [], getattr(src, '_'+prm)
+        for dp in (-eps, eps):
+            setattr(src, '_'+prm, val + dp)
+            ephem.FixedBody.compute(src, self)
+            crds.append((src.ra, src.dec))
+        setattr(src, '_'+prm, val)
+        ephem.FixedBody.compute(src, self)
+        d_ra = (crds[1][0] - crds[0][0] + n.pi) % (2*n.pi) - n.pi
+        return d_ra / (2*eps), (crds[1][1] - crds[0][1]) / (2*eps)
+    def sim_grad(self, i, j, cat, key_list, pol='xx', srcs=None):
+        """Return the derivative of sim(i,j,pol) with respect to each entry 
+        of a parameter list flattened by flatten_prms(), as an (Nprm,Nchan) 
+        array.  Derivatives are analytic, and supported for source 'jys', 
+        'index', 'ra', 'dec', 'dra', 'ddec' and antenna 'x', 'y', 'z', 
+        'dly', 'off', 'phsoff', 'amp', 'bp_r', 'bp_i'.  The (slow) variation 
+        of beam response with source position is neglected.
+        cat = SrcCatalog holding the sources passed to sim_cache()
+        key_list = parameter indexing returned by flatten_prms().  Entries
+            for several objects may share an index (shared parameters), in 
+            which case their derivatives are summed.
+        srcs = names of sources, in the order passed to sim_cache().  
+            Default is cat.keys().
+        sim_cache() must be called (without jultimes) at each time step 
+        before this will return valid results."""
+        cache = getattr(self, '_cache', None)
+        if cache is None or cache.has_key('lsts'):
+            raise RuntimeError('sim_cache() must be called (without jultimes) before sim_grad().')
+        if srcs is None: srcs = cat.keys()
+        f = self.get_afreqs()
+        nprm = max([0] + [ind+L for prms in key_list.values() 
+            for ind,L in prms.values()])
+        grad = n.zeros((nprm, f.size), dtype=n.complex)
+        if self._cache == {}: return grad
+        # Per-source terms of the visibility, V = G * (B*I*R*E).sum(0)
+        s_eqs, s_ind = self._cache['s_eqs'], self._cache['s_ind']
+        nsrc = s_ind.size
+        m = n.reshape(self._src2top_m(s_eqs), (nsrc,3,3))
+        x,y,z = self.get_ant_crds(s_eqs)
+        u_sf = n.outer(x[j] - x[i], f)
+        v_sf = n.outer(y[j] - y[i], f)
+        mfreq = n.resize(self._cache['mfreq'], (nsrc,1))
+        dra,ddec = [n.resize(c, (nsrc,1)) for c in self._cache['i_ref']]
+        a1,a2,th = [n.resize(c, (nsrc,1)) for c in self._cache['s_shp']]
+        ru = a1 * (u_sf*n.cos(th) - v_sf*n.sin(th))
+        rv = a2 * (u_sf*n.sin(th) + v_sf*n.cos(th))
+        r = 2*n.pi*n.sqrt(ru**2 + rv**2)
+        R_sf = n.where(r == 0, 1, 2*_cephes.j1(r)/n.where(r == 0, 1, r))
+        # dR/dr / r = -2 J_2(r) / r**2, with a series expansion near r = 0
+        rs = n.where(r < 1e-3, 1, r)
+        dR = n.where(r < 1e-3, 1./8 - r**2/96, 
+            (2*_cephes.j1(rs)/rs - _cephes.j0(rs)) / rs**2)
+        dR *= -2 * (2*n.pi)**2
+        dRdu = dR * (ru*a1*n.cos(th) + rv*a2*n.sin(th))
+        dRdv = dR * (-ru*a1*n.sin(th) + rv*a2*n.cos(th))
+        E_sf = n.conjugate(self.gen_phs(s_eqs, i, j, mfreq=mfreq,
+            ionref=(dra,ddec)))
+        E_sf = n.reshape(E_sf, u_sf.shape)
+        BE_sf = n.reshape(self.bm_response(i,j,pol=pol), u_sf.shape) * E_sf
+        I_sf = n.reshape(self._cache['jys'], u_sf.shape)
+        S_f = (BE_sf * I_sf * R_sf).sum(axis=0)
+        G_f = self.passband(i,j)
+        ref_sf = mfreq**2 / f**2
+        def dbl(du, dv, dw):
+            # Derivative of V for per-source changes (du,dv,dw) to the
+            # baseline, including refraction and source resolution
+            du, dv = n.outer(du, f), n.outer(dv, f)
+            dw = n.outer(dw, f) + (dra*du + ddec*dv) * ref_sf
+            dT = BE_sf * I_sf * (2j*n.pi*dw*R_sf + dRdu*du + dRdv*dv)
+            return G_f * dT.sum(axis=0)
+        def poly_der(L):
+            return n.array([f**(L-1-c) for c in range(L)])
+        for obj in key_list:
+            if cat.has_key(obj):
+                try: k = list(s_ind).index(list(srcs).index(obj))
+                except(ValueError): continue
+                src = cat[obj]
+                for prm, (ind,L) in key_list[obj].items():
+                    if prm == 'jys':
+                        spec = (f / src.mfreq)**src.index
+                        d = G_f * BE_sf[k] * spec * R_sf[k]
+                    elif prm == 'index':
+                        d = G_f*BE_sf[k]*I_sf[k]*R_sf[k]*n.log(f/src.mfreq)
+                    elif prm in ('ra','dec'):
+                        sH,cH = m[k,0,0], m[k,0,1]
+                        sd,cd = m[k,2,2], m[k,1,2]
+                        # Derivatives of eq2top_m w.r.t. apparent ra,dec
+                        dm_ra = n.array([[-cH, sH, 0], [-sd*sH,-sd*cH, 0],
+                            [cd*sH, cd*cH, 0]])
+                        dm_dec = n.array([[0, 0, 0], [-cd*cH, cd*sH, -sd],
+                            [-sd*cH, sd*sH, cd]])
+                        d_ra, d_dec = self._app_deriv(src, prm)
+                        dm = d_ra * dm_ra + d_dec * dm_dec
+                        bl = self[j].pos - self[i].pos
+                        du,dv,dw = n.zeros((3,nsrc))
+                        du[k],dv[k],dw[k] = n.dot(dm, bl)
+                        d = dbl(du, dv, dw)
+                    elif prm in ('dra','ddec'):
+                        uv = {'dra':u_sf, 'ddec':v_sf}[prm]
+                        d = G_f * (2j*n.pi * BE_sf[k]*I_sf[k]*R_sf[k] * 
+                            uv[k] * ref_sf[k])
+                    else: raise ValueError('No analytic gradient for %s of %s' % (prm, obj))
+                    grad[ind:ind+L] += d
+                continue
+            try: a = int(obj)
+            except(ValueError): continue
+            sgn = int(a == j) - int(a == i)
+            ant = self[a]
+            bp = n.polyval(ant.bp_r, f) + 1j*n.polyval(ant.bp_i, f)
+            for prm, (ind,L) in key_list[obj].items():
+                if prm in ('x','y','z'):
+                    c = 'xyz'.index(prm)
+                    d = sgn * dbl(m[:,0,c], m[:,1,c], m[:,2,c])
+                elif prm in ('phsoff','dly','off'):
+                    P = poly_der(len(ant._phsoff))
+                    if prm == 'dly': P = P[-2:-1]
+                    elif prm == 'off': P = P[-1:]
+                    d = sgn * 2j*n.pi * P * G_f * S_f
+                elif prm in ('amp','bp_r','bp_i'):
+                    if prm == 'amp': dg = bp
+                    elif prm == 'bp_r': dg = ant.amp * poly_der(L)
+                    else: dg = 1j * ant.amp * poly_der(L)
+                    dG = 0
+                    if a == i: dG = dG + dg * self[j].passband(conj=True)
+                    if a == j: dG = dG + self[i].passband() * n.conjugate(dg)
+                    d = dG * S_f
+                else: raise ValueError('No analytic gradient for %s of %s' % (prm, obj))
+                grad[ind:ind+L] += d
+        return grad
@@ -6,7 +6,7 @@ radio telescopes.
 
 __version__ = '0.1.1'
 
-import numpy as n, _miriad
+import numpy as n, _miriad, threading, Queue, sys, os
 
 def echo(uv, p, d): return p, d
 
@@ -57,6 +57,13 @@ data_types = {
     'i' : "integer (32 bit two's complement)",
 }
 
+var_dtypes = {
+    'i' : n.int32,
+    'j' : n.int16,
+    'r' : n.float32,
+    'd' : n.double,
+}
+
 #  _   ___     __
 # | | | \ \   / /
 # | | | |\ \ / / 
@@ -71,7 +78,10 @@ class UV(_miriad.UV):
         assert(status in ['old', 'new', 'append'])
         assert(corrmode in ['r', 'j'])
         _miriad.UV.__init__(self, filename, status, corrmode)
+        self.filename = filename
         self.status = status
+        self._index = None
+        self.chans = None
         self.nchan = 4096
         if status == 'old':
             self.vartable = self._gen_vartable()
@@ -206,23 +216,233 @@ class UV(_miriad.UV):
                     discarded. Ignored for 'and','or','clear'."""
         if name == 'antennae':
             n1 += 1; n2 += 1
+        elif name == 'clear': self._select_mask(None, None)
         self._select(name, float(n1), float(n2), int(include))
-    def read(self, raw=False):
+    def select_mask(self, blmask=None, pols=None):
+        """Choose which data are returned by read() with a precompiled
+        selection that is checked in C for each record (after any selection
+        made with select()), replacing any previous mask.
+            blmask  A (N,N) boolean array which is True for baselines (i,j)
+                    (indexed from 0) to be returned.  Only one of (i,j) and
+                    (j,i) need be set.  Baselines with antennas >= N are
+                    discarded.  None returns all baselines.
+            pols    A list of polarization codes (see str2pol) to be
+                    returned.  None returns all polarizations.
+        Unlike select('antennae',...), the cost per record does not depend
+        on the number of baselines selected, and antenna numbers are not
+        limited by Miriad's MAXANT."""
+        if not blmask is None: blmask = n.asarray(blmask, dtype=n.bool_)
+        if not pols is None: pols = n.asarray(pols, dtype=n.int32)
+        self._select_mask(blmask, pols)
+    def select_chans(self, chans=None):
+        """Choose which channels are returned by read(), read_many(), etc.
+        chans is an array of channel indices (e.g. from
+        scripting.parse_chans), and data and flags will contain only those
+        channels, in that order.  A contiguous window of channels is
+        selected with Miriad's line selection, so other channels are never
+        decoded; otherwise channels are gathered in C.  None returns all
+        channels.  Variables (nchan, sfreq, etc.) are not changed."""
+        try: nchan = self['nchan']
+        except(KeyError): nchan = 4096
+        if chans is None:
+            self._select_chans(None)
+            self.nchan = nchan
+            self.chans = None
+        else:
+            chans = n.asarray(chans, dtype=n.int32).flatten()
+            if chans.size > 0 and chans.max() >= nchan:
+                raise ValueError('Channel %d >= nchan' % chans.max())
+            self._select_chans(chans)
+            self.nchan = chans.size
+            self.chans = chans
+    def time_index(self, save=True):
+        """Return (times, positions), where times is an array of the times
+        of the integrations in the file and positions holds the position
+        (including the records setting each variable) before the first
+        record of each, for seeking with _seek().  The index is built by
+        scanning the file without decoding data, and saved (if save) in
+        the file as the item 'tindex.npz', to be reused while the data are
+        unchanged."""
+        if not self._index is None: return self._index
+        indexfile = os.path.join(self.filename, 'tindex.npz')
+        vis = os.stat(os.path.join(self.filename, 'visdata'))
+        stamp = n.array([vis.st_size, vis.st_mtime])
+        try:
+            f = n.load(indexfile)
+            times, positions = f['times'], f['positions']
+            if not n.all(f['stamp'] == stamp) or \
+                    positions.shape[1] != self._tell().size:
+                raise ValueError('Index is out of date')
+        except(IOError, KeyError, ValueError):
+            times, positions = self._tindex()
+            if save:
+                try: n.savez(indexfile, times=times, positions=positions,
+                    stamp=stamp)
+                except(IOError, OSError): pass
+        self._index = (times, positions)
+        return self._index
+    def times(self):
+        """Return an array of the times of the integrations in the file
+        (see time_index)."""
+        return self.time_index()[0]
+    def seek_time(self, t):
+        """Position reading at the first integration whose time is >= t,
+        using the index of time_index instead of reading the records
+        before it.  Variables are those of the record preceding it (as
+        if read sequentially).  Returns the time of that integration, or
+        None (and reads return no data until rewind) if there is none.
+        Integrations are assumed to be in time order."""
+        times, positions = self.time_index()
+        i = n.searchsorted(times, t)
+        if i == times.size:
+            pos = self._tell()[:4]
+            self._seek(pos, pos[0])
+            return None
+        self._seek(positions[i], -1)
+        return times[i]
+    def select_times(self, t0, t1):
+        """Read only integrations with t0 <= time <= t1: seek to the first
+        as in seek_time, and stop reading after the last, until rewind().
+        Returns the array of times selected."""
+        times, positions = self.time_index()
+        i0 = n.searchsorted(times, t0, side='left')
+        i1 = n.searchsorted(times, t1, side='right')
+        if i0 >= i1:
+            pos = self._tell()[:4]
+            self._seek(pos, pos[0])
+        elif i1 < times.size: self._seek(positions[i0], positions[i1,0])
+        else: self._seek(positions[i0], -1)
+        return times[i0:i1]
+    def read(self, raw=False, out=None):
         """Return the next data record.  Calling this function causes 
         vars to change to reflect the record which this function returns.
-        'raw' causes data and flags to be returned seperately."""
-        preamble, data, flags, nread = self.raw_read(self.nchan)
-        if nread == 0: raise IOError("No data read")
-        flags = n.logical_not(flags)
+        'raw' causes data and flags to be returned seperately.  If out is
+        (preamble,data,flags), where preamble is a (5,) float64 array, data
+        is a (nchan,) complex64 array and flags is a (nchan,) boolean array
+        (see mk_buffers), the record is read into these arrays in place,
+        and the uvw, data and flags returned are views of them."""
+        if out is None:
+            preamble, data, flags, nread = self.raw_read(self.nchan)
+            if nread == 0: raise IOError("No data read")
+            flags = n.logical_not(flags)
+        else:
+            pre, data, flags = out
+            for a in out:
+                if not a.flags.c_contiguous or a.ndim != 1:
+                    raise ValueError('out arrays must be 1D and C-contiguous')
+            nread = self.raw_read_many(pre.reshape(1,pre.size),
+                data.reshape(1,data.size), flags.reshape(1,flags.size),
+                None, 0, -1.)
+            if nread == 0: raise IOError("No data read")
+            preamble = (pre[:3], pre[3], bl2ij(pre[4]))
         if raw: return preamble, data, flags
-        return preamble, n.ma.array(data, mask=flags)
-    def all(self, raw=False):
+        return preamble, n.ma.array(data, mask=flags, copy=False)
+    def mk_buffers(self):
+        """Return (preamble,data,flags) arrays for reading records in place
+        with read(out=...)."""
+        return (n.empty((5,), dtype=n.double),
+            n.empty((self.nchan,), dtype=n.complex64),
+            n.empty((self.nchan,), dtype=n.bool_))
+    def read_many(self, nrecords, stop_at_int=False, pols=False, t0=-1):
+        """Read up to nrecords data records in one call, returning
+        (preambles, data, flags), where preambles is a (N,5) float64 array
+        of (u,v,w,t,bl) (bl is a Miriad baseline code; see bl2ij), data is a
+        (N,nchan) complex64 array and flags is a (N,nchan) boolean array
+        which is True where data are flagged.  N < nrecords when the file
+        ends, or if stop_at_int, at the first record whose time differs
+        from t0 (default is the time of the first record read), which is
+        then returned by the next read.  If pols, also return a (N,) array of
+        polarization codes.  Variables reflect the last record read from
+        the file, which is the held-over record if stop_at_int stopped."""
+        preambles = n.empty((nrecords, 5), dtype=n.double)
+        data = n.empty((nrecords, self.nchan), dtype=n.complex64)
+        flags = n.empty((nrecords, self.nchan), dtype=n.bool_)
+        if pols: pols = n.empty((nrecords,), dtype=n.int32)
+        else: pols = None
+        cnt = self.raw_read_many(preambles, data, flags, pols,
+            int(stop_at_int), float(t0))
+        rv = (preambles[:cnt], data[:cnt], flags[:cnt])
+        if pols is None: return rv
+        return rv + (pols[:cnt],)
+    def read_block(self, pols=False, blocksize=256, t0=-1):
+        """Read all records of the next integration in arrays as returned
+        by read_many.  Records are read blocksize at a time, so blocksize
+        should be at least the expected number of records per integration.
+        If t0 >= 0, only records with that time are read (so the block is
+        empty if the next record has another time).  Returns empty arrays
+        at the end of the file."""
+        blocks = [self.read_many(blocksize, stop_at_int=True, pols=pols,
+            t0=t0)]
+        if t0 < 0 and blocks[0][0].shape[0] > 0: t0 = blocks[0][0][0,3]
+        while t0 >= 0 and blocks[-1][0].shape[0] == blocksize:
+            blocks.append(self.read_many(blocksize, stop_at_int=True,
+                pols=pols, t0=t0))
+        if len(blocks) == 1: return blocks[0]
+        return tuple([n.concatenate(b) for b in zip(*blocks)])
+    def prefetch(self, blocksize=128, depth=2, pols=False):
+        """Iterate over blocks of records as returned by read_many(blocksize)
+        which are read on a background thread, up to depth blocks ahead of
+        the caller, so that reading overlaps processing.  Variables do not
+        track the records yielded, and this UV should not be otherwise used
+        until the iteration ends (or the iterator is closed)."""
+        q, done = Queue.Queue(depth), threading.Event()
+        def put(item):
+            while not done.isSet():
+                try: q.put(item, timeout=.1); return
+                except(Queue.Full): pass
+        def reader():
+            try:
+                while not done.isSet():
+                    block = self.read_many(blocksize, pols=pols)
+                    if block[0].shape[0] == 0: break
+                    put((block, None))
+                put((None, None))
+            except: put((None, sys.exc_info()))
+        thread = threading.Thread(target=reader)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                block, err = q.get()
+                if not err is None: raise err[0], err[1], err[2]
+                if block is None: return
+                yield block
+        finally:
+            done.set()
+            thread.join()
+    def all(self, raw=False, reuse=False, prefetch=0, pols=False):
         """Provide an iterator over preamble, data.  Allows constructs like: 
-        for preamble, data in uv.all(): ..."""
+        for preamble, data in uv.all(): ...
+        If reuse, every record is read into the same buffers (see read), so
+        data from a record must be copied if it is needed after the next.
+        If pols, the polarization code of each record is yielded after its
+        data (and flags, if raw).  If prefetch > 0, records are read on a
+        background thread up to prefetch blocks of 128 records ahead (see
+        prefetch()), and variables do not track the records yielded, so
+        uv['pol'] must not be used; use pols instead."""
+        if prefetch > 0:
+            for block in self.prefetch(depth=prefetch, pols=True):
+                for p, d, f, pol in zip(*block):
+                    rv = ((p[:3], p[3], bl2ij(p[4])),)
+                    if raw: rv += (d, f)
+                    else: rv += (n.ma.array(d, mask=f, copy=False),)
+                    if pols: rv += (int(pol),)
+                    yield rv
+            return
         curtime = None
+        if reuse: out = self.mk_buffers()
+        else: out = None
         while True:
-            try: yield self.read(raw=raw)
+            try: rv = self.read(raw=raw, out=out)
             except(IOError): return
+            if pols: rv += (self['pol'],)
+            yield rv
+    def to_cube(self, dirname, blocksize=256):
+        """Write the (selected) data in this file to a memory-mapped cube of
+        (baseline/pol, time, channel) in directory dirname, and return it
+        as a uvcube.UVCube.  See uvcube.export."""
+        import uvcube
+        return uvcube.export(self, dirname, blocksize=blocksize)
     def write(self, preamble, data, flags=None):
         """Write the next data record.  data must be a complex, masked
         array.  preamble must be (uvw, t, (i,j)), where uvw is an array of 
@@ -237,6 +457,28 @@ class UV(_miriad.UV):
             #data = data.filled(0)
             data = data.data
         self.raw_write(preamble,data.astype(n.complex64),flags.astype(n.int32))
+    def write_many(self, preambles, data, flags=None, vars={}):
+        """Write many data records in one call.  preambles is a (N,5) array
+        of (u,v,w,t,bl) as returned by read_many (bl is a Miriad baseline
+        code; see ij2bl), data is a (N,nchan) complex array, and flags is a
+        (N,nchan) boolean array which is True where data are flagged (if
+        None, the mask of data is used).  vars maps variable names (which
+        must be in the vartable; see add_var) to (N,) or (N,len) arrays of
+        values (e.g. pol, lst) to be written before each record."""
+        if flags is None:
+            flags = n.ma.getmaskarray(data)
+            data = n.ma.getdata(data)
+        preambles = n.ascontiguousarray(preambles, dtype=n.double)
+        data = n.ascontiguousarray(data, dtype=n.complex64)
+        flags = n.ascontiguousarray(flags, dtype=n.bool_)
+        vlist = []
+        for k in vars:
+            type = self.vartable[k]
+            try: dtype = var_dtypes[type]
+            except(KeyError):
+                raise ValueError('Cannot write_many var %s of type %s' % (k,type))
+            vlist.append((k, type, n.ascontiguousarray(vars[k], dtype=dtype)))
+        self.raw_write_many(preambles, data, flags, vlist)
     def init_from_uv(self, uv, override={}, exclude=[]):
         """Initialize header items and variables from another UV.  Those in 
         override will be overwritten by override[k], and tracking will be 
@@ -277,12 +519,175 @@ class UV(_miriad.UV):
                 np, nd = mfunc(uv, p, d)
                 self.copyvr(uv)
                 self.write(np, nd)
+    def pipe_batched(self, uv, bfunc, append2hist='', blocksize=256):
+        """Pipe in data from another UV one integration at a time through
+        the function bfunc(uv,preambles,data,flags), which receives all the
+        records of an integration as arrays (see read_many), and should
+        return (preambles,data,flags) arrays for the records to write,
+        optionally followed by an array of their polarization codes
+        (otherwise those of the records read are used, so the number of
+        records must not change).  If None is returned, the integration is
+        omitted.  Variables are copied once per integration, from its first
+        record, except 'pol', which is written for every record.  The
+        string 'append2hist' will be appended to history."""
+        self._wrhd('history', self['history'] + append2hist)
+        while True:
+            # Variables of the first record are copied before the rest of
+            # the integration is read
+            p, d, f, pols = uv.read_many(1, pols=True)
+            if p.shape[0] == 0: break
+            self.copyvr(uv)
+            rest = uv.read_block(pols=True, blocksize=blocksize, t0=p[0,3])
+            p, d, f, pols = [n.concatenate(b) for b in zip((p,d,f,pols), rest)]
+            rv = bfunc(uv, p, d, f)
+            if rv is None: continue
+            if len(rv) == 4: p, d, f, pols = rv
+            else: p, d, f = rv
+            if len(pols) != len(p):
+                raise ValueError('bfunc changed the number of records but did not return their pols')
+            if 'pol' in self.vartable: vars = {'pol':pols}
+            else: vars = {}
+            self.write_many(p, d, f, vars=vars)
     def add_var(self, name, type):
         """Add a variable of the specified type to a UV file."""
         self.vartable[name] = type
 
+def start_time(filename):
+    """Return the time of the first record in a Miriad UV file, from the
+    time index saved in it (see UV.time_index) if that is up to date, and
+    otherwise by opening the file."""
+    try:
+        vis = os.stat(os.path.join(filename, 'visdata'))
+        f = n.load(os.path.join(filename, 'tindex.npz'))
+        if n.all(f['stamp'] == [vis.st_size, vis.st_mtime]) and \
+                f['times'].size > 0:
+            return f['times'][0]
+    except(IOError, OSError, KeyError, ValueError): pass
+    uv = UV(filename)
+    return uv['time']
+
+class UVSet:
+    """Read a list of Miriad UV files as one data set.  Selections are
+    applied to every file, and while one file is read, the next is opened
+    on a background thread."""
+    def __init__(self, filenames, sort=True, preopen=True):
+        """Open the data set of the listed files.  If sort, files are read
+        in the order of the time of their first records (otherwise, in
+        the order given), which is taken from their saved time indices
+        (see UV.time_index) where those are up to date, so that only
+        unindexed files are opened to sort them.  If preopen, each file is
+        opened in the background while the one before it is read."""
+        filenames = list(filenames)
+        if sort:
+            t0 = [start_time(filename) for filename in filenames]
+            filenames = [f for t,f in sorted(zip(t0, filenames))]
+        self.filenames = filenames
+        self.preopen = preopen
+        self._selections = []
+        self._next = None
+        self.uv, self.fileno = None, -1
+        self.rewind()
+    def _open(self, fileno):
+        """Open file number fileno and apply the selections made so far."""
+        uv = UV(self.filenames[fileno])
+        for name, args in self._selections: getattr(uv, name)(*args)
+        return uv
+    def _preopen(self, fileno):
+        """Start opening file number fileno on a background thread,
+        discarding any file already being opened."""
+        if not self._next is None: self._next[1].join()
+        self._next = None
+        if not self.preopen or fileno >= len(self.filenames): return
+        rv = {}
+        def opener():
+            try: rv['uv'] = self._open(fileno)
+            except: rv['err'] = sys.exc_info()
+        thread = threading.Thread(target=opener)
+        thread.daemon = True
+        thread.start()
+        self._next = (fileno, thread, rv)
+    def _goto(self, fileno):
+        """Make file number fileno the one being read.  Returns False (and
+        sets uv to None) if there is no such file."""
+        self.uv, self.fileno = None, fileno
+        if fileno >= len(self.filenames):
+            self._preopen(fileno)
+            return False
+        if not self._next is None and self._next[0] == fileno:
+            fileno, thread, rv = self._next
+            thread.join()
+            self._next = None
+            if 'err' in rv: raise rv['err'][0], rv['err'][1], rv['err'][2]
+            self.uv = rv['uv']
+        else: self.uv = self._open(fileno)
+        self._preopen(fileno + 1)
+        return True
+    def _select(self, name, *args):
+        """Apply a selection to the current file and all later ones."""
+        self._selections.append((name, args))
+        if not self.uv is None: getattr(self.uv, name)(*args)
+        if not self._next is None: self._preopen(self._next[0])
+    def select(self, name, n1, n2, include=1):
+        """Choose which data are returned, as UV.select.  Decimation
+        restarts with each file."""
+        self._select('select', name, n1, n2, include)
+    def select_mask(self, blmask=None, pols=None):
+        """Choose which baselines and pols are returned, as
+        UV.select_mask."""
+        self._select('select_mask', blmask, pols)
+    def select_chans(self, chans=None):
+        """Choose which channels are returned, as UV.select_chans."""
+        self._select('select_chans', chans)
+    def rewind(self):
+        """Return to the start of the first file."""
+        if self.fileno == 0 and not self.uv is None: self.uv.rewind()
+        else: self._goto(0)
+    def filename(self):
+        """Return the name of the file being read."""
+        return self.filenames[self.fileno]
+    def __getitem__(self, name):
+        """Return a variable or header item of the file being read."""
+        return self.uv[name]
+    def read(self, raw=False):
+        """Return the next data record, as UV.read, moving on to the next
+        file at the end of each.  Variables (and fileno) reflect the file
+        of the record returned."""
+        while not self.uv is None:
+            try: return self.uv.read(raw=raw)
+            except(IOError): self._goto(self.fileno + 1)
+        raise IOError("No data read")
+    def all(self, raw=False):
+        """Provide an iterator over preamble, data of all files, as
+        UV.all."""
+        while True:
+            try: yield self.read(raw=raw)
+            except(IOError): return
+    def _read_bulk(self, name, pols, **kwargs):
+        """Call the bulk read method name of the file being read, moving on
+        to the next file until it returns records."""
+        while not self.uv is None:
+            rv = getattr(self.uv, name)(pols=pols, **kwargs)
+            if rv[0].shape[0] > 0: return rv
+            self._goto(self.fileno + 1)
+        rv = (n.empty((0,5), dtype=n.double),
+            n.empty((0,0), dtype=n.complex64), n.empty((0,0), dtype=n.bool_))
+        if pols: rv += (n.empty((0,), dtype=n.int32),)
+        return rv
+    def read_many(self, nrecords, stop_at_int=False, pols=False):
+        """Read up to nrecords records as UV.read_many.  Records returned
+        together always come from the same file (fileno), so fewer than
+        nrecords are returned at the end of each file.  Empty arrays are
+        returned at the end of the last file."""
+        return self._read_bulk('read_many', pols, nrecords=nrecords,
+            stop_at_int=stop_at_int)
+    def read_block(self, pols=False, blocksize=256):
+        """Read all records of the next integration, as UV.read_block,
+        from the file given by fileno."""
+        return self._read_bulk('read_block', pols, blocksize=blocksize)
+
 def bl2ij(bl):
-    bl = int(bl)
+    try: bl = int(bl)
+    except(TypeError): bl = n.asarray(bl).astype(n.int)
     return (bl>>8)-1, (bl&255) - 1
 
 def ij2bl(i, j):
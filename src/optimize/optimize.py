@@ -10,7 +10,7 @@
 
 # Minimization routines
 
-__all__ = ['fmin', 'fmin_powell','fmin_ncg',
+__all__ = ['fmin', 'fmin_powell','fmin_bfgs','fmin_ncg',
            'fminbound','brent', 'golden','bracket','rosen','rosen_der',
            'rosen_hess', 'rosen_hess_prod', 'brute', 'approx_fprime',
            'line_search', 'check_grad']
@@ -602,6 +602,152 @@ def line_search_BFGS(f, xk, pk, gfk, old_fval, args=(), c1=1e-4, alpha0=1):
         phi_a1 = phi_a2
 
 
+def fmin_bfgs(f, x0, fprime=None, args=(), gtol=1e-5, norm=Inf,
+              epsilon=_epsilon, maxiter=None, full_output=0, disp=1,
+              retall=0, callback=None):
+    """Minimize a function using the BFGS algorithm.
+
+    :Parameters:
+
+    f -- the Python function or method to be minimized.
+    x0 : ndarray -- the initial guess for the minimizer.
+    fprime -- a function to compute the gradient of f: fprime(x, *args).
+              If None, the gradient is approximated by finite differences.
+    args -- extra arguments to f and fprime.
+    gtol : number
+        gradient norm must be less than gtol before succesful termination
+    norm : number
+        order of norm (Inf is max, -Inf is min)
+    epsilon : number
+        if fprime is approximated use this value for
+                 the step size (can be scalar or vector)
+    callback -- an optional user-supplied function to call after each
+                iteration.  It is called as callback(xk), where xk is the
+                current parameter vector.
+
+    :Returns: (xopt, {fopt, gopt, Hopt, func_calls, grad_calls, warnflag}, <allvecs>)
+
+    xopt : ndarray
+        the minimizer of f.
+    fopt : number
+        the value of f(xopt).
+    gopt : ndarray
+        the value of f'(xopt).  (Should be near 0)
+    Bopt : ndarray
+        the value of 1/f''(xopt).  (inverse hessian matrix)
+    func_calls : number
+        the number of function_calls.
+    grad_calls : number
+        the number of gradient calls.
+    warnflag : integer
+            1 : 'Maximum number of iterations exceeded.'
+            2 : 'Gradient and/or function calls not changing'
+    allvecs  :  a list of all iterates  (only returned if retall==1)
+
+    Notes
+
+    ----------------------------------
+
+    Optimize the function, f, whose gradient is given by fprime using the
+    quasi-Newton method of Broyden, Fletcher, Goldfarb, and Shanno (BFGS)
+    See Wright, and Nocedal 'Numerical Optimization', 1999, pg. 198.
+
+    """
+    x0 = asarray(x0).flatten()
+    if maxiter is None:
+        maxiter = len(x0)*200
+    func_calls, f = wrap_function(f, args)
+    if fprime is None:
+        grad_calls, myfprime = wrap_function(approx_fprime, (f, epsilon))
+    else:
+        grad_calls, myfprime = wrap_function(fprime, args)
+    gfk = myfprime(x0)
+    k = 0
+    N = len(x0)
+    I = numpy.eye(N,dtype=int)
+    Hk = I
+    old_fval = f(x0)
+    old_old_fval = old_fval + 5000
+    xk = x0
+    if retall:
+        allvecs = [x0]
+    warnflag = 0
+    gnorm = vecnorm(gfk,ord=norm)
+    while (gnorm > gtol) and (k < maxiter):
+        pk = -numpy.dot(Hk,gfk)
+        alpha_k, fc, gc, old_fval, old_old_fval, gfkp1 = \
+           line_search(f,myfprime,xk,pk,gfk,old_fval,old_old_fval)
+        if alpha_k is None:
+            # The line search failed to find a better solution.
+            warnflag = 2
+            break
+        xkp1 = xk + alpha_k * pk
+        if retall:
+            allvecs.append(xkp1)
+        sk = xkp1 - xk
+        xk = xkp1
+        if gfkp1 is None:
+            gfkp1 = myfprime(xkp1)
+
+        yk = gfkp1 - gfk
+        gfk = gfkp1
+        if callback is not None:
+            callback(xk)
+        k += 1
+        gnorm = vecnorm(gfk,ord=norm)
+        if (gnorm <= gtol):
+            break
+
+        try: # this was handled in numeric, let it remaines for more safety
+            rhok = 1.0 / (numpy.dot(yk,sk))
+        except ZeroDivisionError:
+            rhok = 1000.0
+            print "Divide-by-zero encountered: rhok assumed large"
+        if isinf(rhok): # this is patch for numpy
+            rhok = 1000.0
+            print "Divide-by-zero encountered: rhok assumed large"
+        A1 = I - sk[:,numpy.newaxis] * yk[numpy.newaxis,:] * rhok
+        A2 = I - yk[:,numpy.newaxis] * sk[numpy.newaxis,:] * rhok
+        Hk = numpy.dot(A1,numpy.dot(Hk,A2)) + rhok * sk[:,numpy.newaxis] \
+                 * sk[numpy.newaxis,:]
+
+    if disp or full_output:
+        fval = old_fval
+    if warnflag == 2:
+        if disp:
+            print "Warning: Desired error not necessarily achieved due to precision loss"
+            print "         Current function value: %f" % fval
+            print "         Iterations: %d" % k
+            print "         Function evaluations: %d" % func_calls[0]
+            print "         Gradient evaluations: %d" % grad_calls[0]
+
+    elif k >= maxiter:
+        warnflag = 1
+        if disp:
+            print "Warning: Maximum number of iterations has been exceeded"
+            print "         Current function value: %f" % fval
+            print "         Iterations: %d" % k
+            print "         Function evaluations: %d" % func_calls[0]
+            print "         Gradient evaluations: %d" % grad_calls[0]
+    else:
+        if disp:
+            print "Optimization terminated successfully."
+            print "         Current function value: %f" % fval
+            print "         Iterations: %d" % k
+            print "         Function evaluations: %d" % func_calls[0]
+            print "         Gradient evaluations: %d" % grad_calls[0]
+
+    if full_output:
+        retlist = xk, fval, gfk, Hk, func_calls[0], grad_calls[0], warnflag
+        if retall:
+            retlist += (allvecs,)
+    else:
+        retlist = xk
+        if retall:
+            retlist = (xk, allvecs)
+
+    return retlist
+
 def approx_fprime(xk,f,epsilon,*args):
     f0 = f(*((xk,)+args))
     grad = numpy.zeros((len(xk),), float)
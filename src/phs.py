@@ -2,7 +2,8 @@
 Module for representing antenna array geometry and for generating
 phasing information.
 """
-import ephem, math, numpy as n, coord, const, _cephes
+import ephem, math, numpy as n, coord, const, _cephes, threading
+from collections import OrderedDict
 
 class PointingError(Exception):
     """An error to throw if a source is below the horizon."""
@@ -24,6 +25,55 @@ def ephem2juldate(num):
     """Convert ephem date (measured from noon, Dec. 31, 1899) to Julian date."""
     return float(num + 2415020.)
 
+def _nbytes(val):
+    """Return the # of bytes held in the array(s) of val."""
+    if type(val) in (tuple, list): return sum([_nbytes(v) for v in val])
+    return getattr(val, 'nbytes', 0)
+
+class LRUCache:
+    """A bounded cache of computed values that discards the least recently
+    used entry when full.  Counts hits and misses.  Safe to share between
+    threads."""
+    def __init__(self, size=1024, maxbytes=None):
+        """size = maximum # of entries held
+        maxbytes = maximum # of bytes held in arrays (or tuples of arrays)
+        among the entries, or None for no limit"""
+        self.size, self.maxbytes = size, maxbytes
+        self._lock = threading.Lock()
+        self.clear()
+    def __len__(self): return len(self._data)
+    def __contains__(self, key): return key in self._data
+    def clear(self):
+        """Discard all entries and reset the hit/miss counters."""
+        with self._lock:
+            self._data = OrderedDict()
+            self.hits, self.misses, self.nbytes = 0, 0, 0
+    def get(self, key, func, *args):
+        """Return the value stored under key.  If absent, it is computed as
+        func(*args) (outside the lock, so threads missing the same key may
+        each compute it, but only the first value stored is kept)."""
+        with self._lock:
+            if key in self._data:
+                val = self._data.pop(key)
+                self._data[key] = val
+                self.hits += 1
+                return val
+            self.misses += 1
+        val = func(*args)
+        nbytes = _nbytes(val)
+        with self._lock:
+            if key in self._data:
+                # Another thread stored it first; keep that entry
+                val = self._data.pop(key)
+            else:
+                while len(self._data) > 0 and (len(self._data) >= self.size or
+                        (self.maxbytes is not None and
+                        self.nbytes + nbytes > self.maxbytes)):
+                    self.nbytes -= _nbytes(self._data.popitem(last=False)[1])
+                self.nbytes += nbytes
+            self._data[key] = val
+        return val
+
 #  ____           _ _       ____            _       
 # |  _ \ __ _  __| (_) ___ | __ )  ___   __| |_   _ 
 # | |_) / _` |/ _` | |/ _ \|  _ \ / _ \ / _` | | | |
@@ -33,6 +83,7 @@ def ephem2juldate(num):
 
 class RadioBody:
     """The location of a celestial source."""
+    _memo = None    # LRUCache shared through SrcCatalog.set_memo()
     def __init__(self, name, mfreq, ionref, srcshape):
         self.src_name = name
         self.mfreq = mfreq
@@ -44,7 +95,11 @@ class RadioBody:
         """Update coordinates relative to the provided observer.  Must be
         called at each time step before accessing information."""
         # Generate a map for projecting baselines to uvw coordinates
-        self.map = coord.eq2top_m(observer.sidereal_time()-self.ra, self.dec)
+        ha = observer.sidereal_time() - self.ra
+        if self._memo is None: self.map = coord.eq2top_m(ha, self.dec)
+        else:
+            key = ('map', float(ha), float(self.dec))
+            self.map = self._memo.get(key, coord.eq2top_m, ha, self.dec)
     def get_crds(self, crdsys, ncrd=3):
         """Return the coordinates of this location in the desired coordinate
         system ('eq','top') in the current epoch.  If ncrd=2, angular
@@ -54,10 +109,13 @@ class RadioBody:
         assert(ncrd in (2,3))
         if crdsys == 'eq':
             if ncrd == 2: return (self.ra, self.dec)
-            return coord.radec2eq((self.ra, self.dec))
+            crd, f = (self.ra, self.dec), coord.radec2eq
         else:
             if ncrd == 2: return (self.az, self.alt)
-            return coord.azalt2top((self.az, self.alt))
+            crd, f = (self.az, self.alt), coord.azalt2top
+        if self._memo is None: return f(crd)
+        key = (crdsys, float(crd[0]), float(crd[1]))
+        return self._memo.get(key, f, crd).copy()
 
 #  ____           _ _       _____ _              _ ____            _       
 # |  _ \ __ _  __| (_) ___ |  ___(_)_  _____  __| | __ )  ___   __| |_   _ 
@@ -122,12 +180,24 @@ class SrcCatalog(dict):
     of src objects, of as an empty catalog."""
     def __init__(self, *srcs, **kwargs):
         dict.__init__(self)
+        self._memo = None
         self.add_srcs(*srcs)
     def add_srcs(self, *srcs):
         """Add src object(s) (RadioFixedBody,RadioSpecial) to catalog."""
         if len(srcs) == 1 and getattr(srcs[0], 'src_name', None) == None:
             srcs = srcs[0]
-        for s in srcs: self[s.src_name] = s
+        for s in srcs:
+            self[s.src_name] = s
+            if self._memo is not None: s._memo = self._memo
+    def set_memo(self, size=1024):
+        """Memoize the geometry (projection matrices and coordinates) derived
+        in compute() and get_crds(), holding up to 'size' entries shared
+        by all sources.  Entries are keyed on the apparent position of each
+        source, so only sources whose position (or the time) changed are
+        recomputed.  size=0 turns memoization off."""
+        if size: self._memo = LRUCache(size)
+        else: self._memo = None
+        for s in self: self[s]._memo = self._memo
     def get_srcs(self, *srcs):
         """Return list of all src objects in catalog."""
         if len(srcs) == 0: srcs = self.keys()
@@ -215,6 +285,7 @@ class Antenna:
 
 class ArrayLocation(ephem.Observer):
     """The location and time of an observation."""
+    _memo = None
     def __init__(self, location):
         """location = (lat,long,[elev]) of array"""
         ephem.Observer.__init__(self)
@@ -226,9 +297,30 @@ class ArrayLocation(ephem.Observer):
         self._eq2zen = coord.eq2top_m(0., self.lat)
     def update(self):
         self._update_eq2zen()
+    def set_memo(self, size=1024):
+        """Memoize the matrices derived from the sidereal time on each call 
+        to set_jultime(), holding up to 'size' times.  size=0 turns 
+        memoization off."""
+        if size: self._memo = LRUCache(size)
+        else: self._memo = None
+    def _memoize(self, name, lst, func, *args):
+        """Return func(*args), memoized under (name,lst) if set_memo() was 
+        called."""
+        if self._memo is None: return func(*args)
+        return self._memo.get((name, float(lst), float(self.lat)), func, *args)
     def get_jultime(self):
         """Get current time as a Julian date."""
         return ephem2juldate(self.date)
+    def get_lsts(self, jultimes):
+        """Return an array of the sidereal times at each of the provided 
+        Julian dates, leaving the current time unchanged."""
+        date = self.date
+        lsts = []
+        for t in jultimes:
+            self.date = juldate2ephem(t)
+            lsts.append(float(self.sidereal_time()))
+        self.date = date
+        return n.array(lsts)
     def set_jultime(self, t=None):
         """Set current time as a Julian date."""
         if t is None: t = ephem.julian_date()
@@ -238,7 +330,9 @@ class ArrayLocation(ephem.Observer):
         matrix for projecting baselines into current positions."""
         if t is None: t = ephem.now()
         self.date, self.epoch = t, t
-        self._eq2now = coord.rot_m(-self.sidereal_time(), n.array([0.,0.,1.]))
+        lst = self.sidereal_time()
+        self._eq2now = self._memoize('eq2now', lst, 
+            coord.rot_m, -lst, n.array([0.,0.,1.]))
 
 #     _          _                            _                         
 #    / \   _ __ | |_ ___ _ __  _ __   __ _   / \   _ __ _ __ __ _ _   _ 
@@ -250,11 +344,13 @@ class ArrayLocation(ephem.Observer):
 class AntennaArray(ArrayLocation):
     """A collection of antennas, their spacings, and location/time of 
     observations."""
+    ant_phs_cache_size = 4  # Max # of src configurations held by gen_ant_phs
     def __init__(self, location, ants, **kwargs):
         """ location = (lat,long,[elev]) of array
         ants = list of Antenna objects."""
         ArrayLocation.__init__(self, location=location)
         self.ants = ants
+        self._ant_phs = {}
     def __iter__(self): return self.ants.__iter__()
     def __getitem__(self, *args): return self.ants.__getitem__(*args)
     def __setitem__(self, *args): return self.ants.__setitem__(*args)
@@ -262,6 +358,13 @@ class AntennaArray(ArrayLocation):
     def update(self):
         ArrayLocation.update(self)
         for a in self: a.update()
+        self._ant_phs = {}
+    def set_ephemtime(self, t=None):
+        """Set current time as derived from the ephem package.  Recalculates
+        matrix for projecting baselines into current positions, and clears
+        cached antenna phasors."""
+        ArrayLocation.set_ephemtime(self, t=t)
+        self._ant_phs = {}
     def select_chans(self, active_chans=None):
         """Select which channels are used in computations.  Default is all."""
         for a in self: a.select_chans(active_chans)
@@ -301,14 +404,27 @@ class AntennaArray(ArrayLocation):
             elif src == 'z': return n.dot(self._eq2zen, bl)
             elif src == 'r': return bl
             else: raise ValueError('Unrecognized source:' + src)
+        return n.dot(self._src2top_m(src), bl).transpose()
+    def _src2top_m(self, src):
+        """Return the matrix (or array of matrices, one per source) projecting
+        equatorial coordinates toward src, a RadioBody or equatorial 
+        vectors."""
         try:
             if src.alt < 0:
                 raise PointingError('%s below horizon' % src.src_name)
-            m = src.map
+            return src.map
         except(AttributeError):
             ra,dec = coord.eq2radec(src)
-            m = coord.eq2top_m(self.sidereal_time() - ra, dec)
-        return n.dot(m, bl).transpose()
+            return coord.eq2top_m(self.sidereal_time() - ra, dec)
+    def get_ant_crds(self, src):
+        """Return the positions of all antennas projected toward src (a 
+        RadioBody or equatorial vectors) as an array of shape (3,Nant,Nsrc).
+        The coordinates of baseline i,j (see get_baseline()) are those of 
+        antenna j minus those of antenna i."""
+        m = self._src2top_m(src)
+        if len(m.shape) == 2: m = n.reshape(m, (1,3,3))
+        pos = n.array([a.pos for a in self])
+        return n.dot(m, pos.transpose()).transpose([1,2,0])
     def get_phs_offset(self, i, j):
         """Return the frequency-dependent phase offset of baseline i,j."""
         return self[j].phsoff - self[i].phsoff
@@ -326,22 +442,45 @@ class AntennaArray(ArrayLocation):
         x.shape += (1,); y.shape += (1,); z.shape += (1,)
         if w_only: return n.dot(z,afreqs)
         else: return n.array([n.dot(x,afreqs), n.dot(y,afreqs), n.dot(z,afreqs)])
+    def gen_ant_phs(self, src, mfreq=.150, ionref=None):
+        """Return per-antenna phasors toward src as an array of shape 
+        (Nant,Nsrc,Nchan).  The phasing of baseline i,j (see gen_phs()) is
+        phs[j] * conj(phs[i]).  Results are cached for the current time and
+        array parameters, so phasing many baselines toward the same source(s)
+        only evaluates Nant complex exponentials per source and channel."""
+        x,y,z = self.get_ant_crds(src)
+        if ionref is None: key = (None,)
+        else: key = tuple([n.asarray(c, dtype=n.float).tostring() 
+            for c in (mfreq,) + tuple(ionref)])
+        key = (x.shape, z.tostring(), x.tostring(), y.tostring()) + key
+        try: return self._ant_phs[key]
+        except(KeyError): pass
+        f = n.reshape(self.get_afreqs(), (1,1,-1))
+        w = z[...,n.newaxis] * f
+        if not ionref is None:
+            # Refraction is linear in u,v, so it separates by antenna too
+            u, v = x[...,n.newaxis] * f, y[...,n.newaxis] * f
+            w += self.refract(u, v, mfreq=mfreq, ionref=ionref)
+        o = n.array([a.phsoff for a in self])[:,n.newaxis,:]
+        phs = n.exp(-1j*2*n.pi*(w + o))
+        if len(self._ant_phs) >= self.ant_phs_cache_size: self._ant_phs = {}
+        self._ant_phs[key] = phs
+        return phs
     def gen_phs(self, src, i, j, mfreq=.150, ionref=None, srcshape=None, 
             resolve_src=False):
         """Return phasing that is multiplied to data to point to src."""
         if ionref is None:
             try: ionref = src.ionref
             except(AttributeError): pass
-        if not ionref is None or resolve_src: u,v,w = self.gen_uvw(i,j,src=src)
-        else: w = self.gen_uvw(i,j,src=src, w_only=True)
-        if not ionref is None: w += self.refract(u, v, mfreq=mfreq, ionref=ionref)
-        o = self.get_phs_offset(i,j)
-        phs = n.exp(-1j*2*n.pi*(w + o))
+        ant_phs = self.gen_ant_phs(src, mfreq=mfreq, ionref=ionref)
+        phs = ant_phs[j] * n.conjugate(ant_phs[i])
         if resolve_src:
             if srcshape is None:
                 try: srcshape = src.srcshape
                 except(AttributeError): pass
-            if not srcshape is None: phs *= self.resolve_src(u, v, srcshape=srcshape)
+            if not srcshape is None:
+                u,v,w = self.gen_uvw(i,j,src=src)
+                phs *= self.resolve_src(u, v, srcshape=srcshape)
         return phs.squeeze()
     def resolve_src(self, u, v, srcshape=(0,0,0)):
         """Adjust amplitudes to reflect resolution effects for a uniform 
@@ -368,10 +507,10 @@ class AntennaArray(ArrayLocation):
             of sources along ra/dec axes at the specified mfreq.
         u_sf,v_sf = u,v components of baseline, used to compute the
             change in w given angle offsets and the small angle approx.  Should
-            be numpy arrays with sources (s) along the 1st axis and
-            freqs (f) along the 2nd."""
+            be numpy arrays with sources (s) along the 2nd-to-last axis and
+            freqs (f) along the last."""
         dra,ddec = ionref
-        s,f = u_sf.shape
+        s,f = u_sf.shape[-2:]
         try: dra.shape = (s,1)
         except(AttributeError): pass
         try: ddec.shape = (s,1)
@@ -29,8 +29,8 @@ def gen_rfi_thresh(data, nsig=2, cnt_per_bin=1000):
     # Fit a gaussian to histogram (better than just std-dev of data)
     amp, sig, off = fit_gaussian(n.arange(h.size), h)
     sig = abs(sig)
-    hi_thresh = n.clip(n.round(off + nsig*sig), 0, len(bvals)-1)
-    lo_thresh = n.clip(n.round(off - nsig*sig), 0, len(bvals)-1)
+    hi_thresh = int(n.clip(n.round(off + nsig*sig), 0, len(bvals)-1))
+    lo_thresh = int(n.clip(n.round(off - nsig*sig), 0, len(bvals)-1))
     return 10**bvals[hi_thresh], 10**bvals[lo_thresh]
 
 def flag_by_int(preflagged_auto, nsig=1, raw=False):
@@ -4,10 +4,11 @@ for writing scripts.
 """
 
 import miriad, fit, src, numpy as n, re,phs
+import sys, traceback, StringIO, multiprocessing
 
 def add_standard_options(optparser, ant=False, pol=False, chan=False, 
         cal=False, src=False, prms=False, dec=False, cmap=False, 
-        max=False, drng=False):
+        max=False, drng=False, nproc=False):
     """Add standard command-line options to an optparse.OptionParser() on an 
     opt in basis (i.e. specify =True for each option to be added)."""
     if ant: optparser.add_option ('-a', '--ant', dest='ant', default='cross',
@@ -39,6 +40,64 @@ def add_standard_options(optparser, ant=False, pol=False, chan=False,
     if drng:
         optparser.add_option('--drng', dest='drng', type='float', default=None,
     help="Dynamic range in color of image, in units matching plotting mode.  Default max(data)-min(data).")
+    if nproc: optparser.add_option('-j', '--nproc', dest='nproc', 
+        default=1, type='int',
+        help='Number of files to process in parallel.  Default is 1.')
+
+_pool_func = None
+
+def _pool_init():
+    """Reseed numpy's random numbers, which forked workers would otherwise
+    share."""
+    n.random.seed()
+
+def _pool_call(filename):
+    """Run _pool_func(filename) in a worker process, returning what it
+    printed and the formatted traceback (or None) of any error."""
+    stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    try:
+        try:
+            _pool_func(filename)
+            err = None
+        except(Exception):
+            err = traceback.format_exc()
+        return sys.stdout.getvalue(), err
+    finally: sys.stdout = stdout
+
+def process_files(func, filenames, nproc=1):
+    """Call func(filename) for each of filenames, in a pool of nproc
+    processes if nproc > 1.  The output printed by each call is buffered
+    and written to stdout in the order of filenames, with each line
+    prefixed by the filename.  Errors in one file do not stop the others;
+    a RuntimeError listing the failed files is raised once all are done.
+    func should skip files whose output already exists, as scripts have
+    always done when run serially."""
+    global _pool_func
+    if nproc <= 1 or len(filenames) <= 1:
+        for filename in filenames: func(filename)
+        return
+    # Workers are forked, so they inherit func even if it is a closure
+    _pool_func = func
+    pool = multiprocessing.Pool(min(nproc, len(filenames)), _pool_init)
+    failed = []
+    try:
+        results = pool.imap(_pool_call, filenames)
+        for filename in filenames:
+            # Waiting with a timeout keeps KeyboardInterrupt deliverable
+            out, err = results.next(timeout=1e9)
+            if err is not None: out += err
+            for line in out.splitlines(): print '[%s]' % filename, line
+            sys.stdout.flush()
+            if err is not None: failed.append(filename)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _pool_func = None
+    if len(failed) > 0:
+        raise RuntimeError('Processing failed for: %s' % ', '.join(failed))
 
 ant_re = r'(\(((-?\d+[xy]?,?)+)\)|-?\d+[xy]?)'
 bl_re = '(^(%s_%s|%s),?)' % (ant_re, ant_re, ant_re)
@@ -102,26 +161,36 @@ def parse_ants(ant_str, nants):
     return rv
 
 def uv_selector(uv, ants=-1, pol_str=-1):
-    """Call uv.select with appropriate options based on string argument for
-    antennas (can be 'all', 'auto', 'cross', '0,1,2', or '0_1,0_2') and
-    string for polarization ('xx','yy','xy','yx')."""
+    """Select data in uv based on string argument for antennas (can be 'all',
+    'auto', 'cross', '0,1,2', or '0_1,0_2') and string for polarization 
+    ('xx','yy','xy','yx').  The selection is compiled into a baseline mask
+    and polarization set (see miriad.UV.select_mask), so its cost per record
+    does not grow with the number of baselines selected."""
+    blmask = None
     if ants != -1:
         if type(ants) == str: ants = parse_ants(ants, uv['nants'])
+        nants = uv['nants']
+        for bl,include,pol in ants:
+            if bl != 'auto': nants = max([nants] + [k+1 for k in miriad.bl2ij(bl)])
+        # Clauses are applied in order, as Miriad does with uv.select
         for bl,include,pol in ants:
-            if bl == 'auto': uv.select('auto', 0, 0, include=include)
+            if blmask is None:
+                blmask = n.zeros((nants,nants), dtype=n.bool) + (not include)
+            if bl == 'auto':
+                blmask[n.arange(nants),n.arange(nants)] = include
             else:
                 i,j = miriad.bl2ij(bl)
-                uv.select('antennae', i, j, include=include)
+                blmask[i,j] = blmask[j,i] = include
             if pol!=-1 and pol_str==-1:
                 pol_str = pol
             elif pol!=-1:
                 pol_str = ','.join([pol_str,pol])
+    pols = None
     if pol_str != -1:
-        try:
-            for pol in pol_str.split(','):
-                polopt = miriad.str2pol[pol]
-                uv.select('polarization', polopt, 0)
-        except(NameError,KeyError): raise ValueError('--pol=%s argument invalid or absent'%(pol_str))
+        try: pols = [miriad.str2pol[pol] for pol in pol_str.split(',')]
+        except(NameError,KeyError,AttributeError):
+            raise ValueError('--pol=%s argument invalid or absent'%(pol_str))
+    if not blmask is None or not pols is None: uv.select_mask(blmask, pols)
 
 def parse_chans(chan_str, nchan, concat=True):
     """Return array of active channels based on number of channels and
@@ -90,7 +90,7 @@ template<typename T> struct AddStuff {
 // Adds data to a at indicies specified in ind.  Checks safety of arrays input.
 PyObject *add2array(PyObject *self, PyObject *args) {
     PyArrayObject *a, *ind, *data;
-    int rv;
+    int rv=0, supported=1;
     // Parse arguments and perform sanity check
     if (!PyArg_ParseTuple(args, "OOO", &a, &ind, &data)) return NULL;
     CHK_ARRAY_RANK(ind, 2);
@@ -107,6 +107,8 @@ PyObject *add2array(PyObject *self, PyObject *args) {
     Py_INCREF(a);
     Py_INCREF(ind);
     Py_INCREF(data);
+    // The add loops touch only array data, so other threads may run
+    Py_BEGIN_ALLOW_THREADS
     // Use template to implement data loops for all data types
     if (TYPE(a) == NPY_BOOL) {
         rv = AddStuff<bool>::addloop(a,ind,data);
@@ -142,14 +144,15 @@ PyObject *add2array(PyObject *self, PyObject *args) {
         rv = AddStuff<double>::caddloop(a,ind,data);
     } else if (TYPE(a) == NPY_CLONGDOUBLE) {
         rv = AddStuff<long double>::caddloop(a,ind,data);
-    } else {
-        PyErr_Format(PyExc_ValueError, "Unsupported data type.");
-        return NULL;
-    }
+    } else supported = 0;
+    Py_END_ALLOW_THREADS
     Py_DECREF(a);
     Py_DECREF(ind);
     Py_DECREF(data);
-    if (rv == 0) {
+    if (!supported) {
+        PyErr_Format(PyExc_ValueError, "Unsupported data type.");
+        return NULL;
+    } else if (rv == 0) {
         Py_INCREF(Py_None);
         return Py_None;
     } else {
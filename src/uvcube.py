@@ -0,0 +1,104 @@
+"""
+Module for storing UV data as on-disk, memory-mapped cubes of
+(baseline/pol, time, channel), so that the data for any baseline can be
+sliced without reading (and decoding) a Miriad file.
+
+A cube is a directory holding one .npy array per field:
+    keys    (K,3) int32 of (i,j,pol) for each baseline/pol
+    times   (T,) float64 of the times of integrations
+    freqs   (C,) float64 of channel frequencies (GHz), if known
+    uvw     (K,T,3) float64
+    data    (K,T,C) complex64
+    flags   (K,T,C) bool, True where data are flagged or missing
+"""
+
+import numpy as n, os, miriad
+from numpy.lib.format import open_memmap
+
+FIELDS = ['keys', 'times', 'freqs', 'uvw', 'data', 'flags']
+
+def _codes(bls, pols):
+    """Return a sortable integer code for each (baseline code, pol)."""
+    return n.asarray(bls, dtype=n.int64) * 16 + (n.asarray(pols) + 8)
+
+def export(uv, dirname, blocksize=256):
+    """Write the (selected) records of the Miriad UV file uv into a cube in
+    directory dirname, returning it as a UVCube.  The file is read twice:
+    once to find the baselines, pols and times present, and once to fill
+    the cube.  Baseline/pol/time combinations without a record are
+    flagged.  Freqs come from sfreq, sdf, and nchan (and the channels of
+    uv.select_chans), if these variables exist."""
+    if not os.path.exists(dirname): os.mkdir(dirname)
+    uv.rewind()
+    codes, times = [], []
+    while True:
+        p, d, f, pols = uv.read_many(blocksize, pols=True)
+        if p.shape[0] == 0: break
+        codes.append(n.unique(_codes(p[:,4], pols)))
+        times.append(n.unique(p[:,3]))
+    codes = n.unique(n.concatenate(codes + [n.zeros(0, dtype=n.int64)]))
+    times = n.unique(n.concatenate(times + [n.zeros(0)]))
+    keys = n.array([miriad.bl2ij(c / 16) + (c % 16 - 8,) for c in codes],
+        dtype=n.int32).reshape(codes.size, 3)
+    nchan = uv.nchan
+    try:
+        freqs = uv['sfreq'] + uv['sdf'] * n.arange(uv['nchan'])
+        if not uv.chans is None: freqs = freqs.take(uv.chans)
+    except(KeyError): freqs = None
+    n.save(os.path.join(dirname, 'keys.npy'), keys)
+    n.save(os.path.join(dirname, 'times.npy'), times)
+    if not freqs is None: n.save(os.path.join(dirname, 'freqs.npy'), freqs)
+    shape = (codes.size, times.size)
+    def mk(name, dtype, shape):
+        return open_memmap(os.path.join(dirname, name+'.npy'), mode='w+',
+            dtype=dtype, shape=shape)
+    uvw = mk('uvw', n.double, shape + (3,))
+    data = mk('data', n.complex64, shape + (nchan,))
+    flags = mk('flags', n.bool_, shape + (nchan,))
+    for k in xrange(codes.size): flags[k] = True
+    uv.rewind()
+    while True:
+        p, d, f, pols = uv.read_many(blocksize, pols=True)
+        if p.shape[0] == 0: break
+        ki = n.searchsorted(codes, _codes(p[:,4], pols))
+        ti = n.searchsorted(times, p[:,3])
+        uvw[ki,ti] = p[:,:3]
+        data[ki,ti] = d
+        flags[ki,ti] = f
+    uv.rewind()
+    del(uvw, data, flags)
+    return UVCube(dirname)
+
+class UVCube:
+    """Read-only access to a cube written by export.  Fields (keys, times,
+    freqs, uvw, data, flags) are memory-mapped arrays, so that data are
+    only read from disk as they are used."""
+    def __init__(self, dirname, mode='r'):
+        """Open the cube in directory dirname.  mode is passed to
+        numpy.load as mmap_mode ('r' or 'r+' to modify data)."""
+        self.dirname = dirname
+        for name in FIELDS:
+            filename = os.path.join(dirname, name+'.npy')
+            if name == 'freqs' and not os.path.exists(filename):
+                self.freqs = None
+                continue
+            setattr(self, name, n.load(filename, mmap_mode=mode))
+        self._index = {}
+        for k,key in enumerate(self.keys): self._index[tuple(map(int,key))] = k
+    def index(self, i, j, pol):
+        """Return the index into the first axis of uvw, data, and flags of
+        baseline (i,j) and polarization code pol (see miriad.str2pol)."""
+        if i > j: i,j = j,i
+        return self._index[(i,j,pol)]
+    def get(self, i, j, pol):
+        """Return (uvw, data, flags) for baseline (i,j) and polarization
+        code pol, where data and flags are (ntimes,nchan) views into the
+        memory-mapped cube.  (i,j) and (j,i) return the same (unconjugated)
+        data."""
+        k = self.index(i, j, pol)
+        return self.uvw[k], self.data[k], self.flags[k]
+    def get_masked(self, i, j, pol):
+        """Return the data for baseline (i,j) and polarization code pol as a
+        (ntimes,nchan) masked array (see get)."""
+        uvw, data, flags = self.get(i, j, pol)
+        return n.ma.array(data, mask=flags, copy=False)
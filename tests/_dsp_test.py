@@ -1,5 +1,5 @@
 import unittest
-import aipy._dsp as _dsp
+import aipy._dsp as _dsp, aipy.img as img
 import numpy as n
 
 class Testgrid1D_c(unittest.TestCase):
@@ -66,5 +66,41 @@ class Testdegrid2D_c(unittest.TestCase):
             #P.ylim(1e-10, 1)
             P.show()
 
+class Testgrid2D_kc(unittest.TestCase):
+    def setUp(self):
+        ind = n.array([[5,5], [10.1,10.1], [14.5, 15.5]], dtype=n.float32)
+        self.ind1 = ind[:,0].copy()
+        self.ind2 = ind[:,1].copy()
+    def test_gaussian(self):
+        ker = img.gridding_kernel('gaussian', 8, 256)
+        buf1 = n.zeros((32,32), dtype=n.complex64)
+        buf2 = n.zeros((32,32), dtype=n.complex64)
+        dat = n.array([1, 1, 1], dtype=n.complex64)
+        _dsp.grid2D_c(buf1, self.ind1, self.ind2, dat)
+        _dsp.grid2D_c(buf2, self.ind1, self.ind2, dat, 8, ker, 256)
+        self.assertAlmostEqual(n.max(n.abs(buf1 - buf2)), 0, 2)
+        self.assertAlmostEqual(buf2[5,5], 0.63661977236758149, 4)
+    def test_kernels(self):
+        for kernel in img.GRID_KERNELS:
+            ker = img.gridding_kernel(kernel)
+            buf = n.zeros((32,48), dtype=n.complex64)
+            dat = n.array([1, 2j, 3], dtype=n.complex64)
+            _dsp.grid2D_c(buf, self.ind1, self.ind2, dat, 6, ker, 128)
+            self.assertTrue(n.abs(buf.sum() - (4+2j)) < .1)
+            self.assertAlmostEqual(buf[5,5], ker[0]**2, 6)
+            self.assertEqual(n.sum(buf[:,:2] != 0), 0)
+            dat = n.zeros(3, dtype=n.complex64)
+            _dsp.degrid2D_c(n.ones((32,48), dtype=n.complex64),
+                self.ind1, self.ind2, dat, 6, ker, 128)
+            self.assertTrue(n.allclose(dat, 1))
+    def test_errors(self):
+        buf = n.zeros((32,32), dtype=n.complex64)
+        dat = n.ones(3, dtype=n.complex64)
+        ker = img.gridding_kernel('spheroidal')
+        self.assertRaises(ValueError, _dsp.grid2D_c, buf, self.ind1,
+            self.ind2, dat, 6, ker.astype(n.double), 128)
+        self.assertRaises(ValueError, _dsp.degrid2D_c, buf, self.ind1,
+            self.ind2, dat, 6, ker, 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the compute-intensive paths in AIPY.  Each benchmark is run
+at a problem size set by --scale, and results can be written as JSON and
+compared against those of a previous run to flag regressions."""
+
+import sys, os, tempfile, shutil, json, timeit, platform, threading
+import unittest
+import numpy as n
+
+#  ____                  _                          _
+# | __ )  ___ _ __   ___| |__  _ __ ___   __ _ _ __| | _____
+# |  _ \ / _ \ '_ \ / __| '_ \| '_ ` _ \ / _` | '__| |/ / __|
+# | |_) |  __/ | | | (__| | | | | | | | | (_| | |  |   <\__ \
+# |____/ \___|_| |_|\___|_| |_|_| |_| |_|\__,_|_|  |_|\_\___/
+
+# Each benchmark takes a problem-size scale factor and returns
+# (func, params, cleanup), where func() is the call to be timed, params
+# describes the problem size, and cleanup() (or None) releases resources.
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Register a benchmark function under the provided name."""
+    def register(f):
+        BENCHMARKS[name] = f
+        return f
+    return register
+
+def in_threads(funcs):
+    """Return a function that calls each of funcs in its own thread.  As the
+    C extensions release the GIL, its time should match that of one call
+    when there are at least len(funcs) cores."""
+    def func():
+        threads = [threading.Thread(target=f) for f in funcs]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    return func
+
+def mk_aa(nant, nchan):
+    import aipy as a
+    freqs = n.linspace(.1, .2, nchan)
+    beam = a.fit.Beam(freqs)
+    ants = [a.fit.Antenna(x, y, 0, beam) for x,y in
+        n.random.RandomState(0).uniform(-100, 100, size=(nant,2))]
+    aa = a.fit.AntennaArray(('45:00','90:00'), ants)
+    aa.set_jultime(2455400.1)
+    return aa
+
+@benchmark('phs.gen_phs')
+def bench_gen_phs(scale):
+    aa = mk_aa(2, 1024*scale)
+    s_eqs = n.array([[0,1,0]]*100).transpose()
+    def func():
+        aa._ant_phs = {}    # Time the phasing, not the phasor cache
+        aa.gen_phs(s_eqs, 0, 1)
+    return func, {'nchan':1024*scale, 'nsrc':100, 'cached':False}, None
+
+@benchmark('amp.sim')
+def bench_amp_sim(scale):
+    nsrc, nchan = 20*scale, 256*scale
+    aa = mk_aa(2, nchan)
+    rs = n.random.RandomState(1)
+    s_eqs = rs.normal(size=(3,nsrc)); s_eqs[2] = n.abs(s_eqs[2])
+    s_eqs /= n.sqrt((s_eqs**2).sum(axis=0))
+    times = iter(2455400.1 + n.arange(10**6) / 86400.)
+    def func():
+        # A new time each call, so beam and phasor caches are rebuilt
+        aa.set_jultime(times.next())
+        aa.sim_cache(s_eqs, jys=n.ones((nsrc,nchan)),
+            mfreqs=.15*n.ones(nsrc), srcshapes=n.zeros((3,nsrc)))
+        aa.sim(0, 1)
+    return func, {'nchan':nchan, 'nsrc':nsrc, 'sim_cache':True}, None
+
+def mk_uvw(nvis, size, res):
+    rs = n.random.RandomState(2)
+    uvw = rs.uniform(-size*res/2.2, size*res/2.2, size=(3,nvis))
+    uvw[2] *= .1
+    data = n.exp(1j*rs.uniform(0, 2*n.pi, size=nvis))
+    return uvw, data
+
+class NullWriter:
+    def write(self, s): pass
+
+@benchmark('img.Img.put')
+def bench_img_put(scale):
+    import aipy as a
+    size, nvis = 200, 10000*scale
+    uvw, data = mk_uvw(nvis, size, .5)
+    def func():
+        im = a.img.Img(size=size, res=.5)
+        im.put(uvw, data)
+    return func, {'size':size, 'nvis':nvis}, None
+
+@benchmark('img.ImgW.put')
+def bench_imgw_put(scale):
+    import aipy as a
+    size, nvis = 100, 2000*scale
+    uvw, data = mk_uvw(nvis, size, .5)
+    def func():
+        im = a.img.ImgW(size=size, res=.5, wres=.5)
+        stdout, sys.stdout = sys.stdout, NullWriter()
+        try: im.put(uvw, data)
+        finally: sys.stdout = stdout
+    return func, {'size':size, 'nvis':nvis}, None
+
+@benchmark('_dsp.grid2D_c')
+def bench_grid2D_c(scale):
+    import aipy._dsp as _dsp
+    dim, nvis = 256, 20000*scale
+    rs = n.random.RandomState(3)
+    ind1 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    ind2 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    dat = n.ones(nvis, dtype=n.complex64)
+    buf = n.zeros((dim,dim), dtype=n.complex64)
+    return lambda: _dsp.grid2D_c(buf, ind1, ind2, dat), \
+        {'dim':dim, 'nvis':nvis}, None
+
+@benchmark('_dsp.grid2D_c.spheroidal')
+def bench_grid2D_kc(scale):
+    import aipy._dsp as _dsp, aipy.img as img
+    dim, nvis = 256, 20000*scale
+    rs = n.random.RandomState(3)
+    ind1 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    ind2 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    dat = n.ones(nvis, dtype=n.complex64)
+    buf = n.zeros((dim,dim), dtype=n.complex64)
+    ker = img.gridding_kernel('spheroidal', 6, 128)
+    return lambda: _dsp.grid2D_c(buf, ind1, ind2, dat, 6, ker, 128), \
+        {'dim':dim, 'nvis':nvis, 'support':6}, None
+
+@benchmark('_dsp.grid2D_c.threads4')
+def bench_grid2D_c_threads(scale):
+    funcs = [bench_grid2D_c(scale)[0] for i in range(4)]
+    return in_threads(funcs), {'dim':256, 'nvis':20000*scale, 'nthreads':4}, \
+        None
+
+@benchmark('img.grid_tiled.threads4')
+def bench_grid_tiled(scale):
+    import aipy.img as img
+    dim, nvis = 256, 20000*scale
+    rs = n.random.RandomState(3)
+    ind1 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    ind2 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    dat = n.ones(nvis, dtype=n.complex64)
+    buf = n.zeros((dim,dim), dtype=n.complex64)
+    ker = img.gridding_kernel('spheroidal', 6, 128)
+    return lambda: img.grid_tiled([buf], ind1, ind2, [dat], 6, ker, 128,
+        nthreads=4), {'dim':dim, 'nvis':nvis, 'support':6, 'nthreads':4}, None
+
+@benchmark('_dsp.degrid2D_c')
+def bench_degrid2D_c(scale):
+    import aipy._dsp as _dsp
+    dim, nvis = 256, 20000*scale
+    rs = n.random.RandomState(3)
+    ind1 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    ind2 = rs.uniform(0, dim, size=nvis).astype(n.float32)
+    dat = n.zeros(nvis, dtype=n.complex64)
+    buf = n.ones((dim,dim), dtype=n.complex64)
+    return lambda: _dsp.degrid2D_c(buf, ind1, ind2, dat), \
+        {'dim':dim, 'nvis':nvis}, None
+
+def mk_dirty(shape):
+    rs = n.random.RandomState(4)
+    ker = n.zeros(shape); mdl = n.zeros(shape)
+    ker[(0,)*len(shape)] = 1
+    for i in range(len(shape)):
+        sl = [0]*len(shape)
+        for d in (1,2,-1,-2):
+            sl[i] = d; ker[tuple(sl)] = .3/abs(d)
+    for i in range(10):
+        mdl[tuple([rs.randint(s) for s in shape])] = rs.uniform(1, 10)
+    if len(shape) == 1: im = n.fft.ifft(n.fft.fft(mdl) * n.fft.fft(ker))
+    else: im = n.fft.ifft2(n.fft.fft2(mdl) * n.fft.fft2(ker))
+    return im.real, ker
+
+@benchmark('deconv.clean1d')
+def bench_clean1d(scale):
+    import aipy as a
+    im, ker = mk_dirty((4096*scale,))
+    return lambda: a.deconv.clean(im, ker, tol=1e-6), \
+        {'size':im.size}, None
+
+@benchmark('deconv.clean2d')
+def bench_clean2d(scale):
+    import aipy as a
+    im, ker = mk_dirty((128*scale,128*scale))
+    return lambda: a.deconv.clean(im, ker, tol=1e-6), \
+        {'shape':list(im.shape)}, None
+
+@benchmark('deconv.clean2d.threads4')
+def bench_clean2d_threads(scale):
+    funcs = [bench_clean2d(scale)[0] for i in range(4)]
+    return in_threads(funcs), \
+        {'shape':[128*scale,128*scale], 'nthreads':4}, None
+
+@benchmark('deconv.maxent')
+def bench_maxent(scale):
+    import aipy as a
+    im, ker = mk_dirty((64*scale,64*scale))
+    im += 1
+    return lambda: a.deconv.maxent(im, ker, var0=1e-2, maxiter=50), \
+        {'shape':list(im.shape), 'maxiter':50}, None
+
+@benchmark('healpix.get')
+def bench_hpm_get(scale):
+    import aipy as a
+    h = a.healpix.HealpixMap(nside=64*scale)
+    h.map = n.arange(h.npix(), dtype=n.double)
+    x,y,z = h.px2crd(n.arange(h.npix()))
+    return lambda: h[x,y,z], {'nside':h.nside()}, None
+
+@benchmark('healpix.set')
+def bench_hpm_set(scale):
+    import aipy as a
+    h = a.healpix.HealpixMap(nside=64*scale)
+    x,y,z = h.px2crd(n.arange(h.npix()))
+    val = n.ones(h.npix())
+    def func(): h[x,y,z] = val
+    return func, {'nside':h.nside()}, None
+
+@benchmark('healpix.from_alm')
+def bench_hpm_from_alm(scale):
+    import aipy as a
+    h = a.healpix.HealpixMap(nside=64*scale)
+    lmax = 2*h.nside()
+    alm = a.healpix.Alm(lmax, lmax)
+    alm[0,0] = 1.
+    return lambda: h.from_alm(alm), {'nside':h.nside(), 'lmax':lmax}, None
+
+def mk_uvfile(filename, nrec, nchan):
+    import aipy as a
+    uv = a.miriad.UV(filename, status='new')
+    uv['history'] = 'Benchmark data.\n'
+    uv.add_var('nchan', 'i'); uv.add_var('pol', 'i')
+    uv['nchan'] = nchan; uv['pol'] = a.miriad.str2pol['xx']
+    rs = n.random.RandomState(5)
+    data = (rs.normal(size=(nrec,nchan)) + \
+        1j*rs.normal(size=(nrec,nchan))).astype(n.complex64)
+    flags = rs.uniform(size=(nrec,nchan)) < .1
+    p = n.zeros((nrec,5))
+    p[:,3] = 2455400.1 + n.arange(nrec) / 32 * 1e-4
+    p[:,4] = a.miriad.ij2bl(0, 1)
+    return uv, p, data, flags
+
+def mk_uvbench(scale, write, bulk):
+    import aipy as a
+    nrec, nchan = 512*scale, 1024
+    tmp = tempfile.mkdtemp(prefix='aipy-benchmark-')
+    filename = os.path.join(tmp, 'bench.uv')
+    uv, p, data, flags = mk_uvfile(filename, nrec, nchan)
+    uv.write_many(p, data, flags); del(uv)
+    def write_func():
+        shutil.rmtree(filename)
+        uv, p, data, flags = mk_uvfile(filename, nrec, nchan)
+        if bulk: uv.write_many(p, data, flags)
+        else:
+            for i in xrange(nrec):
+                uv.write((p[i,:3],p[i,3],(0,1)),
+                    n.ma.array(data[i], mask=flags[i]))
+    def read_func():
+        uv = a.miriad.UV(filename)
+        if bulk: uv.read_many(nrec)
+        else:
+            for pre,d,f in uv.all(raw=True): pass
+    func = write_func if write else read_func
+    return func, {'nrec':nrec, 'nchan':nchan}, lambda: shutil.rmtree(tmp)
+
+@benchmark('miriad.UV.read')
+def bench_uv_read(scale): return mk_uvbench(scale, write=False, bulk=False)
+
+@benchmark('miriad.UV.read_many')
+def bench_uv_read_many(scale): return mk_uvbench(scale, write=False, bulk=True)
+
+@benchmark('miriad.UV.write')
+def bench_uv_write(scale): return mk_uvbench(scale, write=True, bulk=False)
+
+@benchmark('miriad.UV.write_many')
+def bench_uv_write_many(scale): return mk_uvbench(scale, write=True, bulk=True)
+
+@benchmark('rfi.flag_by_int')
+def bench_flag_by_int(scale):
+    import aipy as a
+    rs = n.random.RandomState(6)
+    ntime, nchan = 512*scale, 1024
+    d = n.ma.array(n.abs(rs.normal(size=(ntime,nchan))) + 10,
+        mask=rs.uniform(size=(ntime,nchan)) < .05)
+    return lambda: a.rfi.flag_by_int(d), {'ntime':ntime, 'nchan':nchan}, None
+
+#  ____
+# |  _ \ _   _ _ __  _ __   ___ _ __
+# | |_) | | | | '_ \| '_ \ / _ \ '__|
+# |  _ <| |_| | | | | | | |  __/ |
+# |_| \_\\__,_|_| |_|_| |_|\___|_|
+
+def run(names=None, scale=1, repeat=5, number=1, verbose=False):
+    """Run the named benchmarks (default all) and return a dictionary of
+    results suitable for writing as JSON.  Each timing is the best and
+    median over 'repeat' trials of 'number' calls, in seconds per call."""
+    import aipy as a
+    if names is None: names = sorted(BENCHMARKS.keys())
+    results = {}
+    for name in names:
+        func, params, cleanup = BENCHMARKS[name](scale)
+        try:
+            times = timeit.Timer(func).repeat(repeat=repeat, number=number)
+        finally:
+            if not cleanup is None: cleanup()
+        times = n.array(times) / number
+        results[name] = {'params':params, 'best':times.min(),
+            'median':n.median(times), 'repeat':repeat, 'number':number}
+        if verbose:
+            print '%-24s %10.3f ms %10.3f ms' % \
+                (name, times.min()*1e3, n.median(times)*1e3)
+            sys.stdout.flush()
+    return {'aipy':a.__version__, 'numpy':n.__version__,
+        'python':platform.python_version(), 'machine':platform.node(),
+        'scale':scale, 'results':results}
+
+def compare(results, baseline, tol=.2):
+    """Compare the best timings in results against those in baseline.
+    Return a list of (name, ratio, regressed) for benchmarks present in both
+    with matching problem sizes, where regressed is True when the new time
+    exceeds the baseline time by more than the fraction tol."""
+    rv = []
+    for name in sorted(results['results'].keys()):
+        try: old = baseline['results'][name]
+        except(KeyError): continue
+        new = results['results'][name]
+        if old['params'] != new['params']: continue
+        ratio = new['best'] / old['best']
+        rv.append((name, ratio, ratio > 1 + tol))
+    return rv
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run(self):
+        """Test that each benchmark runs"""
+        results = run(repeat=1)
+        self.assertEqual(sorted(results['results'].keys()),
+            sorted(BENCHMARKS.keys()))
+        # Round-trip through JSON, as used for stored baselines
+        baseline = json.loads(json.dumps(results))
+        cmp = compare(results, baseline)
+        self.assertEqual(len(cmp), len(BENCHMARKS))
+        self.assertFalse(n.any([r for name,ratio,r in cmp]))
+        name = cmp[0][0]
+        baseline['results'][name]['best'] /= 2
+        self.assertTrue(compare(results, baseline)[0][2])
+        baseline['results'][name]['params'] = {}
+        self.assertEqual(len(compare(results, baseline)), len(BENCHMARKS)-1)
+
+class TestSuite(unittest.TestSuite):
+    """A unittest.TestSuite class which contains the aipy benchmark tests."""
+
+    def __init__(self):
+        unittest.TestSuite.__init__(self)
+
+        loader = unittest.TestLoader()
+        self.addTests(loader.loadTestsFromTestCase(TestBenchmarks))
+
+if __name__ == '__main__':
+    import optparse
+
+    parser = optparse.OptionParser(usage = "python %prog [options]", description = __doc__)
+    parser.add_option('-b', '--bench', dest='bench',
+        help='Comma-delimited list of benchmarks to run.  Default is all.')
+    parser.add_option('-l', '--list', action='store_true',
+        help='List the available benchmarks and exit.')
+    parser.add_option('-s', '--scale', dest='scale', type='int', default=1,
+        help='Multiplier for the problem size of each benchmark.  Default 1.')
+    parser.add_option('-r', '--repeat', dest='repeat', type='int', default=5,
+        help='Number of trials of each benchmark.  Default 5.')
+    parser.add_option('-n', '--number', dest='number', type='int', default=1,
+        help='Number of calls per trial.  Default 1.')
+    parser.add_option('-o', '--outfile', dest='outfile',
+        help='Write results as JSON to this file.')
+    parser.add_option('-c', '--compare', dest='compare',
+        help='Compare against results (JSON) of a previous run, and exit with status 1 if any benchmark regressed.')
+    parser.add_option('-t', '--tol', dest='tol', type='float', default=.2,
+        help='Fractional slow-down beyond which a benchmark is flagged as a regression.  Default .2.')
+    opts, args = parser.parse_args()
+
+    if opts.list:
+        for name in sorted(BENCHMARKS.keys()): print name
+        sys.exit(0)
+    if opts.bench is None: names = None
+    else: names = opts.bench.split(',')
+    results = run(names, scale=opts.scale, repeat=opts.repeat,
+        number=opts.number, verbose=True)
+    if not opts.outfile is None:
+        f = open(opts.outfile, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    if not opts.compare is None:
+        baseline = json.load(open(opts.compare))
+        regressed = False
+        for name, ratio, r in compare(results, baseline, tol=opts.tol):
+            if r: regressed = True
+            print '%-24s %6.2fx %s' % (name, ratio, ['', 'REGRESSION'][r])
+        if regressed: sys.exit(1)
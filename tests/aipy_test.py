@@ -5,16 +5,21 @@
 import unittest
 
 import _alm_test
+import aipy_benchmark
 import _healpix_test
 import amp_test
 import coord_test
 import deconv_test
+import fit_test
 import helm_test
+import img_test
 import miriad_test
 import phs_test
 import phs_benchmark
 import src_test
 import scripting_test
+import threads_test
+import uvcube_test
 
 class TestSuite(unittest.TestSuite):
         """A unittest.TestSuite class which contains all of the package unit tests."""
@@ -29,12 +34,17 @@ class TestSuite(unittest.TestSuite):
                 self.addTest(amp_test.TestSuite())
                 self.addTest(coord_test.TestSuite())
                 self.addTest(deconv_test.TestSuite())
+                self.addTest(fit_test.TestSuite())
                 self.addTest(helm_test.TestSuite())
+                self.addTest(img_test.TestSuite())
                 self.addTest(miriad_test.TestSuite())
                 self.addTest(phs_test.TestSuite())
                 self.addTest(phs_benchmark.TestSuite())
+                self.addTest(aipy_benchmark.TestSuite())
                 self.addTest(src_test.TestSuite())
                 self.addTest(scripting_test.TestSuite())
+                self.addTest(threads_test.TestSuite())
+                self.addTest(uvcube_test.TestSuite())
 
 def main(opts=None, args=None):
     """Function to call all of the lsl tests."""
@@ -77,6 +77,90 @@ class TestAntenna(unittest.TestCase):
         resp = self.ant.bm_response(xyz, pol='y')
         self.assertAlmostEqual(resp, n.sqrt(n.exp(-4)), 3)
 
+class TestAntennaArray(unittest.TestCase):
+    def setUp(self):
+        self.fqs = n.arange(.1,.2,.01)
+        bm = amp.Beam2DGaussian(self.fqs, .5, .4)
+        ants = [amp.Antenna(x,y,z, bm, phsoff=[.1*x,.2*y], amp=1+.1*x)
+            for x,y,z in [(0,0,0), (10,0,1), (0,20,0), (15,5,-2)]]
+        self.aa = amp.AntennaArray(('0:00','0:00'), ants)
+        self.aa.set_jultime(2454555.)
+        lst = self.aa.sidereal_time()
+        srcs = [amp.RadioFixedBody(lst+.1, .2, jys=100., mfreq=.15,
+                    ionref=(.001,-.002), srcshape=(.01,.005,.3), name='s1'),
+                amp.RadioFixedBody(lst-.2, -.1, jys=50., mfreq=.12,
+                    name='s2'),
+                amp.RadioFixedBody(lst+n.pi, 0, jys=10., name='s3')]
+        self.cat = amp.SrcCatalog(srcs)
+        self.cat.compute(self.aa)
+        srcs = self.cat.keys()
+        self.aa.sim_cache(self.cat.get_crds('eq', srcs=srcs), 
+            self.cat.get_jys(srcs), mfreqs=self.cat.get('mfreq', srcs),
+            ionrefs=self.cat.get('ionref', srcs), 
+            srcshapes=self.cat.get('srcshape', srcs))
+    def test_sim_all(self):
+        """Test simulating all baselines at once matches sim()"""
+        bls = self.aa.bl_indices()
+        pols = ['xx','yy','xy','yx'] * len(bls)
+        pols = pols[:len(bls)]
+        vis = self.aa.sim_all(bls, pols, blk=3)
+        self.assertEqual(vis.shape, (len(bls), self.fqs.size))
+        for bl,pol,v in zip(bls, pols, vis):
+            i,j = self.aa.bl2ij(bl)
+            ans = self.aa.sim(i, j, pol=pol)
+            self.assertTrue(n.allclose(v, ans))
+        vis = self.aa.sim_all([(0,1),(1,3)], 'yy')
+        self.assertTrue(n.allclose(vis[1], self.aa.sim(1, 3, pol='yy')))
+    def test_sim_cache_jultimes(self):
+        """Test time-batched simulation matches simulating each time"""
+        srcs = self.cat.keys()
+        eqs = self.cat.get_crds('eq', srcs=srcs)
+        kwargs = {'jys':self.cat.get_jys(srcs),
+            'mfreqs':self.cat.get('mfreq', srcs),
+            'ionrefs':self.cat.get('ionref', srcs),
+            'srcshapes':self.cat.get('srcshape', srcs)}
+        times = 2454555. + n.arange(-.3, .3, .05)
+        self.aa.sim_cache(eqs, jultimes=times, **kwargs)
+        vis_t = self.aa.sim(1, 3, pol='xy')
+        self.assertEqual(vis_t.shape, (times.size, self.fqs.size))
+        vis_all = self.aa.sim_all([(0,1),(1,3)], pols=['yy','xy'])
+        self.assertEqual(vis_all.shape, (2, times.size, self.fqs.size))
+        self.assertTrue(n.allclose(vis_all[1], vis_t))
+        self.aa.sim_cache(n.array([eqs]*times.size), jultimes=times, **kwargs)
+        self.assertTrue(n.allclose(self.aa.sim(1, 3, pol='xy'), vis_t))
+        for t,v in zip(times, vis_t):
+            self.aa.set_jultime(t)
+            self.aa.sim_cache(eqs, **kwargs)
+            self.assertTrue(n.allclose(v, self.aa.sim(1, 3, pol='xy')))
+        self.aa.sim_cache(n.array([[0.],[0.],[-1.]]), n.ones((1,self.fqs.size)),
+            jultimes=times)
+        self.assertTrue(n.all(self.aa.sim(0, 1) == 0))
+        self.assertEqual(self.aa.sim(0, 1).shape, (times.size,self.fqs.size))
+    def test_sim_all_jultimes(self):
+        """Test time-batched simulation of all baselines matches sim()"""
+        srcs = self.cat.keys()
+        times = 2454555. + n.arange(-.3, .3, .05)
+        self.aa.sim_cache(self.cat.get_crds('eq', srcs=srcs),
+            self.cat.get_jys(srcs), mfreqs=self.cat.get('mfreq', srcs),
+            ionrefs=self.cat.get('ionref', srcs),
+            srcshapes=self.cat.get('srcshape', srcs), jultimes=times)
+        bls = self.aa.bl_indices()
+        pols = (['xx','yy','xy','yx'] * len(bls))[:len(bls)]
+        ans = [self.aa.sim(*self.aa.bl2ij(bl), pol=pol)
+            for bl,pol in zip(bls, pols)]
+        for blk in [1, 2*times.size, 35, 64]:
+            vis = self.aa.sim_all(bls, pols, blk=blk)
+            self.assertEqual(vis.shape, (len(bls), times.size, self.fqs.size))
+            for v,a in zip(vis, ans): self.assertTrue(n.allclose(v, a))
+    def test_sim_all_below_horizon(self):
+        """Test simulating all baselines with no sources above the horizon"""
+        self.aa.sim_cache(n.array([[0.],[0.],[-1.]]), n.ones((1,self.fqs.size)))
+        vis = self.aa.sim_all()
+        self.assertEqual(vis.shape, (10, self.fqs.size))
+        self.assertTrue(n.all(vis == 0))
+        self.aa.set_jultime(2454555.)
+        self.assertRaises(RuntimeError, self.aa.sim_all)
+
 #class TestMemLeaks(unittest.TestCase):
 #    def test_antenna_create(self):
 #        freqs = n.arange(.1,.2,.001)
@@ -99,6 +183,7 @@ class TestSuite(unittest.TestSuite):
         self.addTests(loader.loadTestsFromTestCase(TestBeam))
         self.addTests(loader.loadTestsFromTestCase(TestBeam2DGaussian))
         self.addTests(loader.loadTestsFromTestCase(TestAntenna))
+        self.addTests(loader.loadTestsFromTestCase(TestAntennaArray))
         #self.addTests(loader.loadTestsFromTestCase(TestMemLeaks))
 
 if __name__ == '__main__':
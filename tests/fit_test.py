@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import unittest
+import aipy.fit as fit, numpy as n
+
+class TestAntennaArray(unittest.TestCase):
+    def setUp(self):
+        self.fqs = n.linspace(.12, .18, 16)
+        bm = fit.Beam(self.fqs)
+        ants = [
+            fit.Antenna(0, 0, 0, bm, phsoff=[.01,.2], amp=1.1,
+                bp_r=n.array([.1,1.]), bp_i=n.array([.2,.05])),
+            fit.Antenna(100, 20, 5, bm, phsoff=[-.02,.1], amp=.9),
+            fit.Antenna(-30, 60, -10, bm, phsoff=[0.,.3]),
+        ]
+        self.aa = fit.AntennaArray(('45:00','90:00'), ants)
+        srcs = [
+            fit.RadioFixedBody('16:00', '30:00', name='s1', jys=100,
+                index=-1, srcshape=(.001,.0005,.3), ionref=(.0002,-.0001)),
+            fit.RadioFixedBody('20:00', '50:00', name='s2', jys=50,
+                index=-.5),
+            # Below the horizon
+            fit.RadioFixedBody('20:00', '-60:00', name='s3', jys=10),
+        ]
+        self.cat = fit.SrcCatalog(srcs)
+        pd = {'s1':['jys','index','ra','dec','dra','ddec'],
+            's2':['ra','dec','jys'], 's3':['jys'],
+            '0':['x','y','z','phsoff','amp','bp_r','bp_i'],
+            '1':['dly','off','amp','x']}
+        prms = self.aa.get_params(pd)
+        prms.update(self.cat.get_params(pd))
+        self.prms, self.keys = fit.flatten_prms(prms)
+        self.prms = n.array(self.prms)
+    def sim(self, prms, i, j):
+        prms = fit.reconstruct_prms(prms, self.keys)
+        self.aa.set_params(prms)
+        self.cat.set_params(prms)
+        self.aa.set_jultime(2454555.5)
+        self.cat.compute(self.aa)
+        self.aa.sim_cache(self.cat.get_crds('eq'), self.cat.get_jys(),
+            mfreqs=self.cat.get('mfreq'), ionrefs=self.cat.get('ionref'),
+            srcshapes=self.cat.get('srcshape'))
+        return self.aa.sim(i, j)
+    def test_sim_grad(self):
+        """Test aipy.fit.AntennaArray.sim_grad against finite differences"""
+        for i,j in [(0,1), (1,2), (2,0)]:
+            self.sim(self.prms, i, j)
+            grad = self.aa.sim_grad(i, j, self.cat, self.keys)
+            self.assertEqual(grad.shape, (self.prms.size, self.fqs.size))
+            for c in range(self.prms.size):
+                eps = 1e-6 * max(abs(self.prms[c]), 1e-3)
+                dp = n.zeros_like(self.prms); dp[c] = eps
+                fd = (self.sim(self.prms+dp, i, j) - \
+                    self.sim(self.prms-dp, i, j)) / (2*eps)
+                if n.all(fd == 0):
+                    self.assertTrue(n.all(grad[c] == 0))
+                    continue
+                err = n.abs(grad[c] - fd).max() / n.abs(fd).max()
+                self.assertTrue(err < 1e-3, (i,j,c,err))
+            self.sim(self.prms, i, j)
+        # Derivatives of shared parameters are summed
+        keys = self.keys.copy()
+        keys['2'] = {'x': self.keys['1']['x']}
+        g1 = self.aa.sim_grad(0, 2, self.cat, self.keys)
+        g2 = self.aa.sim_grad(0, 2, self.cat, keys)
+        c = self.keys['1']['x'][0]
+        self.assertTrue(n.all(g1[c] == 0))
+        self.assertTrue(n.any(g2[c] != 0))
+    def test_sim_grad_errors(self):
+        """Test aipy.fit.AntennaArray.sim_grad with unsupported input"""
+        self.assertRaises(RuntimeError,
+            lambda: self.aa.sim_grad(0, 1, self.cat, self.keys))
+        self.sim(self.prms, 0, 1)
+        prms, keys = fit.flatten_prms({'s1':{'a1':.001}})
+        self.assertRaises(ValueError,
+            lambda: self.aa.sim_grad(0, 1, self.cat, keys))
+
+class TestSuite(unittest.TestSuite):
+    """A unittest.TestSuite class which contains all of the aipy.fit unit tests."""
+
+    def __init__(self):
+        unittest.TestSuite.__init__(self)
+
+        loader = unittest.TestLoader()
+        self.addTests(loader.loadTestsFromTestCase(TestAntennaArray))
+
+if __name__ == '__main__':
+    unittest.main()
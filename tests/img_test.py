@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+import unittest, sys, StringIO
+import aipy as a, numpy as n
+
+class TestKernels(unittest.TestCase):
+    def test_gridding_kernel(self):
+        """Test aipy.img.gridding_kernel()"""
+        for kernel in a.img.GRID_KERNELS:
+            ker = a.img.gridding_kernel(kernel, 6, 64)
+            self.assertEqual(ker.dtype, n.float32)
+            self.assertEqual(ker.size, 6*64/2+1)
+            self.assertAlmostEqual((ker[0] + 2*ker[1:].sum()) / 64, 1, 5)
+            self.assertTrue(n.all(n.diff(ker) <= 0))
+        self.assertRaises(ValueError, a.img.gridding_kernel, 'boxcar')
+        ker = a.img.gridding_kernel('gaussian', 8, 64)
+        self.assertAlmostEqual(ker[0], 0.79788456080286541, 5)
+    def test_spheroidal(self):
+        """Test aipy.img.spheroidal()"""
+        self.assertAlmostEqual(a.img.spheroidal(0), 1, 3)
+        self.assertTrue(a.img.spheroidal(1) < .01)
+        self.assertEqual(a.img.spheroidal(1.5), 0)
+        ker = a.img.gridding_kernel('spheroidal')
+        self.assertAlmostEqual(ker[-1], 0, 6)
+    def test_grid_correction(self):
+        """Test aipy.img.grid_correction()"""
+        for kernel in a.img.GRID_KERNELS:
+            ker = a.img.gridding_kernel(kernel, 6, 64)
+            gcf = a.img.grid_correction(ker, 64, 32)
+            self.assertAlmostEqual(gcf[0], 1, 5)
+            self.assertTrue(n.all(gcf[1:16] < gcf[:15]))
+        # The transform of a Gaussian is a Gaussian
+        ker = a.img.gridding_kernel('gaussian', 10, 64)
+        f = n.fft.fftfreq(32)
+        self.assertTrue(n.allclose(a.img.grid_correction(ker, 64, 32),
+            n.exp(-n.pi**2 * f**2 / 2), atol=1e-5))
+
+class TestImg(unittest.TestCase):
+    def test_point_sources(self):
+        """Test that Img.image corrects for the gridding kernel"""
+        rs = n.random.RandomState(0)
+        u, v = rs.uniform(-30, 30, size=(2,20000))
+        w = n.zeros_like(u)
+        for kernel in a.img.GRID_KERNELS:
+            im = a.img.Img(size=64, res=.5, kernel=kernel)
+            self.assertEqual(im.kernel, kernel)
+            self.assertEqual(im.support, 6)
+            dim = im.shape[0]
+            pix = [(0,0), (20,5), (-40,30), (55,-55)]
+            d = n.zeros(u.size, dtype=n.complex)
+            for px,py in pix:
+                l,m = px / (dim * im.res), py / (dim * im.res)
+                d += n.exp(-2j*n.pi*(u*l + v*m))
+            uvw, d = im.append_hermitian((u,v,w), d)
+            im.put(uvw, d)
+            img, bm = im.image(), im.bm_image(term=0)
+            for px,py in pix:
+                self.assertAlmostEqual(img[-py,px] / bm[0,0], 1, 1)
+            # Degridding a source at phase center gives its flux
+            im = a.img.Img(size=64, res=.5, kernel=kernel)
+            im.put((u,v,w), n.ones(u.size, dtype=n.complex64))
+            dat = im.get((u[:100],v[:100],w[:100]))
+            self.assertTrue(n.allclose(dat, 1))
+
+class TestGridTiled(unittest.TestCase):
+    def setUp(self):
+        rs = n.random.RandomState(0)
+        # Indices on a 1/8 pixel grid are unchanged by shifting into tiles
+        self.ind1 = (rs.randint(-8*80, 8*80, size=50000) / 8.).astype(n.float32)
+        self.ind2 = (rs.randint(-8*80, 8*80, size=50000) / 8.).astype(n.float32)
+        self.dats = [rs.normal(size=50000).astype(n.complex64),
+            n.ones(50000, dtype=n.complex64)]
+        self.ker = a.img.gridding_kernel('spheroidal', 6, 128)
+    def grid(self, shape):
+        bufs = [n.zeros(shape, dtype=n.complex64) for d in self.dats]
+        for buf,dat in zip(bufs, self.dats):
+            a._dsp.grid2D_c(buf, self.ind1, self.ind2, dat, 6, self.ker, 128)
+        return bufs
+    def test_grid_tiled(self):
+        """Test that aipy.img.grid_tiled matches _dsp.grid2D_c"""
+        for shape in [(160,160), (128,96), (10,16)]:
+            ref = self.grid(shape)
+            for nthreads, ntiles in [(1,None), (3,None), (4,7), (2,1)]:
+                bufs = [n.zeros(shape, dtype=n.complex64) for d in self.dats]
+                a.img.grid_tiled(bufs, self.ind1, self.ind2, self.dats, 6,
+                    self.ker, 128, nthreads=nthreads, ntiles=ntiles)
+                for buf,r in zip(bufs, ref):
+                    self.assertTrue(n.allclose(buf, r, rtol=0,
+                        atol=1e-5 * n.abs(r).max()))
+    def test_errors(self):
+        """Test that aipy.img.grid_tiled raises errors from its threads"""
+        bufs = [n.zeros((64,64), dtype=n.complex64)]
+        self.assertRaises(ValueError, a.img.grid_tiled, bufs, self.ind1,
+            self.ind2, self.dats[:1], 6, self.ker.astype(n.double), 128,
+            nthreads=2)
+    def test_put(self):
+        """Test that Img.put with nthreads > 1 matches serial gridding"""
+        rs = n.random.RandomState(1)
+        u, v = rs.uniform(-30, 30, size=(2,20000))
+        w = n.zeros_like(u)
+        d = rs.normal(size=u.size).astype(n.complex64)
+        im1 = a.img.Img(size=64, res=.5, mf_order=1)
+        im1.put((u,v,w), d, [n.ones_like(u), u / 30.])
+        im4 = a.img.Img(size=64, res=.5, mf_order=1, nthreads=4)
+        self.assertEqual(im4.nthreads, 4)
+        im4.put((u,v,w), d, [n.ones_like(u), u / 30.])
+        for b4,b1 in zip([im4.uv] + im4.bm, [im1.uv] + im1.bm):
+            self.assertTrue(n.allclose(b4, b1, rtol=0,
+                atol=1e-2 * n.abs(b1).max()))
+        uv, bm = im4.put((u,v,w), d, [n.ones_like(u), u / 30.], apply=False)
+        self.assertTrue(n.all(uv == im4.uv))
+
+class TestImgWStack(unittest.TestCase):
+    def setUp(self):
+        rs = n.random.RandomState(2)
+        self.u, self.v = rs.uniform(-30, 30, size=(2,20000))
+        self.w = rs.uniform(-15, 15, size=20000)
+    def test_wscreen(self):
+        """Test ImgWStack.wscreen()"""
+        im = a.img.ImgWStack(size=64, res=.5)
+        L,M = im.get_LM()
+        for w in [0, 3.]:
+            G = im.wscreen(w)
+            self.assertEqual(G.dtype, n.complex64)
+            self.assertTrue(n.all(G[L.mask] == 0))
+            self.assertTrue(n.allclose(n.abs(G[~L.mask]), 1))
+        # By default, layers are spaced for phase errors of pi/4 at the edge
+        # of the field of view
+        x,y,z = im.get_top()
+        self.assertAlmostEqual(n.pi * im.wres * (1 - z).max(), n.pi/4, 5)
+        self.assertTrue(a.img.ImgWStack(size=64, res=2).wres > 2 * im.wres)
+        im = a.img.ImgWStack(size=64, res=.5, wres=.5)
+        self.assertTrue(n.all(im.get_layers([-.3, .2, .26, 1.]) == [-1,0,1,2]))
+    def test_matches_imgw(self):
+        """Test that ImgWStack matches ImgW for data at a single w"""
+        u, v, w = self.u[:2000], self.v[:2000], n.ones(2000) * 2.25
+        d = n.random.RandomState(3).normal(size=2000).astype(n.complex64)
+        wgts = [n.ones(2000), u / 30.]
+        imw = a.img.ImgW(size=64, res=.5, mf_order=1)
+        stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+        try: imw.put((u,v,w), d, wgts)
+        finally: sys.stdout = stdout
+        ims = a.img.ImgWStack(size=64, res=.5, wres=.25, mf_order=1)
+        ims.put((u,v,w), d, wgts)
+        for p1,p2 in zip([imw.uv] + imw.bm, [ims.uv] + ims.bm):
+            self.assertTrue(n.allclose(p1, p2, rtol=0,
+                atol=1e-5 * n.abs(p1).max()))
+    def test_point_sources(self):
+        """Test that ImgWStack images wide-field sources with w terms"""
+        pix = [(0,0), (20,5), (-40,30), (40,-35)]
+        d = n.zeros(self.u.size, dtype=n.complex)
+        for px,py in pix:
+            l,m = px / 64., py / 64.
+            d += n.exp(-2j*n.pi*(self.u*l + self.v*m -
+                self.w*(n.sqrt(1 - l**2 - m**2) - 1)))
+        for im in [a.img.Img(size=64, res=.5),
+                a.img.ImgWStack(size=64, res=.5, wres=.25)]:
+            uvw, dd = im.append_hermitian((self.u,self.v,self.w), d)
+            im.put(uvw, dd)
+            img, bm = im.image(), im.bm_image(term=0)
+            amps = [img[-py,px] / bm[0,0] for px,py in pix]
+            if not isinstance(im, a.img.ImgWStack):
+                self.assertTrue(amps[-1] < .5)
+            else:
+                for amp in amps: self.assertAlmostEqual(amp, 1, 1)
+        # Degridding a source at phase center gives its flux
+        im = a.img.ImgWStack(size=64, res=.5, wres=.25)
+        im.put((self.u,self.v,self.w), n.ones(self.u.size, dtype=n.complex64))
+        dat = im.get((self.u[:100],self.v[:100],self.w[:100]))
+        self.assertTrue(n.allclose(dat, 1, atol=1e-2))
+
+class TestImgW(unittest.TestCase):
+    def setUp(self):
+        rs = n.random.RandomState(4)
+        self.u, self.v = rs.uniform(-30, 30, size=(2,5000))
+        self.w = rs.uniform(-10, 10, size=5000)
+        self.d = rs.normal(size=5000).astype(n.complex64)
+        self.stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    def tearDown(self):
+        sys.stdout = self.stdout
+    def test_wbins(self):
+        """Test ImgW.get_wbins() and ImgW.w_bin()"""
+        im = a.img.ImgW(size=64, res=.5, wres=.5)
+        self.assertTrue(n.all(im.get_wbins([-2.25, -.01, 0, .2, 1]) ==
+            [-3, 0, 0, 1, 2]))
+        self.assertEqual(im.w_bin(-3), -2.25)
+    def test_cache(self):
+        """Test that ImgW reuses cached kernels and projected planes"""
+        cache = a.phs.LRUCache()
+        uvw = (self.u, self.v, self.w)
+        nbins = n.unique(a.img.ImgW(wres=.5).get_wbins(self.w)).size
+        im1 = a.img.ImgW(size=64, res=.5, cache=cache)
+        im1.put(uvw, self.d)
+        self.assertEqual((cache.hits, cache.misses), (0, nbins))
+        im2 = a.img.ImgW(size=64, res=.5, cache=cache)
+        im2.put(uvw, self.d)
+        im2.put(uvw, self.d)
+        self.assertEqual((cache.hits, cache.misses), (2*nbins, nbins))
+        self.assertTrue(n.allclose(im2.uv, 2*im1.uv, atol=1e-6))
+        # Projected planes are reused until the next put(), and are kept
+        # out of the shared kernel cache
+        dat = im1.get((self.u[:100],self.v[:100],self.w[:100]))
+        nplanes = len(im1.wproj_cache)
+        self.assertTrue(nplanes > 0)
+        self.assertFalse(any(isinstance(v, tuple)
+            for v in cache._data.values()))
+        self.assertTrue(n.all(dat == im1.get((self.u[:100],self.v[:100],
+            self.w[:100]))))
+        self.assertEqual(im1.wproj_cache.hits, nplanes)
+        self.assertEqual(len(im2.wproj_cache), 0)
+        im1.put(uvw, self.d)
+        self.assertEqual(len(im1.wproj_cache), 0)
+        self.assertTrue(n.allclose(dat, im1.get((self.u[:100],self.v[:100],
+            self.w[:100])), atol=1e-4))
+        self.assertEqual(im1.wproj_cache.misses, nplanes)
+    def test_maxbytes(self):
+        """Test that ImgW's cache stays within its memory bound"""
+        nbytes = n.zeros((128,128), dtype=n.complex64).nbytes
+        cache = a.phs.LRUCache(maxbytes=3*nbytes)
+        im = a.img.ImgW(size=64, res=.5, cache=cache)
+        im.put((self.u,self.v,self.w), self.d)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.nbytes, 3*nbytes)
+    def test_compact(self):
+        """Test ImgW with compact W projection kernels"""
+        cache = a.phs.LRUCache()
+        im = a.img.ImgW(size=200, res=4, wres=.5, cache=cache)
+        imc = a.img.ImgW(size=200, res=4, wres=.5, ker_tol=1e-3, cache=cache)
+        invker = im.get_invker(4)
+        ker = imc.compact_invker(invker)
+        self.assertEqual(ker.shape, (13,13))
+        tol = .05 * n.abs(invker).max()
+        self.assertTrue(n.allclose(imc.expand_invker(ker), invker, atol=tol))
+        self.assertTrue(n.allclose(imc.get_invker(4), invker, atol=tol))
+        self.assertEqual(len(cache), 2)
+        # Not smaller than the full plane
+        imc.ker_tol = 1e-30
+        self.assertTrue(imc.compact_invker(invker) is invker)
+
+class TestCoords(unittest.TestCase):
+    def setUp(self):
+        self.im = a.img.Img(size=64, res=.5)
+    def test_get_LM(self):
+        """Test Img.get_LM()"""
+        L,M = self.im.get_LM()
+        self.assertEqual(L.dtype, n.float32)
+        self.assertAlmostEqual(L[0,1], -1/64.)
+        self.assertAlmostEqual(M[1,0], 1/64.)
+        self.assertTrue(n.all(L.mask == (L.data**2 + M.data**2 >= 1)))
+        self.assertTrue(n.all(L.mask == self.im.get_horizon()))
+        L2,M2 = self.im.get_LM(center=(64,64), masked=False)
+        self.assertFalse(n.ma.isMA(L2))
+        self.assertTrue(n.all(L2 == a.img.recenter(L.data, (64,64))))
+        self.assertRaises(ValueError, L2.__setitem__, (0,0), 1)
+    def test_cache(self):
+        """Test that coordinate grids are cached per (shape, res, center)"""
+        a.img.crdcache.clear()
+        x,y,z = self.im.get_top(masked=False)
+        x2,y2,z2 = a.img.Img(size=64, res=.5).get_top(masked=False)
+        self.assertTrue(n.may_share_memory(z, z2))
+        self.assertEqual((a.img.crdcache.hits, a.img.crdcache.misses), (1, 1))
+        a.img.Img(size=64, res=1).get_top()
+        self.im.get_top(center=(1,1))
+        self.assertEqual(a.img.crdcache.misses, 3)
+    def test_get_top(self):
+        """Test Img.get_top()"""
+        x,y,z = self.im.get_top()
+        self.assertTrue(n.ma.allclose(x**2 + y**2 + z**2, 1))
+        # Masked results may be edited in place without touching the cache
+        x *= 2
+        x[0,0] = n.ma.masked
+        L,M = self.im.get_LM()
+        L[1,1] = 5
+        L.mask[2,2] = True
+        x,y,z = self.im.get_top(masked=False)
+        self.assertTrue(n.all(z[self.im.get_horizon()] == 0))
+        L,M = self.im.get_LM()
+        self.assertAlmostEqual(L[0,1], -1/64.)
+        self.assertAlmostEqual(L[1,1], -1/64.)
+        self.assertFalse(L.mask[0,0] or L.mask[2,2])
+        self.assertTrue(n.all(L.mask == self.im.get_horizon()))
+    def test_get_eq(self):
+        """Test Img.get_eq()"""
+        ra, dec = 1.1, -.4
+        x,y,z = self.im.get_top(center=(10,20))
+        eq = self.im.get_eq(ra, dec, center=(10,20))
+        self.assertEqual(eq.shape, (3,) + self.im.shape)
+        self.assertTrue(n.all(eq.mask[2] == x.mask))
+        m = a.coord.top2eq_m(-ra, dec)
+        for i,j in [(0,0), (5,70), (100,3)]:
+            if x.mask[i,j]: continue
+            self.assertTrue(n.allclose(eq[:,i,j],
+                n.dot(m, [x[i,j], y[i,j], z[i,j]]), atol=1e-6))
+        self.assertTrue(n.all(eq.filled(0) ==
+            self.im.get_eq(ra, dec, center=(10,20), masked=False) * ~eq.mask))
+
+class TestSuite(unittest.TestSuite):
+    """A unittest.TestSuite class which contains all of the aipy.img unit tests."""
+
+    def __init__(self):
+        unittest.TestSuite.__init__(self)
+
+        loader = unittest.TestLoader()
+        self.addTests(loader.loadTestsFromTestCase(TestKernels))
+        self.addTests(loader.loadTestsFromTestCase(TestImg))
+        self.addTests(loader.loadTestsFromTestCase(TestGridTiled))
+        self.addTests(loader.loadTestsFromTestCase(TestImgWStack))
+        self.addTests(loader.loadTestsFromTestCase(TestImgW))
+        self.addTests(loader.loadTestsFromTestCase(TestCoords))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 import tempfile
-import unittest, numpy as np, os
+import unittest, numpy as np, os, threading
 import aipy.miriad as m, aipy._miriad as _m
 
 class TestMiriadUV(unittest.TestCase):
@@ -51,6 +51,399 @@ class TestMiriadUV(unittest.TestCase):
     def tearDown(self):
         os.system("rm -rf %s" % self.tmppath)
 
+class TestMiriadUVMany(unittest.TestCase):
+    def setUp(self):
+        self.tmppath = tempfile.mkdtemp(prefix='miriad-test-', suffix='.tmp')
+        self.filename = os.path.join(self.tmppath, 'test.uv')
+        uv = m.UV(self.filename, status='new', corrmode='r')
+        uv['history'] = 'Made this file from scratch.\n'
+        uv.add_var('nchan', 'i')
+        uv.add_var('pol', 'i')
+        uv['nchan'] = 4
+        self.times = [2454555.5, 2454555.6, 2454555.7]
+        self.bls = [(0,0), (0,1), (1,1)]
+        self.pols = [-5, -6]
+        cnt = 0
+        for t in self.times:
+            for pol in self.pols:
+                uv['pol'] = pol
+                for bl in self.bls:
+                    uvw = np.array([cnt,2*cnt,3*cnt], dtype=np.double)
+                    d = np.arange(4, dtype=np.complex64) * (1+1j) + cnt
+                    mask = np.array([cnt%2,0,cnt%3 == 0,1])
+                    uv.write((uvw,t,bl), np.ma.array(d, mask=mask))
+                    cnt += 1
+        self.nrec = cnt
+        del(uv)
+    def records(self):
+        uv = m.UV(self.filename)
+        rv = []
+        for (uvw,t,bl),d,f in uv.all(raw=True):
+            rv.append((uvw, t, bl, d, f, uv['pol']))
+        return rv
+    def test_read_many(self):
+        """Test reading many records at once from a Miriad UV file"""
+        recs = self.records()
+        uv = m.UV(self.filename)
+        p1, d1, f1 = uv.read_many(4)
+        p2, d2, f2, pol2 = uv.read_many(100, pols=True)
+        self.assertEqual(p1.shape, (4,5))
+        self.assertEqual(d1.shape, (4,4))
+        self.assertEqual(d1.dtype, np.complex64)
+        self.assertEqual(f1.dtype, np.bool_)
+        self.assertEqual(p2.shape[0], self.nrec - 4)
+        self.assertEqual(pol2.shape, (self.nrec - 4,))
+        p = np.concatenate([p1,p2]); d = np.concatenate([d1,d2])
+        f = np.concatenate([f1,f2])
+        for cnt,(uvw,t,bl,_d,_f,pol) in enumerate(recs):
+            self.assertTrue(np.all(p[cnt,:3] == uvw))
+            self.assertEqual(p[cnt,3], t)
+            self.assertEqual(m.bl2ij(p[cnt,4]), bl)
+            self.assertTrue(np.all(d[cnt] == _d))
+            self.assertTrue(np.all(f[cnt] == _f))
+            if cnt >= 4: self.assertEqual(pol2[cnt-4], pol)
+        p, d, f = uv.read_many(10)
+        self.assertEqual(p.shape, (0,5))
+        self.assertRaises(IOError, uv.read)
+    def test_read_block(self):
+        """Test reading integrations from a Miriad UV file"""
+        recs = self.records()
+        nbl = len(self.bls) * len(self.pols)
+        uv = m.UV(self.filename)
+        for cnt,t in enumerate(self.times):
+            p, d, f, pol = uv.read_block(pols=True, blocksize=4)
+            self.assertEqual(p.shape, (nbl,5))
+            self.assertTrue(np.all(p[:,3] == t))
+            self.assertTrue(np.all(pol == np.repeat(self.pols, len(self.bls))))
+            for i in range(nbl):
+                self.assertTrue(np.all(d[i] == recs[cnt*nbl+i][3]))
+                self.assertTrue(np.all(f[i] == recs[cnt*nbl+i][4]))
+        p, d, f, pol = uv.read_block(pols=True)
+        self.assertEqual(p.shape, (0,5))
+    def test_read_many_holdover(self):
+        """Test that a record held over by read_many is returned by read"""
+        recs = self.records()
+        nbl = len(self.bls) * len(self.pols)
+        uv = m.UV(self.filename)
+        p, d, f = uv.read_many(100, stop_at_int=True)
+        self.assertEqual(p.shape[0], nbl)
+        (uvw,t,bl),_d,_f = uv.read(raw=True)
+        self.assertEqual(t, self.times[1])
+        self.assertTrue(np.all(_d == recs[nbl][3]))
+        self.assertTrue(np.all(_f == recs[nbl][4]))
+        uv.rewind()
+        (uvw,t,bl),_d = uv.read()
+        self.assertEqual(t, self.times[0])
+    def test_read_many_errors(self):
+        """Test raw_read_many with badly shaped or typed arrays"""
+        uv = m.UV(self.filename)
+        p = np.empty((2,5), dtype=np.double)
+        d = np.empty((2,4), dtype=np.complex64)
+        f = np.empty((2,4), dtype=np.bool_)
+        self.assertRaises(ValueError,
+            lambda: uv.raw_read_many(p[:,:3], d, f, None, 0, -1.))
+        self.assertRaises(ValueError, lambda: uv.raw_read_many(p,
+            d.astype(np.complex128), f, None, 0, -1.))
+        self.assertRaises(ValueError,
+            lambda: uv.raw_read_many(p, d[:,::2], f[:,::2], None, 0, -1.))
+        self.assertRaises(ValueError, lambda: uv.raw_read_many(p, d, f,
+            np.empty(2, dtype=np.float64), 0, -1.))
+        self.assertEqual(uv.raw_read_many(p, d, f, None, 0, -1.), 2)
+    def test_write_many(self):
+        """Test writing many records at once to a Miriad UV file"""
+        recs = self.records()
+        uvi = m.UV(self.filename)
+        p, d, f, pol = uvi.read_many(100, pols=True)
+        filename = os.path.join(self.tmppath, 'test2.uv')
+        uvo = m.UV(filename, status='new')
+        uvo.init_from_uv(uvi)
+        uvo.add_var('lst', 'd')
+        uvo.add_var('foo', 'r')
+        lst = np.arange(p.shape[0]) * .1
+        foo = np.array([lst, -lst]).transpose()
+        uvo.write_many(p, d, f, vars={'pol':pol, 'lst':lst, 'foo':foo})
+        del(uvi); del(uvo)
+        uv = m.UV(filename)
+        for cnt,((uvw,t,bl),_d,_f) in enumerate(uv.all(raw=True)):
+            self.assertTrue(np.all(uvw == recs[cnt][0]))
+            self.assertEqual(t, recs[cnt][1])
+            self.assertEqual(bl, recs[cnt][2])
+            self.assertTrue(np.all(_d == recs[cnt][3]))
+            self.assertTrue(np.all(_f == recs[cnt][4]))
+            self.assertEqual(uv['pol'], recs[cnt][5])
+            self.assertAlmostEqual(uv['lst'], lst[cnt])
+            self.assertTrue(np.allclose(uv['foo'], foo[cnt]))
+        self.assertEqual(cnt+1, self.nrec)
+    def test_write_many_masked(self):
+        """Test writing many masked records to a Miriad UV file"""
+        filename = os.path.join(self.tmppath, 'test2.uv')
+        uv = m.UV(filename, status='new')
+        uv.add_var('nchan', 'i')
+        uv['nchan'] = 4
+        p = np.array([[1,2,3,2454555.5,m.ij2bl(0,1)]] * 2)
+        d = np.ma.array(np.ones((2,4)), mask=[[0,1,0,0],[1,0,0,1]])
+        uv.write_many(p, d)
+        uv.add_var('source', 'a')
+        self.assertRaises(ValueError, uv.write_many, p, d,
+            vars={'source':np.array(['a','b'])})
+        self.assertRaises(ValueError, uv.write_many, p, d,
+            vars={'nchan':np.array([4])})
+        self.assertRaises(ValueError, uv.raw_write_many, p, d.data,
+            d.mask, [])
+        del(uv)
+        uv = m.UV(filename)
+        p2, d2, f2 = uv.read_many(10)
+        self.assertTrue(np.all(p2 == p))
+        self.assertTrue(np.all(d2 == d.data))
+        self.assertTrue(np.all(f2 == d.mask))
+    def test_select_mask(self):
+        """Test selecting baselines and pols with a mask"""
+        recs = self.records()
+        uv = m.UV(self.filename)
+        blmask = np.zeros((2,2), dtype=np.bool_)
+        blmask[1,0] = True
+        uv.select_mask(blmask, [-6])
+        p, d, f = uv.read_many(100)
+        ans = [r for r in recs if r[2] == (0,1) and r[5] == -6]
+        self.assertEqual(p.shape[0], len(ans))
+        for cnt,r in enumerate(ans):
+            self.assertEqual(m.bl2ij(p[cnt,4]), (0,1))
+            self.assertTrue(np.all(d[cnt] == r[3]))
+        # Masks smaller than the array discard the antennas beyond them
+        uv.rewind()
+        uv.select_mask(np.ones((1,1)), None)
+        self.assertEqual([bl for (uvw,t,bl),_d in uv.all()], [(0,0)] * 6)
+        uv.rewind()
+        uv.select('clear', 0, 0)
+        self.assertEqual(len(list(uv.all())), self.nrec)
+        self.assertRaises(ValueError, uv.select_mask, np.ones((2,3)), None)
+    def test_prefetch(self):
+        """Test reading records ahead on a background thread"""
+        recs = self.records()
+        uv = m.UV(self.filename)
+        p, d, f, pol = uv.read_many(100, pols=True)
+        uv.rewind()
+        blocks = list(uv.prefetch(blocksize=4, depth=1, pols=True))
+        self.assertEqual([b[0].shape[0] for b in blocks], [4,4,4,4,2])
+        for ans,b in zip((p,d,f,pol), zip(*blocks)):
+            self.assertTrue(np.all(ans == np.concatenate(b)))
+        uv.rewind()
+        for cnt,((uvw,t,bl),_d) in enumerate(uv.all(prefetch=2)):
+            self.assertTrue(np.all(uvw == recs[cnt][0]))
+            self.assertEqual((t,bl), recs[cnt][1:3])
+            self.assertTrue(np.all(_d.data == recs[cnt][3]))
+            self.assertTrue(np.all(_d.mask == recs[cnt][4]))
+        self.assertEqual(cnt+1, self.nrec)
+        # Polarizations are yielded whether or not records are prefetched
+        for prefetch in (0, 2):
+            uv.rewind()
+            recs = list(uv.all(raw=True, prefetch=prefetch, pols=True))
+            self.assertEqual([r[-1] for r in recs], list(pol))
+            self.assertTrue(np.all(np.array([r[1] for r in recs]) == d))
+            self.assertTrue(np.all(np.array([r[2] for r in recs]) == f))
+        # Closing the iterator early stops the reader
+        nthreads = threading.active_count()
+        uv.rewind()
+        blocks = uv.prefetch(blocksize=1, depth=1)
+        blocks.next()
+        blocks.close()
+        self.assertEqual(threading.active_count(), nthreads)
+        (uvw,t,bl),_d = uv.read()
+    def test_threads(self):
+        """Test reading files concurrently from several threads"""
+        recs = self.records()
+        results = [None] * 4
+        def read(i):
+            uv = m.UV(self.filename)
+            results[i] = [uv.read_many(1) for cnt in range(self.nrec)]
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(4)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        for r in results:
+            for cnt,(p,d,f) in enumerate(r):
+                self.assertEqual(m.bl2ij(p[0,4]), recs[cnt][2])
+                self.assertTrue(np.all(d[0] == recs[cnt][3]))
+                self.assertTrue(np.all(f[0] == recs[cnt][4]))
+    def test_time_index(self):
+        """Test seeking to times with an index of integrations"""
+        recs = self.records()
+        uv = m.UV(self.filename)
+        uv.read_many(2)
+        self.assertTrue(np.all(uv.times() == self.times))
+        self.assertTrue(os.path.exists(os.path.join(self.filename,
+            'tindex.npz')))
+        # Building the index leaves the position unchanged
+        p, d, f = uv.read_many(1)
+        self.assertTrue(np.all(p[0,:3] == recs[2][0]))
+        uv.select('antennae', 0, 1)
+        for k in (2, 0, 1):
+            self.assertEqual(uv.seek_time(self.times[k] - 1e-3), self.times[k])
+            ans = [r for r in recs if r[1] == self.times[k] and r[2] == (0,1)]
+            for r in ans + recs[6*k+7:6*k+8]:
+                (uvw,t,bl),_d,_f = uv.read(raw=True)
+                self.assertEqual((t,bl), r[1:3])
+                self.assertTrue(np.all(_d == r[3]))
+                self.assertEqual(uv['pol'], r[5])
+        self.assertEqual(uv.seek_time(self.times[-1] + 1), None)
+        self.assertEqual(len(list(uv.all())), 0)
+        uv.rewind()
+        self.assertEqual(len(list(uv.all())), 6)
+        # A saved index is reused until the data change
+        uv = m.UV(self.filename)
+        sel = uv.select_times(self.times[1], self.times[1] + .01)
+        self.assertTrue(np.all(sel == self.times[1:2]))
+        self.assertEqual([bl for (uvw,t,bl),_d in uv.all()], self.bls * 2)
+        uv.select_times(self.times[0] + .01, self.times[1] - .01)
+        self.assertEqual(len(list(uv.all())), 0)
+        uv.rewind()
+        self.assertEqual(len(list(uv.all())), self.nrec)
+        uv = m.UV(self.filename, status='append')
+        uv.write((np.zeros(3), self.times[-1] + .1, (0,1)),
+            np.ma.array(np.ones(4), mask=np.zeros(4)))
+        del(uv)
+        uv = m.UV(self.filename)
+        self.assertEqual(uv.times().size, 4)
+    def test_uvset(self):
+        """Test reading several Miriad UV files as one data set"""
+        recs = self.records()
+        filename = os.path.join(self.tmppath, 'test2.uv')
+        uvi, uvo = m.UV(self.filename), m.UV(filename, status='new')
+        uvo.init_from_uv(uvi)
+        p, d, f, pol = uvi.read_many(100, pols=True)
+        p[:,3] += 1
+        uvo.write_many(p, d, f, vars={'pol':pol})
+        del(uvi); del(uvo)
+        for preopen in (True, False):
+            uvs = m.UVSet([filename, self.filename], preopen=preopen)
+            self.assertEqual(uvs.filenames, [self.filename, filename])
+            ts = [t for (uvw,t,bl),_d in uvs.all()]
+            self.assertEqual(ts, [r[1] for r in recs] + [r[1]+1 for r in recs])
+            self.assertEqual(uvs.fileno, 2)
+            self.assertRaises(IOError, uvs.read)
+            uvs.rewind()
+            blmask = np.zeros((2,2), dtype=np.bool_)
+            blmask[0,1] = True
+            uvs.select_mask(blmask, [-6])
+            for k in range(2):
+                p, d, f, pol = uvs.read_many(100, pols=True)
+                self.assertEqual(uvs.filename(), uvs.filenames[k])
+                self.assertEqual(p.shape[0], 3)
+                self.assertTrue(np.all(pol == -6))
+                self.assertEqual(uvs['pol'], -6)
+            self.assertEqual(uvs.read_many(100)[0].shape, (0,5))
+            uvs.rewind()
+            uvs.select('clear', 0, 0)
+            uvs.select_chans([1,2])
+            blocks = [uvs.read_block()[1] for k in range(7)]
+            self.assertEqual([b.shape for b in blocks], [(6,2)] * 6 + [(0,0)])
+            self.assertTrue(np.all(blocks[3] == blocks[0]))
+        # Files are sorted by the times of their saved indices, unopened
+        self.assertEqual(m.start_time(filename), self.times[0] + 1)
+        for fn in (filename, self.filename): m.UV(fn).time_index()
+        UV, m.UV = m.UV, None
+        try:
+            self.assertEqual(m.start_time(filename), self.times[0] + 1)
+            self.assertEqual(m.start_time(self.filename), self.times[0])
+        finally: m.UV = UV
+        # An out-of-date index is not used
+        np.savez(os.path.join(filename, 'tindex.npz'), times=[0.],
+            positions=np.zeros((1,1)), stamp=[0,0])
+        self.assertEqual(m.start_time(filename), self.times[0] + 1)
+    def test_pipe_batched(self):
+        """Test piping whole integrations through a function"""
+        recs = self.records()
+        uvi = m.UV(self.filename)
+        uvi.select('antennae', 1, 1, include=0)
+        filename = os.path.join(self.tmppath, 'test2.uv')
+        uvo = m.UV(filename, status='new')
+        uvo.init_from_uv(uvi)
+        sizes = []
+        def bfunc(uv, p, d, f):
+            sizes.append(p.shape[0])
+            self.assertTrue(np.all(p[:,3] == p[0,3]))
+            if p[0,3] == self.times[1]: return None
+            i, j = m.bl2ij(p[:,4])
+            d *= (i + j + 1)[:,np.newaxis]
+            return p, d, f
+        uvo.pipe_batched(uvi, bfunc, append2hist='test\n', blocksize=2)
+        self.assertEqual(sizes, [4] * 3)
+        del(uvo)
+        uv = m.UV(filename)
+        self.assertTrue(uv['history'].endswith('test\n'))
+        ans = [r for r in recs if r[2] != (1,1) and r[1] != self.times[1]]
+        for cnt,((uvw,t,bl),_d,_f) in enumerate(uv.all(raw=True)):
+            r = ans[cnt]
+            self.assertEqual((t,bl), r[1:3])
+            self.assertTrue(np.all(_d == r[3] * (bl[0] + bl[1] + 1)))
+            self.assertTrue(np.all(_f == r[4]))
+            self.assertEqual(uv['pol'], r[5])
+        self.assertEqual(cnt+1, len(ans))
+        # Changing the number of records requires returning pols
+        uvi.rewind()
+        uvo = m.UV(os.path.join(self.tmppath, 'test3.uv'), status='new')
+        uvo.init_from_uv(uvi)
+        self.assertRaises(ValueError, uvo.pipe_batched, uvi,
+            lambda uv, p, d, f: (p[:1], d[:1], f[:1]))
+        uvi.rewind()
+        uvo.pipe_batched(uvi,
+            lambda uv, p, d, f: (p[:1], d[:1], f[:1], np.array([-7])))
+        del(uvo)
+        uv = m.UV(os.path.join(self.tmppath, 'test3.uv'))
+        self.assertEqual([uv['pol'] for p,d in uv.all()], [-7] * 3)
+    def test_read_reuse(self):
+        """Test reading records into reused buffers"""
+        recs = self.records()
+        uv = m.UV(self.filename)
+        buf = uv.mk_buffers()
+        (uvw,t,bl),d,f = uv.read(raw=True, out=buf)
+        self.assertTrue(d is buf[1] and f is buf[2])
+        self.assertTrue(np.all(uvw == recs[0][0]))
+        (uvw,t,bl),d = uv.read(out=buf)
+        self.assertTrue(np.all(d.data == recs[1][3]))
+        self.assertTrue(np.all(d.mask == recs[1][4]))
+        self.assertEqual((t,bl), recs[1][1:3])
+        uv.rewind()
+        for cnt,((uvw,t,bl),d,f) in enumerate(uv.all(raw=True, reuse=True)):
+            if cnt == 0: d0, f0 = d, f
+            self.assertTrue(d is d0 and f is f0)
+            self.assertTrue(np.all(uvw == recs[cnt][0]))
+            self.assertEqual((t,bl), recs[cnt][1:3])
+            self.assertTrue(np.all(d == recs[cnt][3]))
+            self.assertTrue(np.all(f == recs[cnt][4]))
+        self.assertEqual(cnt+1, self.nrec)
+        uv.rewind()
+        self.assertRaises(ValueError, uv.read, out=(buf[0], buf[1][::2], buf[2][::2]))
+        self.assertRaises(ValueError, uv.read,
+            out=(buf[0], buf[1].astype(np.complex128), buf[2]))
+    def test_select_chans(self):
+        """Test reading a subset of channels"""
+        recs = self.records()
+        uv = m.UV(self.filename)
+        for chans in [[1,2], [0,2], [3], [3,0], [1,1,2], np.arange(4)]:
+            uv.rewind()
+            uv.select_chans(chans)
+            self.assertEqual(uv.nchan, len(chans))
+            for cnt,((uvw,t,bl),d,f) in enumerate(uv.all(raw=True)):
+                self.assertEqual(d.shape, (len(chans),))
+                self.assertTrue(np.all(d == recs[cnt][3][chans]))
+                self.assertTrue(np.all(f == recs[cnt][4][chans]))
+            self.assertEqual(cnt+1, self.nrec)
+            uv.rewind()
+            p, d, f = uv.read_many(100)
+            self.assertEqual(d.shape, (self.nrec, len(chans)))
+            self.assertTrue(np.all(d == np.array([r[3][chans] for r in recs])))
+            self.assertTrue(np.all(f == np.array([r[4][chans] for r in recs])))
+        uv.rewind()
+        uv.select_chans(None)
+        self.assertEqual(uv.nchan, 4)
+        (uvw,t,bl),d,f = uv.read(raw=True)
+        self.assertTrue(np.all(d == recs[0][3]))
+        self.assertRaises(ValueError, uv.select_chans, [-1,2])
+        self.assertRaises(ValueError, uv.select_chans, [2,4])
+        self.assertRaises(ValueError, uv.select_chans, [])
+    def tearDown(self):
+        os.system("rm -rf %s" % self.tmppath)
+
 class TestSuite(unittest.TestSuite):
     """A unittest.TestSuite class which contains all of the aipy.miriad unit tests."""
 
@@ -59,6 +452,7 @@ class TestSuite(unittest.TestSuite):
 
         loader = unittest.TestLoader()
         self.addTests(loader.loadTestsFromTestCase(TestMiriadUV))
+        self.addTests(loader.loadTestsFromTestCase(TestMiriadUVMany))
 
 if __name__ == '__main__':
     unittest.main()
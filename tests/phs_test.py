@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import unittest, ephem, random
+import unittest, ephem, random, threading
 import aipy as a, numpy as n
 
 class TestPointingError(unittest.TestCase):
@@ -28,6 +28,46 @@ class TestJulDates(unittest.TestCase):
             d2 = a.phs.juldate2ephem(a.phs.ephem2juldate(d1))
             self.assertAlmostEqual(d1, d2)
 
+class TestLRUCache(unittest.TestCase):
+    def test_size(self):
+        """Test that an LRUCache evicts its least recently used entry"""
+        cache = a.phs.LRUCache(size=2)
+        for key in [1, 2, 1, 3]: cache.get(key, lambda k: 10*k, key)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(1 in cache and 3 in cache and not 2 in cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+    def test_maxbytes(self):
+        """Test that an LRUCache holds at most maxbytes of arrays"""
+        cache = a.phs.LRUCache(maxbytes=3*800)
+        for key in range(5):
+            cache.get(key, n.zeros, 100)
+            self.assertTrue(cache.nbytes <= 3*800)
+        self.assertEqual(len(cache), 3)
+        cache.get('pair', lambda: (n.zeros(100), n.zeros(100)))
+        self.assertEqual((len(cache), cache.nbytes), (2, 3*800))
+        self.assertTrue(4 in cache)
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes, cache.misses), (0, 0, 0))
+    def test_threads(self):
+        """Test that threads missing the same key share one LRUCache entry"""
+        cache, nthreads = a.phs.LRUCache(), 4
+        started, all_started = [], threading.Event()
+        def func():
+            # Hold every thread in func until all have missed the key
+            started.append(1)
+            if len(started) == nthreads: all_started.set()
+            all_started.wait(10)
+            return n.zeros(1000)
+        vals = [None] * nthreads
+        def get(i): vals[i] = cache.get('k', func)
+        threads = [threading.Thread(target=get, args=(i,))
+            for i in range(nthreads)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual((len(cache), cache.nbytes, cache.misses),
+            (1, 8000, nthreads))
+        for v in vals: self.assertTrue(v is vals[0])
+
 class TestRadioBody(unittest.TestCase):
     def test_attributes(self):
         """Test aipy.phs.RadioFixedBody attributes"""
@@ -140,6 +180,39 @@ class TestSrcCatalog(unittest.TestCase):
         self.assertTrue(n.all(crd1[:,0] == self.srcs[0].get_crds('eq')))
         crd2 = self.cat.get_crds('top', srcs=['src1','src2'])
         self.assertEqual(crd2.shape, (3,2))
+    def test_set_memo(self):
+        """Test memoizing geometry in a aipy.phs.SrcCatalog() catalog"""
+        o = a.phs.ArrayLocation(('0','0'))
+        o.set_jultime(2454555.)
+        self.cat.compute(o)
+        crd0 = self.cat.get_crds('eq', srcs=[s.src_name for s in self.srcs])
+        maps0 = [s.map for s in self.srcs]
+        self.cat.set_memo(size=100)
+        memo = self.cat._memo
+        names = [s.src_name for s in self.srcs]
+        for i in range(2):
+            self.cat.compute(o)
+            crd = self.cat.get_crds('eq', srcs=names)
+            self.assertTrue(n.all(crd == crd0))
+            for s,m in zip(self.srcs, maps0): self.assertTrue(n.all(s.map == m))
+        self.assertEqual(memo.misses, 6)
+        self.assertEqual(memo.hits, 6)
+        # Only the source that moved is recomputed
+        self.srcs[0]._ra = '1:30'
+        self.cat.compute(o)
+        crd = self.cat.get_crds('eq', srcs=names)
+        self.assertEqual(memo.misses, 8)
+        self.assertNotEqual(crd[0,0], crd0[0,0])
+        self.assertTrue(n.all(crd[:,1:] == crd0[:,1:]))
+        # Returned coordinates don't alias the memo
+        crd = self.srcs[1].get_crds('eq')
+        crd[:] = 0
+        self.assertTrue(n.all(self.srcs[1].get_crds('eq') == crd0[:,1]))
+        src4 = a.phs.RadioFixedBody('4:00', '4:00', name='src4')
+        self.cat.add_srcs(src4)
+        self.assertTrue(src4._memo is memo)
+        self.cat.set_memo(0)
+        for s in self.cat.values(): self.assertEqual(s._memo, None)
     def test_get(self):
         """Test retrieving source attributes from a aipy.phs.SrcCatalog() catalog"""
         mfreq = self.cat.get('mfreq',srcs=['src1'])
@@ -212,6 +285,24 @@ class TestArrayLocation(unittest.TestCase):
     def test_get_jultime(self):
         self.aa.set_jultime(2454555)
         self.assertEqual(self.aa.get_jultime(), 2454555)
+    def test_set_memo(self):
+        times = [2454555., 2454555.1, 2454555.2]
+        eq2now = []
+        for t in times:
+            self.aa.set_jultime(t)
+            eq2now.append(self.aa._eq2now)
+        self.aa.set_memo(size=2)
+        for i in range(2):
+            for t,m in zip(times[:2], eq2now):
+                self.aa.set_jultime(t)
+                self.assertTrue(n.all(self.aa._eq2now == m))
+        self.assertEqual(self.aa._memo.misses, 2)
+        self.assertEqual(self.aa._memo.hits, 2)
+        self.aa.set_jultime(times[2])
+        self.assertTrue(n.all(self.aa._eq2now == eq2now[2]))
+        self.assertEqual(len(self.aa._memo), 2)
+        self.assertFalse(('eq2now', float(self.aa.get_lsts(times[:1])[0]),
+            float(self.aa.lat)) in self.aa._memo)
 
 class TestAntennaArray(unittest.TestCase):
     def setUp(self):
@@ -312,6 +403,32 @@ class TestAntennaArray(unittest.TestCase):
             resolve_src=True)
         self.assertTrue(n.all(phs1 != 1+0j))
         self.assertTrue(n.all(phs2 != 1+0j))
+    def test_gen_ant_phs(self):
+        self.aa.select_chans([1,2,3])
+        afreqs = self.aa[0].beam.afreqs
+        self.aa.set_jultime(2454555.)
+        src = a.phs.RadioFixedBody('0:00', '20:00')
+        src.compute(self.aa)
+        seq = n.array([src.get_crds('eq', ncrd=3)]*2).transpose()
+        ionref = (n.array([.001,0]), n.array([0,.002]))
+        phs = self.aa.gen_ant_phs(seq, mfreq=.1, ionref=ionref)
+        self.assertEqual(phs.shape, (4,2,3))
+        for i in range(4):
+            for j in range(4):
+                u,v,w = self.aa.gen_uvw(i,j,seq)
+                w += self.aa.refract(u, v, mfreq=.1, ionref=ionref)
+                o = self.aa.get_phs_offset(i,j)
+                ans = n.exp(-1j*2*n.pi*(w + o))
+                self.assertTrue(n.allclose(phs[j]*n.conj(phs[i]), ans))
+        self.assertTrue(self.aa.gen_ant_phs(seq, mfreq=.1, ionref=ionref) 
+            is phs)
+        self.aa.ants[1]._phsoff = [0,.25]
+        self.aa.update()
+        phs2 = self.aa.gen_ant_phs(seq, mfreq=.1, ionref=ionref)
+        self.assertFalse(n.allclose(phs2[1], phs[1]))
+        self.aa.set_jultime(2454555.1)
+        self.assertFalse(self.aa.gen_ant_phs(seq, mfreq=.1, ionref=ionref)
+            is phs2)
     def test_resolve_src(self):
         amp = self.aa.resolve_src(100., 100., srcshape=(0,0,0))
         self.assertEqual(amp, 1)
@@ -374,6 +491,7 @@ class TestSuite(unittest.TestSuite):
         loader = unittest.TestLoader()
         self.addTests(loader.loadTestsFromTestCase(TestPointingError))
         self.addTests(loader.loadTestsFromTestCase(TestJulDates))
+        self.addTests(loader.loadTestsFromTestCase(TestLRUCache))
         self.addTests(loader.loadTestsFromTestCase(TestRadioBody))
         self.addTests(loader.loadTestsFromTestCase(TestSrcCatalog))
         self.addTests(loader.loadTestsFromTestCase(TestBeam))
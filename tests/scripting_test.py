@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import unittest, aipy as a, numpy as n, re
+import unittest, aipy as a, numpy as n, re, tempfile, os, sys, StringIO
 from aipy.miriad import ij2bl
 
 class TestParseAnts(unittest.TestCase):
@@ -141,6 +141,86 @@ class TestParsePrms(unittest.TestCase):
         prms = a.scripting.parse_prms('a=(b/c)')
         self.assertEqual(len(prms['a']), 2)
 
+class TestUVSelector(unittest.TestCase):
+    'Tests aipy.scripting.uv_selector()'
+    def setUp(self):
+        self.tmppath = tempfile.mkdtemp(prefix='scripting-test-', suffix='.tmp')
+        self.filename = os.path.join(self.tmppath, 'test.uv')
+        uv = a.miriad.UV(self.filename, status='new')
+        uv['history'] = 'Made this file from scratch.\n'
+        uv.add_var('nchan', 'i')
+        uv.add_var('nants', 'i')
+        uv.add_var('pol', 'i')
+        uv['nchan'] = 2
+        uv['nants'] = 4
+        uvw = n.zeros(3, dtype=n.double)
+        data = n.ma.array(n.ones(2, dtype=n.complex64), mask=[0,0])
+        for t in [2454555.5, 2454555.6]:
+            for pol in ['xx','yy']:
+                uv['pol'] = a.miriad.str2pol[pol]
+                for i in range(4):
+                    for j in range(i,4): uv.write((uvw,t,(i,j)), data)
+        del(uv)
+    def read(self, uv):
+        return [(p[2], uv['pol']) for p,d in uv.all()]
+    def testselect(self):
+        """Test aipy.scripting.uv_selector() against Miriad selection"""
+        cases = [('all',-1), ('auto',-1), ('cross',-1), ('0_1',-1),
+            ('0_1,1_2','xx'), ('(0,1)_(2,3)',-1), ('0_(1,-2)',-1), ('2',-1),
+            ('-2','yy'), ('cross,-0','xx,yy'), ('auto,0_3',-1), ('all','yy')]
+        for ant_str,pol_str in cases:
+            # Reference selection using a uv.select clause per baseline
+            uv = a.miriad.UV(self.filename)
+            for bl,include,pol in a.scripting.parse_ants(ant_str, 4):
+                if bl == 'auto': uv.select('auto', 0, 0, include=include)
+                else:
+                    i,j = a.miriad.bl2ij(bl)
+                    uv.select('antennae', i, j, include=include)
+            if pol_str != -1:
+                for pol in pol_str.split(','):
+                    uv.select('polarization', a.miriad.str2pol[pol], 0)
+            ans = self.read(uv)
+            uv = a.miriad.UV(self.filename)
+            a.scripting.uv_selector(uv, ant_str, pol_str)
+            self.assertEqual(self.read(uv), ans, (ant_str, pol_str))
+        uv = a.miriad.UV(self.filename)
+        self.assertRaises(ValueError, a.scripting.uv_selector, uv, 'all', 'zz')
+    def tearDown(self):
+        os.system("rm -rf %s" % self.tmppath)
+
+class TestProcessFiles(unittest.TestCase):
+    def run_files(self, func, filenames, nproc):
+        stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+        try:
+            try: a.scripting.process_files(func, filenames, nproc=nproc)
+            except(RuntimeError), e: err = e
+            else: err = None
+            return sys.stdout.getvalue(), err
+        finally: sys.stdout = stdout
+    def test_process_files(self):
+        """Test aipy.scripting.process_files()"""
+        def func(filename):
+            if filename == 'bad': raise ValueError('bad file')
+            print filename, '->', filename+'m'
+            print 'done'
+        files = ['f%d' % i for i in range(8)]
+        out, err = self.run_files(func, files, 1)
+        self.assertEqual(err, None)
+        self.assertEqual(out, ''.join(['%s -> %sm\ndone\n' % (f,f)
+            for f in files]))
+        out, err = self.run_files(func, files, 3)
+        self.assertEqual(err, None)
+        self.assertEqual(out, ''.join(['[%s] %s -> %sm\n[%s] done\n' % \
+            (f,f,f,f) for f in files]))
+        out, err = self.run_files(func, files[:2] + ['bad'] + files[2:], 3)
+        self.assertTrue(isinstance(err, RuntimeError))
+        self.assertTrue(str(err).endswith(': bad'))
+        lines = out.splitlines()
+        self.assertEqual(lines[:4], ['[f0] f0 -> f0m', '[f0] done',
+            '[f1] f1 -> f1m', '[f1] done'])
+        self.assertTrue(lines[4].startswith('[bad] Traceback'))
+        self.assertEqual(lines[-1], '[f7] done')
+
 class TestSuite(unittest.TestSuite):
     """A unittest.TestSuite class which contains all of the aipy.coord unit tests."""
 
@@ -152,6 +232,8 @@ class TestSuite(unittest.TestSuite):
         self.addTests(loader.loadTestsFromTestCase(TestParseSrcs))
         self.addTests(loader.loadTestsFromTestCase(TestParseChans))
         self.addTests(loader.loadTestsFromTestCase(TestParsePrms))
+        self.addTests(loader.loadTestsFromTestCase(TestUVSelector))
+        self.addTests(loader.loadTestsFromTestCase(TestProcessFiles))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Tests that the C extensions release the GIL during their computation, so
+that Python threads can run alongside them, and that calls made
+concurrently from several threads give the same results as serial calls."""
+
+import unittest, threading, tempfile, shutil, os, time
+import aipy as a, numpy as n
+import aipy._deconv as _deconv, aipy._dsp as _dsp
+
+def stalled_fraction(func):
+    """Time func() serially, then run it in a thread and return the longest
+    time for which this thread could not run Python meanwhile, as a fraction
+    of the serial time.  This is near 1 if func holds the GIL throughout."""
+    t0 = time.time(); func(); duration = time.time() - t0
+    started = threading.Event()
+    def target():
+        started.set()
+        func()
+    t = threading.Thread(target=target)
+    last = time.time(); stall = 0
+    t.start()
+    started.wait()
+    while t.isAlive():
+        now = time.time()
+        stall = max(stall, now - last)
+        last = now
+    t.join()
+    stall = max(stall, time.time() - last)
+    return stall / duration
+
+def in_threads(funcs):
+    """Call each of funcs in its own thread and return their results."""
+    rv = [None] * len(funcs)
+    def target(i): rv[i] = funcs[i]()
+    threads = [threading.Thread(target=target, args=(i,))
+        for i in range(len(funcs))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return rv
+
+class TestGIL(unittest.TestCase):
+    def setUp(self):
+        rs = n.random.RandomState(0)
+        self.ker = n.zeros((128,128)); self.ker[0,0] = 1
+        self.ker[0,1] = self.ker[1,0] = self.ker[0,-1] = self.ker[-1,0] = .3
+        mdl = n.zeros((128,128))
+        for i in range(10):
+            mdl[rs.randint(128),rs.randint(128)] = rs.uniform(1,10)
+        self.im = n.fft.ifft2(n.fft.fft2(mdl) * n.fft.fft2(self.ker)).real
+        self.ind1 = rs.uniform(0, 256, size=200000).astype(n.float32)
+        self.ind2 = rs.uniform(0, 256, size=200000).astype(n.float32)
+        self.dat = rs.normal(size=200000).astype(n.complex64)
+    def clean(self):
+        res, mdl = self.im.copy(), n.zeros_like(self.im)
+        area = n.ones(self.im.shape, dtype=n.int)
+        _deconv.clean(res, self.ker, mdl, area, tol=1e-9, maxiter=500)
+        return res, mdl
+    def test_clean(self):
+        """Test that aipy._deconv.clean releases the GIL"""
+        self.assertTrue(stalled_fraction(self.clean) < .5)
+        res, mdl = self.clean()
+        for r,m in in_threads([self.clean] * 4):
+            self.assertTrue(n.all(r == res))
+            self.assertTrue(n.all(m == mdl))
+    def grid(self):
+        buf = n.zeros((256,256), dtype=n.complex64)
+        _dsp.grid2D_c(buf, self.ind1, self.ind2, self.dat)
+        return buf
+    def test_grid(self):
+        """Test that aipy._dsp.grid2D_c and degrid2D_c release the GIL"""
+        self.assertTrue(stalled_fraction(self.grid) < .5)
+        buf = self.grid()
+        def degrid():
+            dat = n.zeros_like(self.dat)
+            _dsp.degrid2D_c(buf, self.ind1, self.ind2, dat)
+            return dat
+        self.assertTrue(stalled_fraction(degrid) < .5)
+        dat = degrid()
+        for rv in in_threads([self.grid] * 4): self.assertTrue(n.all(rv == buf))
+        for rv in in_threads([degrid] * 4): self.assertTrue(n.all(rv == dat))
+    def test_add2array(self):
+        """Test that aipy.utils.add2array releases the GIL"""
+        ind = n.array([self.ind1, self.ind2]).astype(n.int).transpose()
+        ind = ind.repeat(20, axis=0)
+        dat = self.dat.repeat(20)
+        def func():
+            buf = n.zeros((256,256), dtype=n.complex64)
+            a.utils.add2array(buf, ind, dat)
+            return buf
+        self.assertTrue(stalled_fraction(func) < .5)
+        buf = func()
+        for rv in in_threads([func] * 4): self.assertTrue(n.all(rv == buf))
+    def test_healpix(self):
+        """Test that the aipy._healpix transforms release the GIL"""
+        h = a.healpix.HealpixBase(nside=512)
+        px = n.arange(h.npix())
+        x,y,z = h.px2crd(px)
+        def func(): return h.crd2px(x, y, z, interpolate=True)
+        self.assertTrue(stalled_fraction(func) < .5)
+        self.assertTrue(stalled_fraction(lambda: h.px2crd(px)) < .5)
+        pxs, wgts = func()
+        for p,w in in_threads([func] * 4):
+            self.assertTrue(n.all(p == pxs))
+            self.assertTrue(n.all(w == wgts))
+        alm = a.healpix.Alm(256, 256)
+        alm[0,0] = 1.
+        def func(): return alm.to_map(128, 'RING')
+        self.assertTrue(stalled_fraction(func) < .5)
+        m = func()
+        for rv in in_threads([func] * 4): self.assertTrue(n.all(rv == m))
+
+class TestMiriadGIL(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        nrec, nchan = 20000, 256
+        self.p = n.zeros((nrec,5))
+        self.p[:,3] = 2455400. + n.arange(nrec) / 86400.
+        self.p[:,4] = 258
+        self.d = n.ones((nrec,nchan), dtype=n.complex64)
+        self.f = n.zeros((nrec,nchan), dtype=n.bool)
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    def write(self, name):
+        filename = os.path.join(self.dir, name)
+        uv = a.miriad.UV(filename, status='new')
+        uv.add_var('telescop','a'); uv['telescop'] = 'AIPY'
+        uv.add_var('pol','i'); uv['pol'] = -5
+        uv.add_var('nchan','i'); uv['nchan'] = self.d.shape[1]
+        uv.write_many(self.p, self.d, self.f)
+        del(uv)
+        return filename
+    def test_write(self):
+        """Test that aipy.miriad.UV.write_many releases the GIL"""
+        files = iter(['0.uv', '1.uv'])
+        self.assertTrue(stalled_fraction(lambda: self.write(files.next())) < .5)
+        for filename in in_threads([lambda: self.write('a.uv'),
+                lambda: self.write('b.uv')]) + [self.write('c.uv')]:
+            uv = a.miriad.UV(filename)
+            p, d, f = uv.read_many(2*self.p.shape[0])
+            self.assertTrue(n.all(p == self.p))
+            self.assertTrue(n.all(d == self.d))
+
+class TestSuite(unittest.TestSuite):
+    """A unittest.TestSuite class which contains the tests of GIL release by
+    the C extensions."""
+
+    def __init__(self):
+        unittest.TestSuite.__init__(self)
+
+        loader = unittest.TestLoader()
+        self.addTests(loader.loadTestsFromTestCase(TestGIL))
+        self.addTests(loader.loadTestsFromTestCase(TestMiriadGIL))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import tempfile
+import unittest, numpy as np, os
+import aipy.miriad as m, aipy.uvcube as uvcube
+
+class TestUVCube(unittest.TestCase):
+    def setUp(self):
+        self.tmppath = tempfile.mkdtemp(prefix='uvcube-test-', suffix='.tmp')
+        self.filename = os.path.join(self.tmppath, 'test.uv')
+        uv = m.UV(self.filename, status='new', corrmode='r')
+        uv['history'] = 'Made this file from scratch.\n'
+        uv.add_var('nchan', 'i')
+        uv.add_var('pol', 'i')
+        uv.add_var('sfreq', 'd')
+        uv.add_var('sdf', 'd')
+        uv['nchan'] = 4
+        uv['sfreq'] = .1
+        uv['sdf'] = .01
+        self.times = [2454555.5, 2454555.6, 2454555.7]
+        self.recs = []
+        cnt = 0
+        for t in self.times:
+            for pol in [-5, -6]:
+                uv['pol'] = pol
+                for bl in [(0,0), (0,1), (1,2)]:
+                    # Baseline (1,2) is missing at the second time
+                    if bl == (1,2) and t == self.times[1]: continue
+                    uvw = np.array([cnt,2*cnt,3*cnt], dtype=np.double)
+                    d = np.arange(4, dtype=np.complex64) * (1+1j) + cnt
+                    mask = np.array([cnt%2,0,cnt%3 == 0,1])
+                    uv.write((uvw,t,bl), np.ma.array(d, mask=mask))
+                    self.recs.append((bl + (pol,), t, uvw, d, mask))
+                    cnt += 1
+        del(uv)
+    def tearDown(self):
+        os.system("rm -rf %s" % self.tmppath)
+    def test_export(self):
+        """Test exporting a Miriad UV file to a cube and loading it"""
+        uv = m.UV(self.filename)
+        dirname = os.path.join(self.tmppath, 'test.cube')
+        cube = uv.to_cube(dirname, blocksize=4)
+        self.assertEqual(cube.keys.shape, (6,3))
+        self.assertTrue(np.all(cube.times == self.times))
+        self.assertTrue(np.allclose(cube.freqs, [.1,.11,.12,.13]))
+        self.assertEqual(cube.data.shape, (6,3,4))
+        cube = uvcube.UVCube(dirname)
+        self.assertTrue(isinstance(cube.data, np.memmap))
+        for key,t,uvw,d,mask in self.recs:
+            ti = self.times.index(t)
+            _uvw, _d, _f = cube.get(*key)
+            self.assertTrue(np.all(_uvw[ti] == uvw))
+            self.assertTrue(np.all(_d[ti] == d))
+            self.assertTrue(np.all(_f[ti] == mask))
+        d = cube.get_masked(2, 1, -6)
+        self.assertTrue(np.all(d.mask[1]))
+        self.assertTrue(np.all(d.data[1] == 0))
+        self.assertRaises(KeyError, cube.get, 0, 2, -5)
+        self.assertRaises(ValueError, cube.data.__setitem__, 0, 1)
+        # Selections apply to the cube
+        uv.select('antennae', 0, 1)
+        uv.select_chans([3,1])
+        cube = uv.to_cube(os.path.join(self.tmppath, 'test2.cube'))
+        self.assertEqual(cube.keys.tolist(), [[0,1,-6],[0,1,-5]])
+        self.assertTrue(np.allclose(cube.freqs, [.13,.11]))
+        for key,t,uvw,d,mask in self.recs:
+            if key[:2] != (0,1): continue
+            _uvw, _d, _f = cube.get(*key)
+            self.assertTrue(np.all(_d[self.times.index(t)] == d[[3,1]]))
+
+class TestSuite(unittest.TestSuite):
+    """A unittest.TestSuite class which contains all of the aipy.uvcube unit tests."""
+
+    def __init__(self):
+        unittest.TestSuite.__init__(self)
+
+        loader = unittest.TestLoader()
+        self.addTests(loader.loadTestsFromTestCase(TestUVCube))
+
+if __name__ == '__main__':
+    unittest.main()